@@ -1,13 +1,62 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
 from flask_cors import CORS
 import logging
 import threading
 import time
 import os
 from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
 import requests
 import json
 import urllib3
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from backtest import DEFAULT_HORIZONS, parse_horizons, run_backtest
+from conditional_fetch import CombinedSnapshot, ConditionalSnapshot
+from deadline import Deadline, DeadlineExceeded, current_deadline, deadline_scope
+from history_providers import (
+    ApiHubProvider,
+    LocalStoreProvider,
+    ProviderRegistry,
+    ProviderUnavailableError,
+    SimulatedProvider,
+    YahooChartProvider,
+    is_synthetic_history,
+)
+from history_store import HistoryStore, format_trade_date, normalize_trade_date
+from indicator_pool import IndicatorPool
+from market_snapshot import MarketSnapshot
+from rate_limiter import THROTTLED, AdaptiveRateLimiter, RateLimitedError, classify_status, parse_retry_after
+from result_cache import ResultCache
+from screen_jobs import JobCancelled, ScreenJobManager
+from shared_snapshot import (
+    SharedSnapshotReader,
+    default_snapshot_path,
+    publish_snapshot,
+    publisher_lock,
+    snapshot_signature,
+)
+from refresh_scheduler import RefreshScheduler, parse_offsets
+from signal_prefilter import SignalPrefilter
+from single_flight import SingleFlight
+from trading_calendar import load_trading_calendar
+from warm_start import DEFAULT_WARM_START_PATH, load_warm_start, save_warm_start
+from yahoo_chart import (
+    MARKET_TPEX,
+    MARKET_TWSE,
+    get_chart_params,
+    get_chart_url,
+    register_stock_markets,
+)
+from parameter_sweep import build_param_sets, get_params_key, normalize_params, required_bars, sweep_histories
+from pine_indicators import (
+    MIN_BARS,
+    calculate_pine_script_indicators_batch,
+    calculate_pine_script_indicators_vectorized,
+    calculate_indicator_series,
+)
 
 # 台灣時區設定 (UTC+8)
 TAIWAN_TZ = timezone(timedelta(hours=8))
@@ -37,10 +86,110 @@ app = Flask(__name__)
 CORS(app)
 
 # 全域變數
-stocks_data = {}
+# 目前的市場快照（即時資料、更新時間、資料日期），更新時以單一指派整個替換；
+# 讀取端在請求開始時取得參考並一路使用同一版本
+market_snapshot = MarketSnapshot.empty()
 is_updating = False
-last_update_time = None
-data_date = None  # 資料日期
+history_store = HistoryStore()  # 本地歷史資料庫
+
+# 篩選時並行獲取歷史資料的執行緒數
+SCREEN_FETCH_WORKERS = int(os.environ.get('SCREEN_FETCH_WORKERS', 16))
+# 每累積多少支股票批次計算一次技術指標（同時也是進度回報的粒度）
+SCREEN_COMPUTE_CHUNK = int(os.environ.get('SCREEN_COMPUTE_CHUNK', 50))
+# 指標計算的行程數（0 表示在目前行程內計算）；I/O仍由執行緒負責，兩階段同時進行
+SCREEN_CPU_WORKERS = int(os.environ.get('SCREEN_CPU_WORKERS', 0))
+indicator_pool = IndicatorPool(SCREEN_CPU_WORKERS)
+# 每支股票歷史資料獲取（含限流等待與重試）的時間上限
+SCREEN_FETCH_TIMEOUT = int(os.environ.get('SCREEN_FETCH_TIMEOUT_MS', 10000)) / 1000
+
+# 指標參數識別字串，參數改變時快取鍵隨之改變
+INDICATOR_PARAMS_KEY = 'fund27-wsa5/3-x1.032|bull34-ema13|oversold25'
+
+# 個股分析結果與整體篩選結果的快取
+result_cache = ResultCache(max_stocks=int(os.environ.get('RESULT_CACHE_SIZE', 4096)),
+                           max_series=int(os.environ.get('SERIES_CACHE_SIZE', 512)))
+
+# 暖啟動檔：每次更新與篩選後寫入，worker啟動後第一次請求時讀回
+WARM_START_PATH = os.environ.get('WARM_START_PATH', DEFAULT_WARM_START_PATH)
+warm_start_loaded = False
+warm_start_lock = threading.Lock()
+
+# 多個worker共用的唯讀快照（mmap），更新的worker發布、其他worker在下一個請求時掛載
+SHARED_SNAPSHOT_PATH = os.environ.get('SHARED_SNAPSHOT_PATH', default_snapshot_path())
+shared_snapshot_reader = SharedSnapshotReader(SHARED_SNAPSHOT_PATH)
+
+# 篩選前置過濾：以前一交易日的指標狀態排除不可能出現黃柱的股票，不下載其歷史資料
+SCREEN_PREFILTER_ENABLED = os.environ.get('SCREEN_PREFILTER', '1') == '1'
+signal_prefilter = SignalPrefilter(
+    history_days=60,
+    path=os.environ.get('INDICATOR_STATE_PATH',
+                        os.path.join(os.path.dirname(os.path.abspath(WARM_START_PATH)), 'indicator_states.json'))
+)
+
+# 並行的相同請求只執行一次：快照更新、整體篩選、單一股票歷史資料、單一股票指標序列
+update_flight = SingleFlight()
+screen_flight = SingleFlight()
+history_flight = SingleFlight()
+series_flight = SingleFlight()
+
+# 背景工作的狀態寫入共用目錄（預設與共享快照同一處），任一worker都能查詢 /api/screen/<job_id>
+SCREEN_JOB_STATE_DIR = os.environ.get('SCREEN_JOB_STATE_DIR',
+                                      os.path.join(os.path.dirname(os.path.abspath(SHARED_SNAPSHOT_PATH)), 'tw_stock_jobs'))
+
+# 背景篩選工作（同一時間只執行一個篩選，保留最近20筆結果）
+screen_job_manager = ScreenJobManager(max_concurrent_jobs=1, max_history=20,
+                                      state_dir=os.path.join(SCREEN_JOB_STATE_DIR, 'screen'))
+# 參數掃描與回測等研究用工作另有自己的執行緒，不會佔住篩選與排程預先計算的名額
+research_job_manager = ScreenJobManager(max_concurrent_jobs=1, max_history=20, thread_name_prefix='research-job',
+                                        state_dir=os.path.join(SCREEN_JOB_STATE_DIR, 'research'))
+job_managers = (screen_job_manager, research_job_manager)
+
+def find_job(job_id):
+    """在所有工作管理器中找出工作，不存在時回傳None"""
+    for manager in job_managers:
+        job = manager.get(job_id)
+        if job is not None:
+            return job
+    return None
+
+def create_http_session(pool_size):
+    """建立共用的keep-alive連線池，所有對外請求共用同一組連線"""
+    session = requests.Session()
+    session.headers.update({
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    })
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+http_session = create_http_session(SCREEN_FETCH_WORKERS)
+
+# Yahoo chart 請求共用的自適應並行控制（threads 與 async 後端共用），
+# SCREEN_FETCH_WORKERS / ASYNC_CONNECTIONS_PER_HOST 只是上限，實際並行度由上游回應決定
+yahoo_rate_limiter = AdaptiveRateLimiter(
+    initial_concurrency=int(os.environ.get('YAHOO_INITIAL_CONCURRENCY', 4)),
+    max_concurrency=int(os.environ.get('YAHOO_MAX_CONCURRENCY', 64))
+)
+YAHOO_MAX_RETRIES = int(os.environ.get('YAHOO_MAX_RETRIES', 2))
+
+# 資料獲取後端：'threads'（requests + 執行緒池）或 'async'（asyncio + aiohttp單一事件迴圈）
+DATA_FETCH_BACKEND = os.environ.get('DATA_FETCH_BACKEND', 'threads')
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('ASYNC_MAX_CONNECTIONS', 200))
+ASYNC_CONNECTIONS_PER_HOST = int(os.environ.get('ASYNC_CONNECTIONS_PER_HOST', 32))
+async_client = None
+async_client_lock = threading.Lock()
+
+def get_async_client():
+    """延遲建立非同步資料客戶端（gunicorn preload後每個worker各自建立事件迴圈）"""
+    global async_client
+    with async_client_lock:
+        if async_client is None:
+            from async_fetcher import AsyncDataClient
+            async_client = AsyncDataClient(total_limit=ASYNC_MAX_CONNECTIONS,
+                                           per_host_limit=ASYNC_CONNECTIONS_PER_HOST,
+                                           rate_limiter=yahoo_rate_limiter)
+        return async_client
 
 def format_volume(volume):
     """格式化成交張數顯示（1張=1000股）"""
@@ -134,267 +283,313 @@ def get_stock_name_by_code(stock_code):
             return stock['stock_name']
     return f"股票{stock_code}"
 
+# 交易日曆（內建休市表，臨時休市寫入 TRADING_CALENDAR_FILE）
+trading_calendar = load_trading_calendar()
+
 def get_latest_trading_date():
-    """獲取最近的交易日期（排除週末，基於台灣時間）"""
-    today = get_taiwan_time()
-    
-    # 如果是週六(5)或週日(6)，回推到週五
-    if today.weekday() == 5:  # 週六
-        trading_date = today - timedelta(days=1)  # 週五
-    elif today.weekday() == 6:  # 週日
-        trading_date = today - timedelta(days=2)  # 週五
-    else:
-        # 平日，使用前一個交易日
-        trading_date = today - timedelta(days=1)
-    
-    return trading_date.strftime('%Y%m%d')
+    """獲取資料已公布的最近交易日期（排除週末、休市日，基於台灣時間）"""
+    return trading_calendar.latest_complete_session(get_taiwan_time()).strftime('%Y%m%d')
 
-def fetch_real_stock_data():
-    """從台灣證券交易所API獲取真實股票資料（全部股票）"""
-    try:
-        # 台灣證券交易所OpenAPI
-        url = "https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_ALL"
-        
-        logger.info(f"正在從證交所API獲取股票資料: {url}")
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=30, verify=False)
-        response.raise_for_status()
-        
-        data = response.json()
-        logger.info(f"成功獲取證交所資料，共 {len(data)} 筆記錄")
-        
-        # 處理資料格式（處理所有股票）
-        processed_data = {}
-        valid_stocks = 0
-        
-        for item in data:
-            stock_code = item.get('Code', '').strip()
-            stock_name = item.get('Name', '').strip()
+def get_snapshot_data_date(stocks):
+    """快照實際的K棒日期（YYYYMMDD），取不到時以交易日曆推算"""
+    dates = {normalize_trade_date(data['date']) for data in stocks.values()}
+    dates.discard(None)
+    return str(max(dates)) if dates else get_latest_trading_date()
+
+# 上市（證交所）與上櫃（櫃買中心）OpenAPI全市場日成交資訊，各自保留驗證資訊供條件式下載
+twse_snapshot = ConditionalSnapshot("https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_ALL")
+tpex_snapshot = ConditionalSnapshot("https://www.tpex.org.tw/openapi/v1/tpex_mainboard_daily_close_quotes")
+# 兩個市場都未更新時沿用同一個合併快照物件
+market_quotes = CombinedSnapshot()
+
+# 各市場回應的欄位名稱
+TWSE_QUOTE_FIELDS = {
+    'code': 'Code', 'name': 'Name', 'open': 'OpeningPrice', 'high': 'HighestPrice', 'low': 'LowestPrice',
+    'close': 'ClosingPrice', 'volume': 'TradeVolume', 'change': 'Change', 'date': 'Date'
+}
+TPEX_QUOTE_FIELDS = {
+    'code': 'SecuritiesCompanyCode', 'name': 'CompanyName', 'open': 'Open', 'high': 'High', 'low': 'Low',
+    'close': 'Close', 'volume': 'TradingShares', 'change': 'Change', 'date': 'Date'
+}
+
+def parse_market_quotes(data, fields, market):
+    """將OpenAPI的日成交資訊轉為 {股票代碼: 即時資料}，只保留一般股票（代碼1000-9999）"""
+    processed_data = {}
+    
+    for item in data:
+        stock_code = str(item.get(fields['code'], '')).strip()
+        stock_name = str(item.get(fields['name'], '')).strip()
+        
+        # 過濾條件：只處理一般股票（代碼1000-9999）
+        if (stock_code and 
+            len(stock_code) == 4 and 
+            stock_code.isdigit() and
+            1000 <= int(stock_code) <= 9999 and  # 限制為一般股票代碼範圍
+            stock_name and
+            not any(keyword in stock_name for keyword in ['DR', 'TDR', 'ETF', 'ETN', '權證', '特別股', '存託憑證'])):
             
-            # 過濾條件：只處理上市股票（代碼1000-9999）
-            if (stock_code and 
-                len(stock_code) == 4 and 
-                stock_code.isdigit() and
-                1000 <= int(stock_code) <= 9999 and  # 限制為上市股票代碼範圍
-                stock_name and
-                not any(keyword in stock_name for keyword in ['DR', 'TDR', 'ETF', 'ETN', '權證', '特別股', '存託憑證'])):
+            try:
+                # 解析數值，處理可能的逗號分隔符與空白
+                opening_price = float(str(item.get(fields['open'], '0')).replace(',', '').strip())
+                highest_price = float(str(item.get(fields['high'], '0')).replace(',', '').strip())
+                lowest_price = float(str(item.get(fields['low'], '0')).replace(',', '').strip())
+                closing_price = float(str(item.get(fields['close'], '0')).replace(',', '').strip())
+                trade_volume = int(float(str(item.get(fields['volume'], '0')).replace(',', '').strip()))
                 
-                try:
-                    # 解析數值，處理可能的逗號分隔符
-                    opening_price = float(item.get('OpeningPrice', '0').replace(',', ''))
-                    highest_price = float(item.get('HighestPrice', '0').replace(',', ''))
-                    lowest_price = float(item.get('LowestPrice', '0').replace(',', ''))
-                    closing_price = float(item.get('ClosingPrice', '0').replace(',', ''))
-                    trade_volume = int(item.get('TradeVolume', '0').replace(',', ''))
+                # 過濾無效資料
+                if closing_price > 0 and trade_volume > 0:
+                    # 計算漲跌幅
+                    change_str = str(item.get(fields['change'], '0')).replace(',', '').strip()
+                    if change_str.startswith('+'):
+                        change = float(change_str[1:])
+                    elif change_str.startswith('-'):
+                        change = -float(change_str[1:])
+                    else:
+                        change = float(change_str) if change_str else 0
                     
-                    # 過濾無效資料
-                    if closing_price > 0 and trade_volume > 0:
-                        # 計算漲跌幅
-                        change_str = item.get('Change', '0').replace(',', '')
-                        if change_str.startswith('+'):
-                            change = float(change_str[1:])
-                        elif change_str.startswith('-'):
-                            change = -float(change_str[1:])
-                        else:
-                            change = float(change_str) if change_str else 0
-                        
-                        change_percent = (change / (closing_price - change)) * 100 if (closing_price - change) != 0 else 0
-                        
-                        processed_data[stock_code] = {
-                            'name': stock_name,
-                            'open': opening_price,
-                            'high': highest_price,
-                            'low': lowest_price,
-                            'close': closing_price,
-                            'volume': trade_volume,
-                            'change': change,
-                            'change_percent': change_percent,
-                            'date': item.get('Date', get_latest_trading_date())
-                        }
-                        valid_stocks += 1
-                        
-                except (ValueError, TypeError) as e:
-                    logger.warning(f"處理股票 {stock_code} 資料時發生錯誤: {e}")
-                    continue
+                    change_percent = (change / (closing_price - change)) * 100 if (closing_price - change) != 0 else 0
+                    
+                    processed_data[stock_code] = {
+                        'name': stock_name,
+                        'market': market,
+                        'open': opening_price,
+                        'high': highest_price,
+                        'low': lowest_price,
+                        'close': closing_price,
+                        'volume': trade_volume,
+                        'change': change,
+                        'change_percent': change_percent,
+                        'date': item.get(fields['date'], get_latest_trading_date())
+                    }
+                    
+            except (ValueError, TypeError) as e:
+                logger.debug(f"略過 {market} 股票 {stock_code}（無成交或格式不符）: {e}")
+                continue
+    
+    return processed_data
+
+def fetch_market_quotes(snapshot, fields, market):
+    """條件式下載單一市場的日成交資訊
+    
+    上游尚未發布新資料（304或內容雜湊相同）時直接回傳上次解析的同一個物件；失敗時回傳None。
+    """
+    try:
+        url = snapshot.url
         
-        logger.info(f"成功處理 {valid_stocks} 支有效股票資料")
+        logger.info(f"正在從 {market} API獲取股票資料: {url}")
+        
+        headers = snapshot.request_headers()
+        if DATA_FETCH_BACKEND == 'async':
+            status_code, response_headers, body = get_async_client().get_bytes_sync(url, headers=headers, timeout=30)
+        else:
+            response = http_session.get(url, headers=headers, timeout=30, verify=False)
+            if response.status_code != 304:
+                response.raise_for_status()
+            status_code, response_headers, body = response.status_code, response.headers, response.content
+        
+        unchanged = snapshot.unchanged_data(status_code, body)
+        if unchanged is not None:
+            logger.info(f"{market} 資料未更新（HTTP {status_code}），沿用上次快照")
+            return unchanged
+        
+        data = json.loads(body)
+        logger.info(f"成功獲取 {market} 資料，共 {len(data)} 筆記錄")
+        
+        processed_data = MappingProxyType(parse_market_quotes(data, fields, market))  # 快照發布後不可修改
+        logger.info(f"成功處理 {len(processed_data)} 支 {market} 有效股票資料")
+        snapshot.commit(response_headers, body, processed_data)
         return processed_data
         
     except requests.exceptions.RequestException as e:
-        logger.error(f"獲取證交所資料失敗: {e}")
+        logger.error(f"獲取 {market} 資料失敗: {e}")
         return None
     except json.JSONDecodeError as e:
-        logger.error(f"解析證交所資料失敗: {e}")
+        logger.error(f"解析 {market} 資料失敗: {e}")
         return None
     except Exception as e:
-        logger.error(f"處理證交所資料時發生未知錯誤: {e}")
+        logger.error(f"處理 {market} 資料時發生未知錯誤: {e}")
         return None
 
-def fetch_historical_data_for_indicators(stock_code, days=60):
-    """獲取歷史資料用於技術指標計算（增強版本，包含備用機制）"""
+def merge_market_quotes(parts):
+    merged = {}
+    for part in parts:
+        merged.update(part)
+    return MappingProxyType(merged)
+
+def fetch_real_stock_data():
+    """獲取上市與上櫃全部股票的真實資料
+    
+    兩個市場同時下載；都未更新時回傳上次的同一個快照物件。上櫃下載失敗時沿用上次的上櫃資料，
+    沒有上次資料時只回傳上市股票；上市下載失敗時回傳None。
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        twse_future = executor.submit(fetch_market_quotes, twse_snapshot, TWSE_QUOTE_FIELDS, MARKET_TWSE)
+        tpex_future = executor.submit(fetch_market_quotes, tpex_snapshot, TPEX_QUOTE_FIELDS, MARKET_TPEX)
+        twse_data, tpex_data = twse_future.result(), tpex_future.result()
     
-    # 方法1: 使用Manus API Hub的Yahoo Finance API
+    if not twse_data:
+        return None
+    if tpex_data is None:
+        tpex_data = tpex_snapshot.data
+        if tpex_data is None:
+            logger.warning("無法獲取上櫃股票資料，本次只包含上市股票")
+            tpex_data = MappingProxyType({})
+    
+    return market_quotes.combine((twse_data, tpex_data), merge_market_quotes)
+
+def get_tail_fetch_range(last_date, target_date=None):
+    """依本地資料的最後交易日到目標日之間缺少的交易日數決定需要補抓的Yahoo range參數"""
+    last = datetime.strptime(str(last_date), '%Y%m%d').date()
+    target = target_date or get_latest_trading_date()
+    missing_sessions = trading_calendar.count_sessions_between(last + timedelta(days=1), target)
+    if missing_sessions <= 4:
+        return '5d'
+    elif missing_sessions <= 19:
+        return '1mo'
+    elif missing_sessions <= 58:
+        return '3mo'
+    elif missing_sessions <= 118:
+        return '6mo'
+    return '1y'
+
+def get_history_fetch_range(stock_code, current_data=None):
+    """本地歷史資料已涵蓋快照日期（或之間沒有交易日）時回傳None，否則回傳需要補抓的Yahoo range參數"""
+    if history_store.bar_count(stock_code) < 34:
+        return '3mo'
+    
+    last_date = history_store.last_date(stock_code)
+    if current_data is None:
+        current_data = market_snapshot.stocks.get(stock_code)
+    target_date = normalize_trade_date(current_data['date']) if current_data else None
+    if target_date is None:
+        target_date = int(get_latest_trading_date())
+    if last_date >= target_date:
+        return None
+    # 中間只隔休市日（颱風假、連假）時沒有新的K棒可以下載
+    last = datetime.strptime(str(last_date), '%Y%m%d').date()
+    if not trading_calendar.count_sessions_between(last + timedelta(days=1), str(target_date)):
+        return None
+    return get_tail_fetch_range(last_date, str(target_date))
+
+def save_fetched_history(stock_code, ohlc_data, days):
+    """將下載的歷史資料併入本地資料庫，回傳最近days天資料"""
     try:
-        import sys
-        sys.path.append('/opt/.manus/.sandbox-runtime')
-        from data_api import ApiClient
-        
-        client = ApiClient()
-        symbol = f"{stock_code}.TW"
-        
-        logger.info(f"正在獲取 {stock_code} 歷史資料（方法1: Manus API Hub）...")
-        
-        response = client.call_api('YahooFinance/get_stock_chart', query={
-            'symbol': symbol,
-            'region': 'TW',
-            'interval': '1d',
-            'range': '3mo',
-            'includeAdjustedClose': True
-        })
-        
-        if response and 'chart' in response and 'result' in response['chart']:
-            result = response['chart']['result'][0]
-            if 'timestamp' in result and 'indicators' in result:
-                timestamps = result['timestamp']
-                quotes = result['indicators']['quote'][0]
-                
-                ohlc_data = []
-                for i in range(len(timestamps)):
-                    if (quotes['open'][i] is not None and 
-                        quotes['high'][i] is not None and 
-                        quotes['low'][i] is not None and 
-                        quotes['close'][i] is not None):
-                        
-                        ohlc_data.append({
-                            'date': datetime.fromtimestamp(timestamps[i]).strftime('%Y-%m-%d'),
-                            'open': quotes['open'][i],
-                            'high': quotes['high'][i],
-                            'low': quotes['low'][i],
-                            'close': quotes['close'][i],
-                            'volume': quotes['volume'][i] if quotes['volume'][i] else 0
-                        })
-                
-                if len(ohlc_data) >= 34:  # 確保有足夠資料
-                    logger.info(f"✅ {stock_code}: 成功獲取 {len(ohlc_data)} 天歷史資料（方法1）")
-                    return ohlc_data[-days:] if len(ohlc_data) > days else ohlc_data
-                else:
-                    logger.warning(f"⚠️ {stock_code}: 資料不足，僅 {len(ohlc_data)} 天（需要至少34天）")
-        
-        logger.warning(f"❌ {stock_code}: 方法1失敗，嘗試備用方法...")
-        
+        history_store.merge(stock_code, ohlc_data)
+        return history_store.to_ohlc_list(stock_code, days)
     except Exception as e:
-        logger.warning(f"❌ {stock_code}: 方法1異常 - {e}")
+        logger.warning(f"⚠️ {stock_code}: 寫入本地歷史資料失敗 - {e}")
+        return ohlc_data[-days:] if len(ohlc_data) > days else ohlc_data
+
+def fetch_yahoo_chart(stock_code, fetch_range, retries=YAHOO_MAX_RETRIES):
+    """經由共用限流器直接向Yahoo獲取chart回應
     
-    # 方法2: 直接使用requests訪問Yahoo Finance
+    被限流時等待退避期間後重試，重試用盡仍被限流則拋出 RateLimitedError。
+    目前執行緒有時間預算時，等待名額與HTTP逾時都不超過剩餘時間，用完則拋出 DeadlineExceeded。
+    """
+    deadline = current_deadline()
+    for attempt in range(retries + 1):
+        try:
+            with yahoo_rate_limiter.slot(timeout=deadline.remaining() if deadline else None) as permit:
+                request_timeout = deadline.cap(10) if deadline else 10
+                try:
+                    response = http_session.get(get_chart_url(stock_code), params=get_chart_params(fetch_range),
+                                                timeout=request_timeout, verify=False)
+                except requests.Timeout as e:
+                    if request_timeout < 10:
+                        # 因時間預算縮短的逾時不代表上游壅塞
+                        raise DeadlineExceeded(f"請求超過時間預算: {e}")
+                    permit.record(THROTTLED)
+                    error = RateLimitedError(f"請求逾時: {e}")
+                    continue
+                outcome = classify_status(response.status_code)
+                permit.record(outcome, parse_retry_after(response.headers.get('Retry-After')))
+        except DeadlineExceeded:
+            raise
+        except TimeoutError:
+            raise DeadlineExceeded("等待Yahoo請求名額超過時間預算")
+        
+        if outcome != THROTTLED:
+            return response
+        error = RateLimitedError(f"HTTP {response.status_code}", permit.retry_after)
+    
+    raise error
+
+def get_simulation_base_price(stock_code):
+    """模擬資料的基準價格：當日收盤價，沒有即時資料時為100"""
+    stocks = market_snapshot.stocks
+    if stock_code in stocks:
+        return stocks[stock_code]['close']
+    return 100.0  # 預設基準價格
+
+# 歷史資料來源：本地最新資料 -> 外部來源（依健康度與延遲排序）-> 本地舊資料 -> 模擬資料
+history_providers = ProviderRegistry()
+history_providers.register(LocalStoreProvider(history_store))
+history_providers.register(ApiHubProvider())
+history_providers.register(YahooChartProvider(fetch_yahoo_chart))
+history_providers.register(LocalStoreProvider(history_store, allow_stale=True))
+history_providers.register(SimulatedProvider(get_simulation_base_price, get_taiwan_time))
+
+def fetch_historical_data_for_indicators(stock_code, days=60, current_data=None):
+    """獲取歷史資料用於技術指標計算（依序嘗試已註冊且可用的資料來源）
+    
+    current_data 為呼叫端所用快照中的即時資料，決定本地資料是否已涵蓋該快照日期。
+    """
+    
+    # 本地歷史資料庫已是最新時不需任何網路請求，否則只補抓缺少的區段
     try:
-        logger.info(f"正在獲取 {stock_code} 歷史資料（方法2: 直接Yahoo API）...")
-        
-        import requests
-        import time
-        
-        # Yahoo Finance API URL
-        symbol = f"{stock_code}.TW"
-        url = f"https://query1.finance.yahoo.com/v8/finance/chart/{symbol}"
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        params = {
-            'range': '3mo',
-            'interval': '1d',
-            'includeAdjustedClose': 'true'
-        }
-        
-        response = requests.get(url, headers=headers, params=params, timeout=10, verify=False)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            if (data and 'chart' in data and 'result' in data['chart'] and 
-                data['chart']['result'] and len(data['chart']['result']) > 0):
-                
-                result = data['chart']['result'][0]
-                timestamps = result['timestamp']
-                quotes = result['indicators']['quote'][0]
-                
-                ohlc_data = []
-                for i in range(len(timestamps)):
-                    if (quotes['open'][i] is not None and 
-                        quotes['high'][i] is not None and 
-                        quotes['low'][i] is not None and 
-                        quotes['close'][i] is not None):
-                        
-                        ohlc_data.append({
-                            'date': datetime.fromtimestamp(timestamps[i]).strftime('%Y-%m-%d'),
-                            'open': quotes['open'][i],
-                            'high': quotes['high'][i],
-                            'low': quotes['low'][i],
-                            'close': quotes['close'][i],
-                            'volume': quotes['volume'][i] if quotes['volume'][i] else 0
-                        })
-                
-                if len(ohlc_data) >= 34:
-                    logger.info(f"✅ {stock_code}: 成功獲取 {len(ohlc_data)} 天歷史資料（方法2）")
-                    return ohlc_data[-days:] if len(ohlc_data) > days else ohlc_data
-                else:
-                    logger.warning(f"⚠️ {stock_code}: 方法2資料不足，僅 {len(ohlc_data)} 天")
-        
-        logger.warning(f"❌ {stock_code}: 方法2失敗，HTTP狀態碼: {response.status_code}")
-        
+        fetch_range = get_history_fetch_range(stock_code, current_data)
     except Exception as e:
-        logger.warning(f"❌ {stock_code}: 方法2異常 - {e}")
+        logger.warning(f"❌ {stock_code}: 讀取本地歷史資料異常 - {e}")
+        fetch_range = '3mo'
     
-    # 方法3: 使用模擬資料（最後備用）
-    try:
-        logger.warning(f"🔄 {stock_code}: 使用模擬歷史資料作為最後備用...")
-        
-        # 獲取當前股價作為基準
-        if stock_code in stocks_data:
-            base_price = stocks_data[stock_code]['close']
+    rate_limited = None
+    remote_error = None
+    for provider in history_providers.providers():
+        # 被限流或真實來源故障、暫時停用都不代表沒有資料，回報錯誤而不是以模擬資料產生錯誤的篩選結果
+        if provider.synthetic:
+            if rate_limited is not None:
+                raise rate_limited
+            disabled = history_providers.disabled_sources()
+            if remote_error is not None or disabled:
+                raise ProviderUnavailableError(
+                    f"真實資料來源暫時無法使用（{', '.join(disabled) or remote_error}），不使用模擬資料")
+        
+        start_time = time.time()
+        try:
+            ohlc_data = provider.fetch(stock_code, fetch_range, days)
+        except RateLimitedError as e:
+            logger.warning(f"❌ {stock_code}: {provider.name} 被限流 - {e}")
+            rate_limited = e
+            continue
+        except DeadlineExceeded:
+            # 時間預算用完時不再嘗試其他來源，更不能以模擬資料代替
+            raise
+        except Exception as e:
+            logger.warning(f"❌ {stock_code}: {provider.name} 異常 - {e}")
+            history_providers.record_failure(provider, e)
+            if not provider.synthetic:
+                remote_error = e
+            continue
+        history_providers.record_success(provider, time.time() - start_time)
+        
+        if not ohlc_data:
+            continue
+        if provider.persist:
+            fetched_count = len(ohlc_data)
+            ohlc_data = save_fetched_history(stock_code, ohlc_data, days)
+            if len(ohlc_data) < 34:  # 確保有足夠資料
+                logger.warning(f"⚠️ {stock_code}: {provider.name} 資料不足，僅 {len(ohlc_data)} 天（需要至少34天）")
+                continue
+            logger.info(f"✅ {stock_code}: 成功獲取 {fetched_count} 天歷史資料（{provider.name}）")
+        elif provider.synthetic:
+            logger.info(f"⚠️ {stock_code}: 使用模擬資料 {len(ohlc_data)} 天（僅供技術指標計算）")
         else:
-            base_price = 100.0  # 預設基準價格
-        
-        # 生成60天的模擬OHLC資料
-        ohlc_data = []
-        current_date = get_taiwan_time()
-        
-        for i in range(60):
-            date = current_date - timedelta(days=59-i)
-            
-            # 簡單的隨機波動
-            import random
-            random.seed(hash(stock_code) + i)  # 確保相同股票產生相同資料
-            
-            change_pct = (random.random() - 0.5) * 0.06  # ±3%波動
-            price = base_price * (1 + change_pct * (i / 60))  # 逐漸趨向基準價
-            
-            daily_volatility = price * 0.02  # 2%日內波動
-            
-            open_price = price + (random.random() - 0.5) * daily_volatility
-            close_price = price + (random.random() - 0.5) * daily_volatility
-            high_price = max(open_price, close_price) + random.random() * daily_volatility * 0.5
-            low_price = min(open_price, close_price) - random.random() * daily_volatility * 0.5
-            
-            ohlc_data.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'open': round(open_price, 2),
-                'high': round(high_price, 2),
-                'low': round(low_price, 2),
-                'close': round(close_price, 2),
-                'volume': random.randint(1000, 10000) * 1000
-            })
-        
-        logger.info(f"⚠️ {stock_code}: 使用模擬資料 {len(ohlc_data)} 天（僅供技術指標計算）")
+            logger.info(f"✅ {stock_code}: 使用本地歷史資料 {len(ohlc_data)} 天（{provider.name}）")
         return ohlc_data
-        
-    except Exception as e:
-        logger.error(f"❌ {stock_code}: 所有方法都失敗 - {e}")
     
+    if rate_limited is not None:
+        raise rate_limited
+    logger.error(f"❌ {stock_code}: 所有資料來源都失敗")
     return None
 
 def calculate_weighted_simple_average(src_values, length, weight):
@@ -453,7 +648,11 @@ def calculate_ema(values, period):
     return ema
 
 def calculate_pine_script_indicators(ohlc_data):
-    """完全按照Pine Script邏輯計算技術指標"""
+    """計算Pine Script技術指標（向量化引擎，結果與參考實作一致）"""
+    return calculate_pine_script_indicators_vectorized(ohlc_data)
+
+def calculate_pine_script_indicators_reference(ohlc_data):
+    """完全按照Pine Script邏輯計算技術指標（逐筆計算的參考實作，用於驗證向量化引擎）"""
     if len(ohlc_data) < 34:  # 需要足夠的歷史數據
         return None, None, False, False, False
     
@@ -596,179 +795,480 @@ def calculate_pine_script_indicators(ohlc_data):
             'multi_short_line_previous': previous_bull_bear if len(bull_bear_line_values) >= 2 else current_bull_bear
         }
     
-def get_stock_web_data(stock_code, stock_name=None):
+def prepare_stock_history(stock_code, snapshot=None):
+    """獲取歷史資料並加入當日資料，回傳 (即時資料, 歷史資料)
+    
+    同一股票、同一快照日期的並行請求（例如同時進行的多個篩選）只獲取一次並共用結果。
+    """
+    current_data = (snapshot or market_snapshot).stocks[stock_code]
+    history, _ = history_flight.do((stock_code, current_data['date']), load_stock_history, stock_code, current_data)
+    return history
+
+def load_stock_history(stock_code, current_data):
+    """prepare_stock_history 的實際獲取流程"""
+    # 獲取歷史資料用於技術指標計算
+    historical_data = fetch_historical_data_for_indicators(stock_code, current_data=current_data)
+    
+    if historical_data and len(historical_data) >= 34:
+        # 將當日資料加入歷史資料
+        today_data = {
+            'date': current_data['date'],
+            'open': current_data['open'],
+            'high': current_data['high'],
+            'low': current_data['low'],
+            'close': current_data['close'],
+            'volume': current_data['volume']
+        }
+        
+        # 檢查是否已經包含當日資料（證交所與Yahoo的日期格式不同，統一後比較）
+        if normalize_trade_date(historical_data[-1]['date']) != normalize_trade_date(today_data['date']):
+            historical_data.append(today_data)
+    
+    return current_data, historical_data
+
+def get_stock_web_data(stock_code, stock_name=None, snapshot=None):
     """獲取股票的完整資料（結合即時資料和技術指標）"""
     try:
+        snapshot = snapshot or market_snapshot
+        
         # 獲取即時資料
-        if stock_code not in stocks_data:
+        if stock_code not in snapshot.stocks:
             logger.warning(f"股票 {stock_code} 沒有即時資料")
             return None
         
-        current_data = stocks_data[stock_code]
+        # 同一資料日期、同一指標參數的結果直接使用快取
+        cached = result_cache.get_stock(stock_code, snapshot.stocks[stock_code]['date'], INDICATOR_PARAMS_KEY)
+        if cached is not None:
+            return {**cached, 'name': stock_name or cached['name']}
         
-        # 獲取歷史資料用於技術指標計算
-        historical_data = fetch_historical_data_for_indicators(stock_code)
+        current_data, historical_data = prepare_stock_history(stock_code, snapshot)
         
+        # 計算Pine Script技術指標
+        result = None
         if historical_data and len(historical_data) >= 34:
-            # 將當日資料加入歷史資料
-            today_data = {
-                'date': current_data['date'],
-                'open': current_data['open'],
-                'high': current_data['high'],
-                'low': current_data['low'],
-                'close': current_data['close'],
-                'volume': current_data['volume']
-            }
-            
-            # 檢查是否已經包含當日資料
-            if not historical_data or historical_data[-1]['date'] != today_data['date']:
-                historical_data.append(today_data)
-            
-            # 計算Pine Script技術指標
             result = calculate_pine_script_indicators(historical_data)
-            
-            if result:
-                fund_flow_trend = result['fund_trend']
-                bull_bear_line = result['multi_short_line']
-                banker_entry_signal = result['banker_entry_signal']
-                is_crossover = result['is_crossover']
-                is_oversold = result['is_oversold']
-                fund_trend_previous = result['fund_trend_previous']
-                multi_short_line_previous = result['multi_short_line_previous']
-            
-            if fund_flow_trend is not None:
-                # 根據嚴格的Pine Script條件判斷狀態
-                if banker_entry_signal:
-                    signal_status = "🟡 黃柱信號"
-                    score = 100
-                elif is_crossover and not is_oversold:
-                    signal_status = "突破但非超賣"
-                    score = 75
-                elif is_oversold and not is_crossover:
-                    signal_status = "超賣但未突破"
-                    score = 65
-                elif fund_flow_trend > bull_bear_line:
-                    signal_status = "資金流向強勢"
-                    score = 55
-                else:
-                    signal_status = "資金流向弱勢"
-                    score = 30
-                
-                # 計算成交量和趨勢信息
-                current_volume = current_data['volume']
-                volume_formatted = format_volume(current_volume)
-                
-                # 計算成交量趨勢（需要歷史成交量數據）
-                historical_volumes = [d.get('volume', 0) for d in historical_data[-6:-1]] if len(historical_data) > 5 else []
-                previous_volume = historical_volumes[-1] if historical_volumes else current_volume
-                volume_trend, volume_change_percent = calculate_trend_direction(current_volume, previous_volume)
-                
-                # 計算量比
-                volume_ratio = calculate_volume_ratio(current_volume, historical_volumes)
-                volume_ratio_class = get_volume_ratio_class(volume_ratio)
-                
-                # 計算資金流向和多空線趨勢
-                fund_trend_direction, fund_trend_change = calculate_trend_direction(fund_flow_trend, fund_trend_previous)
-                multi_short_line_direction, multi_short_line_change = calculate_trend_direction(bull_bear_line, multi_short_line_previous)
-                
-                return {
-                    'name': stock_name or current_data['name'],
-                    'price': current_data['close'],
-                    'change_percent': current_data['change_percent'],
-                    'volume': current_volume,
-                    'volume_formatted': volume_formatted,
-                    'volume_trend': volume_trend,
-                    'volume_change_percent': volume_change_percent,
-                    'volume_ratio': volume_ratio,
-                    'volume_ratio_class': volume_ratio_class,
-                    'fund_trend': f"{fund_flow_trend:.2f}",
-                    'fund_trend_direction': fund_trend_direction,
-                    'fund_trend_change': fund_trend_change,
-                    'multi_short_line': f"{bull_bear_line:.2f}",
-                    'multi_short_line_direction': multi_short_line_direction,
-                    'multi_short_line_change': multi_short_line_change,
-                    'signal_status': signal_status,
-                    'score': score,
-                    'date': current_data['date'],
-                    'is_crossover': is_crossover,
-                    'is_oversold': is_oversold,
-                    'banker_entry_signal': banker_entry_signal
-                }
-        
-        # 如果無法計算技術指標，返回詳細錯誤資訊
-        error_msg = "歷史資料獲取失敗"
-        if historical_data is None:
-            error_msg = "API連接失敗"
-        elif len(historical_data) < 34:
-            error_msg = f"資料不足({len(historical_data)}/34天)"
-        
-        logger.warning(f"股票 {stock_code} 無法計算技術指標: {error_msg}")
-        
-        # 即使無法計算技術指標，也要返回基本的成交量信息
-        current_volume = current_data['volume']
-        volume_formatted = format_volume(current_volume)
         
-        return {
-            'name': stock_name or current_data['name'],
-            'price': current_data['close'],
-            'change_percent': current_data['change_percent'],
-            'volume': current_volume,
-            'volume_formatted': volume_formatted,
-            'volume_trend': 'flat',
-            'volume_change_percent': 0,
-            'volume_ratio': 1.0,
-            'volume_ratio_class': 'volume-normal',
-            'fund_trend': error_msg,
-            'fund_trend_direction': 'flat',
-            'fund_trend_change': 0,
-            'multi_short_line': error_msg,
-            'multi_short_line_direction': 'flat',
-            'multi_short_line_change': 0,
-            'signal_status': error_msg,
-            'score': 0,
-            'date': current_data['date'],
-            'is_crossover': False,
-            'is_oversold': False,
-            'banker_entry_signal': False
-        }
+        stock_data = build_stock_web_data(stock_code, current_data, historical_data, result)
+        # 模擬資料算出的結果不快取，真實來源恢復後重新計算
+        if result and not is_synthetic_history(historical_data):
+            result_cache.put_stock(stock_code, current_data['date'], INDICATOR_PARAMS_KEY, stock_data)
+        return {**stock_data, 'name': stock_name or stock_data['name']}
         
     except Exception as e:
         logger.error(f"獲取股票 {stock_code} 資料時發生錯誤: {e}")
         return None
 
-def update_stocks_data():
-    """更新股票資料"""
-    global stocks_data, is_updating, last_update_time, data_date
+def format_series_date(value):
+    """各來源的日期格式統一為 YYYY-MM-DD（無法辨識時保留原值）"""
+    trade_date = normalize_trade_date(value)
+    return format_trade_date(trade_date) if trade_date else str(value)
+
+def compute_stock_indicator_series(stock_code, snapshot):
+    """以篩選使用的同一份歷史資料計算完整指標序列（欄式，日期為 YYYY-MM-DD）
+    
+    序列最後兩天的數值與篩選結果的當日/前一日數值相同；前 MIN_BARS-1 天指標尚未穩定，數值為None。
+    回傳 (指標序列, 是否為模擬資料)；資料不足 MIN_BARS 天時指標序列為None。
+    """
+    _, historical_data = prepare_stock_history(stock_code, snapshot)
+    if not historical_data or len(historical_data) < MIN_BARS:
+        return None, False
+    
+    series = calculate_indicator_series(historical_data)
+    
+    warmup = MIN_BARS - 1
+    def values(array):
+        return [None] * warmup + [round(float(value), 4) for value in array[warmup:]]
+    def flags(array):
+        return [False] * warmup + [bool(value) for value in array[warmup:]]
+    
+    series = {
+        'dates': [format_series_date(bar['date']) for bar in historical_data],
+        'close': [float(bar['close']) for bar in historical_data],
+        'fund_flow': values(series['fund_flow']),
+        'bull_bear_line': values(series['bull_bear_line']),
+        'crossover': flags(series['crossover']),
+        'oversold': flags(series['oversold']),
+        'signal': flags(series['signal']),
+        'banker_entry_signal': flags(series['banker_entry_signal'])
+    }
+    return series, is_synthetic_history(historical_data)
+
+def get_stock_indicator_series(stock_code, snapshot=None):
+    """取得 (指標序列, 是否來自快取)；同一股票、同一資料日期只獲取與計算一次"""
+    snapshot = snapshot or market_snapshot
+    data_date = snapshot.stocks[stock_code]['date']
+    cached = result_cache.get_series(stock_code, data_date, INDICATOR_PARAMS_KEY)
+    if cached is not None:
+        return cached, True
     
-    if is_updating:
-        logger.info("股票資料更新已在進行中，跳過此次更新")
+    def compute():
+        series, synthetic = compute_stock_indicator_series(stock_code, snapshot)
+        if series is not None and not synthetic:
+            result_cache.put_series(stock_code, data_date, INDICATOR_PARAMS_KEY, series)
+        return series
+    
+    series, _ = series_flight.do((stock_code, data_date), compute)
+    return series, False
+
+def slice_indicator_series(series, start_date=None, end_date=None):
+    """依日期區間（YYYYMMDD整數，皆含）擷取序列"""
+    if start_date is None and end_date is None:
+        return series
+    trade_dates = [normalize_trade_date(value) or 0 for value in series['dates']]
+    keep = [index for index, value in enumerate(trade_dates)
+            if (start_date is None or value >= start_date) and (end_date is None or value <= end_date)]
+    return {name: [values[index] for index in keep] for name, values in series.items()}
+
+def build_stock_web_data(stock_code, current_data, historical_data, result, stock_name=None):
+    """由即時資料、歷史資料與指標結果組成前端顯示的股票資料"""
+    if historical_data and len(historical_data) >= 34 and result:
+        fund_flow_trend = result['fund_trend']
+        bull_bear_line = result['multi_short_line']
+        banker_entry_signal = result['banker_entry_signal']
+        is_crossover = result['is_crossover']
+        is_oversold = result['is_oversold']
+        fund_trend_previous = result['fund_trend_previous']
+        multi_short_line_previous = result['multi_short_line_previous']
+        
+        if fund_flow_trend is not None:
+            # 根據嚴格的Pine Script條件判斷狀態
+            if banker_entry_signal:
+                signal_status = "🟡 黃柱信號"
+                score = 100
+            elif is_crossover and not is_oversold:
+                signal_status = "突破但非超賣"
+                score = 75
+            elif is_oversold and not is_crossover:
+                signal_status = "超賣但未突破"
+                score = 65
+            elif fund_flow_trend > bull_bear_line:
+                signal_status = "資金流向強勢"
+                score = 55
+            else:
+                signal_status = "資金流向弱勢"
+                score = 30
+            
+            # 計算成交量和趨勢信息
+            current_volume = current_data['volume']
+            volume_formatted = format_volume(current_volume)
+            
+            # 計算成交量趨勢（需要歷史成交量數據）
+            historical_volumes = [d.get('volume', 0) for d in historical_data[-6:-1]] if len(historical_data) > 5 else []
+            previous_volume = historical_volumes[-1] if historical_volumes else current_volume
+            volume_trend, volume_change_percent = calculate_trend_direction(current_volume, previous_volume)
+            
+            # 計算量比
+            volume_ratio = calculate_volume_ratio(current_volume, historical_volumes)
+            volume_ratio_class = get_volume_ratio_class(volume_ratio)
+            
+            # 計算資金流向和多空線趨勢
+            fund_trend_direction, fund_trend_change = calculate_trend_direction(fund_flow_trend, fund_trend_previous)
+            multi_short_line_direction, multi_short_line_change = calculate_trend_direction(bull_bear_line, multi_short_line_previous)
+            
+            return {
+                'name': stock_name or current_data['name'],
+                'market': current_data.get('market') or MARKET_TWSE,
+                'price': current_data['close'],
+                'change_percent': current_data['change_percent'],
+                'volume': current_volume,
+                'volume_formatted': volume_formatted,
+                'volume_trend': volume_trend,
+                'volume_change_percent': volume_change_percent,
+                'volume_ratio': volume_ratio,
+                'volume_ratio_class': volume_ratio_class,
+                'fund_trend': f"{fund_flow_trend:.2f}",
+                'fund_trend_direction': fund_trend_direction,
+                'fund_trend_change': fund_trend_change,
+                'multi_short_line': f"{bull_bear_line:.2f}",
+                'multi_short_line_direction': multi_short_line_direction,
+                'multi_short_line_change': multi_short_line_change,
+                'signal_status': signal_status,
+                'score': score,
+                'date': current_data['date'],
+                'is_crossover': is_crossover,
+                'is_oversold': is_oversold,
+                'banker_entry_signal': banker_entry_signal
+            }
+    
+    # 如果無法計算技術指標，返回詳細錯誤資訊
+    error_msg = "歷史資料獲取失敗"
+    if historical_data is None:
+        error_msg = "API連接失敗"
+    elif len(historical_data) < 34:
+        error_msg = f"資料不足({len(historical_data)}/34天)"
+    
+    logger.warning(f"股票 {stock_code} 無法計算技術指標: {error_msg}")
+    
+    # 即使無法計算技術指標，也要返回基本的成交量信息
+    current_volume = current_data['volume']
+    volume_formatted = format_volume(current_volume)
+    
+    return {
+        'name': stock_name or current_data['name'],
+        'market': current_data.get('market') or MARKET_TWSE,
+        'price': current_data['close'],
+        'change_percent': current_data['change_percent'],
+        'volume': current_volume,
+        'volume_formatted': volume_formatted,
+        'volume_trend': 'flat',
+        'volume_change_percent': 0,
+        'volume_ratio': 1.0,
+        'volume_ratio_class': 'volume-normal',
+        'fund_trend': error_msg,
+        'fund_trend_direction': 'flat',
+        'fund_trend_change': 0,
+        'multi_short_line': error_msg,
+        'multi_short_line_direction': 'flat',
+        'multi_short_line_change': 0,
+        'signal_status': error_msg,
+        'score': 0,
+        'date': current_data['date'],
+        'is_crossover': False,
+        'is_oversold': False,
+        'banker_entry_signal': False
+    }
+
+def prefetch_histories_async(stock_codes, snapshot, fetch_timeout=SCREEN_FETCH_TIMEOUT, cancel_event=None):
+    """在單一事件迴圈上一次送出所有需要補抓的Yahoo請求，結果併入本地歷史資料庫
+    
+    之後的 fetch_historical_data_for_indicators 可直接讀取本地資料；
+    預抓失敗的股票仍會走原本的同步備用流程。回傳成功預抓的股票數。
+    """
+    fetch_ranges = {}
+    for stock_code in stock_codes:
+        fetch_range = get_history_fetch_range(stock_code, snapshot.stocks[stock_code])
+        if fetch_range:
+            fetch_ranges[stock_code] = fetch_range
+    
+    if not fetch_ranges:
+        return 0
+    
+    logger.info(f"以asyncio預抓 {len(fetch_ranges)} 支股票的歷史資料...")
+    charts = get_async_client().fetch_charts_sync(fetch_ranges, timeout=fetch_timeout, cancel_event=cancel_event)
+    
+    fetched_count = 0
+    for stock_code, (ohlc_data, error) in charts.items():
+        if error:
+            logger.warning(f"❌ {stock_code}: 非同步預抓失敗 - {error}")
+            continue
+        # 一併併入當日快照，讓本地資料涵蓋最新交易日
+        ohlc_data = ohlc_data + [snapshot.stocks[stock_code]]
+        history_store.merge(stock_code, ohlc_data)
+        fetched_count += 1
+    
+    logger.info(f"非同步預抓完成：{fetched_count}/{len(fetch_ranges)} 支成功")
+    return fetched_count
+
+def iter_stock_histories(stock_codes, snapshot, workers=SCREEN_FETCH_WORKERS,
+                         fetch_timeout=SCREEN_FETCH_TIMEOUT, cancel_event=None):
+    """以有限並行度獲取多支股票的歷史資料
+    
+    依輸入順序逐一產生 (股票代碼, (即時資料, 歷史資料), 錯誤訊息)，成功時錯誤訊息為None。
+    每支股票的獲取（含限流等待與重試）以 fetch_timeout 秒為時間預算；
+    cancel_event 觸發時取消尚未開始的獲取，在途請求在下一次檢查時停止，並拋出 JobCancelled。
+    """
+    def fetch_one(stock_code):
+        deadline = Deadline(fetch_timeout, cancel_event)
+        with deadline_scope(deadline):
+            deadline.check()
+            return prepare_stock_history(stock_code, snapshot)
+    
+    logger.info(f"以 {workers} 個執行緒並行獲取 {len(stock_codes)} 支股票的歷史資料...")
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(fetch_one, stock_code) for stock_code in stock_codes]
+        try:
+            for index, (stock_code, future) in enumerate(zip(stock_codes, futures), 1):
+                try:
+                    yield stock_code, future.result(), None
+                except Exception as e:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise JobCancelled()
+                    logger.warning(f"處理股票 {stock_code} 時發生錯誤: {e}")
+                    yield stock_code, None, str(e) or type(e).__name__
+                
+                if cancel_event is not None and cancel_event.is_set():
+                    raise JobCancelled()
+                
+                # 每處理50支股票記錄一次進度
+                if index % 50 == 0:
+                    logger.info(f"已獲取 {index}/{len(stock_codes)} 支股票歷史資料...")
+        finally:
+            # 提前結束（取消或呼叫端不再讀取）時不再啟動排隊中的獲取
+            for future in futures:
+                future.cancel()
+
+def fetch_stock_histories(stock_codes, snapshot, workers=SCREEN_FETCH_WORKERS):
+    """iter_stock_histories 的清單版本"""
+    return list(iter_stock_histories(stock_codes, snapshot, workers))
+
+def get_changed_stocks(old_data, new_data):
+    """比對新舊快照，回傳K棒有變動（含新增或移除）的股票代碼集合"""
+    changed = set(old_data) ^ set(new_data)
+    for stock_code in set(old_data) & set(new_data):
+        old, new = old_data[stock_code], new_data[stock_code]
+        if any(old.get(field) != new.get(field) for field in ('date', 'open', 'high', 'low', 'close', 'volume')):
+            changed.add(stock_code)
+    return changed
+
+def invalidate_changed_stocks(old_data, new_data):
+    """新快照只讓K棒實際變動的股票快取失效"""
+    changed = get_changed_stocks(old_data, new_data)
+    removed = result_cache.invalidate_stocks(changed)
+    logger.info(f"快照中有 {len(changed)} 支股票變動，清除 {removed} 筆個股快取")
+    return changed
+
+def get_snapshot_meta(snapshot):
+    """即時資料以外需要一起保存或發布的狀態"""
+    return {
+        'last_update_time': snapshot.last_update_time.isoformat() if snapshot.last_update_time else None,
+        'data_date': snapshot.data_date,
+        'twse_validators': twse_snapshot.validators(),
+        'tpex_validators': tpex_snapshot.validators(),
+        'params_key': INDICATOR_PARAMS_KEY,
+        'screen': result_cache.peek_screen(snapshot.data_date, INDICATOR_PARAMS_KEY)
+    }
+
+def restore_market_snapshot(stocks, meta):
+    """由暖啟動檔或共享快照的內容建立下一個快照版本"""
+    last_update_time = datetime.fromisoformat(meta['last_update_time']) if meta.get('last_update_time') else None
+    snapshot = market_snapshot.replace(stocks=stocks, last_update_time=last_update_time,
+                                       data_date=meta.get('data_date'))
+    # 合併快照依市場拆回兩個部分（舊版快照沒有市場欄位，視為上市）
+    parts = {MARKET_TWSE: {}, MARKET_TPEX: {}}
+    for stock_code, stock in snapshot.stocks.items():
+        parts.setdefault(stock.get('market') or MARKET_TWSE, {})[stock_code] = stock
+    twse_data = MappingProxyType(parts[MARKET_TWSE])
+    tpex_data = MappingProxyType(parts[MARKET_TPEX])
+    twse_snapshot.restore(meta.get('twse_validators') or {}, twse_data)
+    tpex_snapshot.restore(meta.get('tpex_validators') or {}, tpex_data)
+    market_quotes.restore((twse_data, tpex_data), snapshot.stocks)
+    register_stock_markets(snapshot.stocks)
+    if meta.get('screen') and meta.get('params_key') == INDICATOR_PARAMS_KEY:
+        result_cache.put_screen(snapshot.data_date, INDICATOR_PARAMS_KEY, meta['screen'])
+    return snapshot
+
+def persist_warm_start(snapshot):
+    """將快照、時間資訊與最新篩選結果寫入暖啟動檔，並發布給其他worker"""
+    if not snapshot:
         return
+    meta = get_snapshot_meta(snapshot)
+    try:
+        save_warm_start(WARM_START_PATH, {'stocks_data': dict(snapshot.stocks.items()), **meta})
+    except Exception as e:
+        logger.warning(f"寫入暖啟動檔失敗: {e}")
+    try:
+        publish_snapshot(SHARED_SNAPSHOT_PATH, snapshot.stocks, meta)
+        shared_snapshot_reader.mark_published()
+    except Exception as e:
+        logger.warning(f"發布共享快照失敗: {e}")
+
+def attach_shared_snapshot():
+    """其他worker發布新版本時改用共享快照，有換版時回傳True"""
+    global market_snapshot
     
-    is_updating = True
-    logger.info("開始更新股票資料...")
+    published = shared_snapshot_reader.poll()
+    if published is None:
+        return False
+    view, meta = published
+    
+    invalidate_changed_stocks(market_snapshot.stocks, view)
+    market_snapshot = restore_market_snapshot(view, meta)
     
+    logger.info(f"已掛載共享快照 {len(view)} 支股票（資料日期 {market_snapshot.data_date}）")
+    return True
+
+def load_warm_start_state():
+    """worker啟動後第一次請求時讀回暖啟動檔（只執行一次，已有資料時略過）"""
+    global market_snapshot, warm_start_loaded
+    
+    with warm_start_lock:
+        if warm_start_loaded:
+            return
+        warm_start_loaded = True
+        loaded_states = signal_prefilter.load()
+        if loaded_states:
+            logger.info(f"載入 {loaded_states} 支股票的指標狀態供前置過濾使用")
+        if market_snapshot:
+            return
+        
+        state = load_warm_start(WARM_START_PATH)
+        if not state or not state.get('stocks_data'):
+            return
+        
+        market_snapshot = restore_market_snapshot(state['stocks_data'], state)
+        logger.info(f"由暖啟動檔載入 {len(market_snapshot.stocks)} 支股票資料（資料日期 {market_snapshot.data_date}）")
+
+@app.before_request
+def load_latest_snapshot():
+    """每個請求前確認是否有其他worker發布的新版本，沒有任何資料時讀回暖啟動檔"""
+    attach_shared_snapshot()
+    if not warm_start_loaded:
+        load_warm_start_state()
+
+def refresh_stocks_data(force=False):
+    """下載最新快照並替換目前的市場快照，成功時回傳新版本，失敗時回傳None
+    
+    快照已涵蓋最近一個已公布的交易日時不再下載（force為True時仍下載）。
+    """
+    global market_snapshot, is_updating
+    
+    is_updating = True
     try:
-        # 獲取真實股票資料
-        real_data = fetch_real_stock_data()
-        
-        if real_data:
-            stocks_data = real_data
-            last_update_time = get_taiwan_time()
+        # 跨worker只允許一個行程下載；等待期間其他worker已發布新版本時直接使用
+        published_before = snapshot_signature(SHARED_SNAPSHOT_PATH)
+        with publisher_lock(SHARED_SNAPSHOT_PATH):
+            if snapshot_signature(SHARED_SNAPSHOT_PATH) != published_before and attach_shared_snapshot():
+                logger.info("其他worker剛完成更新，使用共享快照")
+                return market_snapshot
             
-            # 設定資料日期（使用第一支股票的日期）
-            if stocks_data:
-                first_stock = next(iter(stocks_data.values()))
-                data_date = first_stock.get('date', get_latest_trading_date())
+            latest_session = get_latest_trading_date()
+            if not force and market_snapshot and market_snapshot.data_date == latest_session:
+                next_publish = trading_calendar.next_publish_time(get_taiwan_time())
+                logger.info(f"快照已是最近交易日 {latest_session} 的資料，"
+                            f"下次公布時間 {format_taiwan_time(next_publish)}，略過下載")
+                market_snapshot = market_snapshot.replace(last_update_time=get_taiwan_time())
+                return market_snapshot
             
-            logger.info(f"股票資料更新完成，共更新 {len(stocks_data)} 支股票")
-        else:
-            logger.error("無法獲取真實股票資料")
+            logger.info("開始更新全市場股票資料...")
             
-    except Exception as e:
-        logger.error(f"更新股票資料時發生錯誤: {e}")
+            # 獲取真實股票資料
+            real_data = fetch_real_stock_data()
+            
+            if not real_data:
+                logger.error("無法獲取真實股票資料")
+                return None
+            
+            previous = market_snapshot
+            if real_data is previous.stocks:
+                logger.info("快照未變動，不需更新快取與本地歷史資料")
+                market_snapshot = previous.replace(last_update_time=get_taiwan_time())
+                persist_warm_start(market_snapshot)
+                return market_snapshot
+            
+            # 只有K棒實際變動的股票需要清除快取並併入本地歷史資料
+            changed = invalidate_changed_stocks(previous.stocks, real_data)
+            market_snapshot = previous.replace(stocks=real_data, last_update_time=get_taiwan_time(),
+                                               data_date=get_snapshot_data_date(real_data))
+            register_stock_markets(real_data)
+            history_store.merge_snapshot({code: real_data[code] for code in changed if code in real_data},
+                                       get_previous_session)
+            persist_warm_start(market_snapshot)
+            
+            logger.info(f"股票資料更新完成，共 {len(real_data)} 支股票")
+            return market_snapshot
     finally:
         is_updating = False
 
+def update_stocks_data(force=False):
+    """更新股票資料（與進行中的更新合併）"""
+    try:
+        _, shared = update_flight.do('stocks', refresh_stocks_data, force)
+        if shared:
+            logger.info("股票資料更新已在進行中，使用該次更新的結果")
+    except Exception as e:
+        logger.error(f"更新股票資料時發生錯誤: {e}")
+
 @app.route('/')
 def index():
     """首頁"""
@@ -778,11 +1278,13 @@ def index():
 def get_stocks():
     """獲取股票清單"""
     try:
+        snapshot = market_snapshot
+        
         # 如果有更新的股票資料，使用實際資料；否則使用預設清單
-        if stocks_data:
+        if snapshot:
             stock_list = [
-                {'stock_id': code, 'stock_name': data['name']} 
-                for code, data in stocks_data.items()
+                {'stock_id': code, 'stock_name': data['name'], 'market': data.get('market') or MARKET_TWSE}
+                for code, data in snapshot.stocks.items()
             ]
         else:
             stock_list = get_default_stock_list()
@@ -790,40 +1292,71 @@ def get_stocks():
         return jsonify({
             'success': True,
             'data': stock_list,
-            'last_update': last_update_time.isoformat() if last_update_time else None,
-            'data_date': data_date
+            'last_update': snapshot.last_update_time.isoformat() if snapshot.last_update_time else None,
+            'data_date': snapshot.data_date
         })
     except Exception as e:
         logger.error(f"獲取股票清單時發生錯誤: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/stocks/<stock_code>/indicators')
+def get_stock_indicators(stock_code):
+    """個股的完整指標序列（資金流向、多空線、crossover、超賣與黃柱旗標），from/to 限制日期區間"""
+    snapshot = market_snapshot
+    if stock_code not in snapshot.stocks:
+        return jsonify({'success': False, 'error': f'找不到股票 {stock_code} 的即時資料'}), 404
+    
+    dates = {}
+    for name in ('from', 'to'):
+        value = request.args.get(name)
+        dates[name] = normalize_trade_date(value) if value else None
+        if value and dates[name] is None:
+            return jsonify({'success': False, 'error': f'{name} 日期格式錯誤: {value}'}), 400
+    
+    try:
+        series, cached = get_stock_indicator_series(stock_code, snapshot)
+    except Exception as e:
+        logger.error(f"計算股票 {stock_code} 指標序列時發生錯誤: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if series is None:
+        return jsonify({'success': False, 'error': f'股票 {stock_code} 歷史資料不足 {MIN_BARS} 天'}), 404
+    
+    series = slice_indicator_series(series, dates['from'], dates['to'])
+    current_data = snapshot.stocks[stock_code]
+    return jsonify({
+        'success': True,
+        'code': stock_code,
+        'name': current_data['name'],
+        'market': current_data.get('market') or MARKET_TWSE,
+        'data_date': snapshot.data_date,
+        'params_key': INDICATOR_PARAMS_KEY,
+        'from': format_trade_date(dates['from']) if dates['from'] else None,
+        'to': format_trade_date(dates['to']) if dates['to'] else None,
+        'count': len(series['dates']),
+        'cached': cached,
+        'series': series
+    })
+
 @app.route('/api/update', methods=['POST'])
 def update_stocks():
-    """更新股票資料"""
-    global stocks_data, is_updating, last_update_time, data_date
+    """更新股票資料（同時多個更新請求只下載一次，全部取得同一個結果）
     
+    快照已是最近交易日的資料時不重新下載；帶 force=1 強制重新下載。
+    """
     try:
-        # 移除過度保護機制，允許用戶隨時更新
-        is_updating = True
+        options = request.get_json(silent=True) or {}
+        force = bool(options.get('force')) or request.args.get('force') in ('1', 'true')
+        snapshot, shared = update_flight.do('stocks', refresh_stocks_data, force)
         
-        logger.info("開始更新全市場股票資料...")
-        
-        # 獲取真實股票資料
-        real_data = fetch_real_stock_data()
-        
-        if real_data:
-            stocks_data = real_data
-            last_update_time = get_taiwan_time()
-            data_date = get_latest_trading_date()
-            
-            logger.info(f"股票資料更新完成，共 {len(stocks_data)} 支股票")
-            
+        if snapshot:
             return jsonify({
                 'success': True,
-                'message': f'成功更新 {len(stocks_data)} 支股票資料（全市場覆蓋）',
-                'stocks_count': len(stocks_data),
-                'update_time': last_update_time.isoformat(),
-                'data_date': data_date
+                'message': f'成功更新 {len(snapshot.stocks)} 支股票資料（全市場覆蓋）',
+                'stocks_count': len(snapshot.stocks),
+                'update_time': snapshot.last_update_time.isoformat(),
+                'data_date': snapshot.data_date,
+                'snapshot_version': snapshot.version,
+                'shared': shared
             })
         else:
             return jsonify({
@@ -837,141 +1370,791 @@ def update_stocks():
             'success': False,
             'error': f'更新失敗: {str(e)}'
         }), 500
-    finally:
-        is_updating = False
+
+def get_computable_histories(histories):
+    """{股票代碼: (即時資料, 歷史資料)} 中資料足夠計算指標的部分"""
+    return {
+        code: historical_data
+        for code, (_, historical_data) in histories.items()
+        if historical_data and len(historical_data) >= 34
+    }
+
+def submit_indicator_chunk(histories):
+    """把一段歷史資料交給指標計算行程池，回傳結果的 Future"""
+    return indicator_pool.submit(get_computable_histories(histories))
+
+def get_indicator_chunk_results(future, histories):
+    """取得行程池的計算結果；行程池故障時改在目前行程內計算"""
+    try:
+        return future.result()
+    except Exception as e:
+        logger.warning(f"指標計算行程失敗，改在目前行程計算: {e}")
+        return calculate_pine_script_indicators_batch(get_computable_histories(histories))
+
+def build_screen_rows(histories, indicator_results=None):
+    """對一段已獲取的歷史資料批次計算技術指標，回傳篩選結果列"""
+    if indicator_results is None:
+        indicator_results = calculate_pine_script_indicators_batch(get_computable_histories(histories))
+    
+    rows = []
+    for stock_code, (current_data, historical_data) in histories.items():
+        try:
+            result = indicator_results.get(stock_code)
+            stock_data = build_stock_web_data(stock_code, current_data, historical_data, result)
+            synthetic = is_synthetic_history(historical_data)
+            if result and not synthetic:
+                result_cache.put_stock(stock_code, current_data['date'], INDICATOR_PARAMS_KEY, stock_data)
+                if SCREEN_PREFILTER_ENABLED:
+                    signal_prefilter.record_history(stock_code, historical_data)
+            row = {
+                'code': stock_code,
+                **stock_data
+            }
+            if synthetic:
+                row['simulated'] = True
+            rows.append(row)
+        except Exception as e:
+            logger.warning(f"處理股票 {stock_code} 時發生錯誤: {e}")
+    return rows
+
+def get_previous_session(trade_date):
+    """YYYYMMDD 整數的前一個交易日（YYYYMMDD 整數）"""
+    return int(trading_calendar.previous_trading_day(str(trade_date)).strftime('%Y%m%d'))
+
+def iter_batched_histories(stock_codes, snapshot, workers=SCREEN_FETCH_WORKERS, cancel_event=None):
+    """依序獲取多支股票的歷史資料，產生 (股票代碼, (即時資料, 歷史資料), 錯誤訊息)
+    
+    非同步模式分批預抓（保持輸入順序），讓前面的批次先完成；其餘與 iter_stock_histories 相同。
+    """
+    batch_size = SCREEN_COMPUTE_CHUNK * 4 if DATA_FETCH_BACKEND == 'async' else len(stock_codes)
+    for batch_start in range(0, len(stock_codes), max(1, batch_size)):
+        batch = stock_codes[batch_start:batch_start + batch_size]
+        
+        if DATA_FETCH_BACKEND == 'async':
+            try:
+                prefetch_histories_async(batch, snapshot, cancel_event=cancel_event)
+            except Exception as e:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise JobCancelled()
+                logger.warning(f"非同步預抓失敗，改用同步流程: {e}")
+        
+        yield from iter_stock_histories(batch, snapshot, workers, cancel_event=cancel_event)
+
+def iter_screen_chunks(stock_codes, snapshot, workers=SCREEN_FETCH_WORKERS, cancel_event=None):
+    """並行獲取歷史資料，每累積 SCREEN_COMPUTE_CHUNK 支股票就批次計算一次
+    
+    依序產生 (結果列, 獲取失敗清單, 前置過濾排除數)，讓呼叫端可以逐段回報進度。
+    已有快取結果的股票與前置過濾排除的股票不再獲取歷史資料，以第一段一次產生；
+    其餘股票依最可能出現黃柱的順序處理，提早結束時已完成的部分最有價值。
+    """
+    cached_rows = []
+    pending_codes = []
+    for stock_code in stock_codes:
+        cached = result_cache.get_stock(stock_code, snapshot.stocks[stock_code]['date'], INDICATOR_PARAMS_KEY)
+        if cached is not None:
+            cached_rows.append({'code': stock_code, **cached})
+        else:
+            pending_codes.append(stock_code)
+    
+    pruned = []
+    if SCREEN_PREFILTER_ENABLED and pending_codes:
+        pending_codes, pruned = signal_prefilter.split(pending_codes, snapshot.stocks, get_previous_session)
+        pending_codes = signal_prefilter.prioritize(pending_codes, snapshot.stocks, get_previous_session)
+    
+    if cached_rows or pruned:
+        logger.info(f"快取命中 {len(cached_rows)} 支股票，前置過濾排除 {len(pruned)} 支，需要分析 {len(pending_codes)} 支")
+        yield cached_rows, [], len(pruned)
+    
+    # 第二階段的計算交給行程池，計算中的段落不阻擋後續的獲取；結果依送出順序產生
+    pending_chunks = deque()
+    max_pending_chunks = max(2, SCREEN_CPU_WORKERS * 2)
+    
+    def completed_chunks(wait=False):
+        while pending_chunks and (wait or pending_chunks[0][0].done() or len(pending_chunks) > max_pending_chunks):
+            future, chunk_histories, chunk_errors = pending_chunks.popleft()
+            yield build_screen_rows(chunk_histories, get_indicator_chunk_results(future, chunk_histories)), chunk_errors, 0
+    
+    histories = {}
+    fetch_errors = []
+    for stock_code, history, error in iter_batched_histories(pending_codes, snapshot, workers, cancel_event):
+        if error:
+            fetch_errors.append({'code': stock_code, 'error': error})
+        else:
+            histories[stock_code] = history
+        
+        # 第二階段：每段一次批次計算技術指標
+        if len(histories) + len(fetch_errors) >= SCREEN_COMPUTE_CHUNK:
+            pending_chunks.append((submit_indicator_chunk(histories), histories, fetch_errors))
+            histories = {}
+            fetch_errors = []
+        yield from completed_chunks()
+    
+    if histories or fetch_errors:
+        pending_chunks.append((submit_indicator_chunk(histories), histories, fetch_errors))
+    yield from completed_chunks(wait=True)
+
+def iter_screen_events(snapshot=None, workers=SCREEN_FETCH_WORKERS, cancel_event=None):
+    """全市場黃柱篩選的事件產生器
+    
+    依序產生 start → (hit..., progress)... → done 事件字典；只保留黃柱股票，
+    不緩衝全部股票的分析結果，適合串流輸出。整個篩選只使用同一個快照版本。
+    """
+    snapshot = snapshot or market_snapshot
+    data_date = snapshot.data_date
+    current_time = get_taiwan_time()
+    total_stocks = len(snapshot.stocks)
+    
+    logger.info(f"開始分析 {total_stocks} 支股票的Pine Script指標（快照版本 {snapshot.version}）...")
+    
+    stock_codes = list(snapshot.stocks.keys())
+    market_counts = Counter(stock.get('market') or MARKET_TWSE for stock in snapshot.stocks.values())
+    logger.info(f"本次處理上市 {market_counts[MARKET_TWSE]} 支、上櫃 {market_counts[MARKET_TPEX]} 支股票")
+    
+    # 同一資料日期已有完整篩選結果時直接重播
+    cached_screen = result_cache.get_screen(data_date, INDICATOR_PARAMS_KEY)
+    if cached_screen is not None:
+        logger.info(f"使用快取的篩選結果（資料日期 {data_date}）")
+        yield {**cached_screen['start'], 'cached': True}
+        for stock in cached_screen['hits']:
+            yield {'type': 'hit', 'stock': stock}
+        yield {
+            'type': 'progress',
+            'processed': cached_screen['start']['total'],
+            'total': cached_screen['start']['total'],
+            'hits': len(cached_screen['hits'])
+        }
+        yield cached_screen['done']
+        return
+    
+    start_event = {
+        'type': 'start',
+        'total': total_stocks,
+        'total_available': total_stocks,
+        'markets': {MARKET_TWSE: market_counts[MARKET_TWSE], MARKET_TPEX: market_counts[MARKET_TPEX]},
+        'query_time': current_time.isoformat(),
+        'data_date': data_date,
+        'snapshot_version': snapshot.version
+    }
+    yield start_event
+    
+    processed_count = 0
+    error_count = 0
+    pruned_count = 0
+    simulated_count = 0
+    hits = []
+    
+    for rows, errors, pruned in iter_screen_chunks(stock_codes, snapshot, workers, cancel_event):
+        processed_count += len(rows)
+        error_count += len(errors)
+        pruned_count += pruned
+        simulated_count += sum(1 for stock in rows if stock.get('simulated'))
+        
+        # 嚴格的Pine Script主力進場條件：只有banker_entry_signal為True才符合；
+        # 模擬資料的價格不是真實行情，算出的信號不列為黃柱股票
+        for stock in rows:
+            if stock.get('banker_entry_signal', False) and not stock.get('simulated'):
+                hits.append(stock)
+                logger.info(f"  🟡 {stock['code']} {stock['name']}: 資金流向={stock['fund_trend']}, 多空線={stock['multi_short_line']}, crossover={stock['is_crossover']}, 超賣={stock['is_oversold']}, 黃柱={stock['banker_entry_signal']}")
+                yield {'type': 'hit', 'stock': stock}
+        
+        for error in errors:
+            yield {'type': 'error', **error}
+        
+        yield {
+            'type': 'progress',
+            'processed': processed_count + error_count + pruned_count,
+            'total': total_stocks,
+            'hits': len(hits),
+            'pruned': pruned_count
+        }
+    
+    # 前置過濾排除的股票已證明不會出現黃柱，視同已處理
+    covered_count = processed_count + pruned_count
+    logger.info(f"黃柱篩選結果:")
+    logger.info(f"  總共分析: {processed_count} 支股票（前置過濾排除 {pruned_count} 支）")
+    logger.info(f"  符合條件: {len(hits)} 支股票")
+    
+    done_event = {
+        'type': 'done',
+        'message': f'黃柱篩選完成：{len(hits)} 支出現黃柱信號（已處理 {covered_count}/{total_stocks} 支股票）',
+        'analysis_summary': {
+            'total_analyzed': processed_count,
+            'total_available': total_stocks,
+            'meets_criteria': len(hits),
+            'criteria': '黃柱信號：crossover(資金流向, 多空線) AND 多空線 < 25 (當日或前一日)',
+            'market_coverage': f'{(covered_count/total_stocks*100):.1f}%' if total_stocks > 0 else '0%',
+            'fetch_errors': error_count,
+            'simulated_data': simulated_count,
+            'pruned_by_prefilter': pruned_count
+        }
+    }
+    
+    if SCREEN_PREFILTER_ENABLED:
+        signal_prefilter.save()
+    
+    # 只快取完整成功且全為真實資料的篩選，有獲取失敗或使用模擬資料時下次重新嘗試（成功的個股仍在個股快取中）
+    if error_count == 0 and simulated_count == 0:
+        result_cache.put_screen(data_date, INDICATOR_PARAMS_KEY,
+                                {'start': start_event, 'hits': hits, 'done': done_event})
+        # 篩選期間快照已換版時，新版本的篩選結果要由新版本自己產生
+        if snapshot is market_snapshot:
+            persist_warm_start(snapshot)
+    yield done_event
+
+def run_screen(progress_callback=None, snapshot=None, workers=SCREEN_FETCH_WORKERS, cancel_event=None):
+    """執行一次全市場黃柱篩選，回傳API回應內容
+    
+    progress_callback(已處理數, 總數, 新找到的黃柱股票) 於每段計算完成後呼叫。
+    """
+    filtered_stocks = []
+    fetch_errors = []
+    new_hits = []
+    
+    for event in iter_screen_events(snapshot, workers, cancel_event):
+        if event['type'] == 'start':
+            start = event
+            if progress_callback:
+                progress_callback(0, event['total'], None)
+        elif event['type'] == 'hit':
+            filtered_stocks.append(event['stock'])
+            new_hits.append(event['stock'])
+        elif event['type'] == 'error':
+            fetch_errors.append({'code': event['code'], 'error': event['error']})
+        elif event['type'] == 'progress':
+            if progress_callback:
+                progress_callback(event['processed'], event['total'], new_hits)
+            new_hits = []
+        elif event['type'] == 'done':
+            done = event
+    
+    # 按評分排序
+    filtered_stocks.sort(key=lambda x: x['score'], reverse=True)
+    
+    return {
+        'success': True,
+        'data': filtered_stocks,
+        'total': len(filtered_stocks),
+        'message': done['message'],
+        'query_time': start['query_time'],
+        'data_date': start['data_date'],
+        'cached': start.get('cached', False),
+        'analysis_summary': done['analysis_summary'],
+        'errors': fetch_errors
+    }
+
+def run_screen_job(job, snapshot=None, workers=SCREEN_FETCH_WORKERS):
+    """背景工作的執行函數：把進度回報給工作物件"""
+    return run_screen(progress_callback=job.update_progress, snapshot=snapshot, workers=workers,
+                      cancel_event=job.cancel_event)
+
+def get_screen_key(snapshot):
+    """同一快照版本與指標參數的並行篩選合併為一次"""
+    return (snapshot.version, snapshot.data_date, INDICATOR_PARAMS_KEY)
+
+def submit_screen_job(snapshot, workers=SCREEN_FETCH_WORKERS, params=None):
+    """建立（或併入進行中的）背景篩選工作，回傳 (工作, 是否共用)"""
+    return screen_job_manager.submit(lambda job: run_screen_job(job, snapshot, workers),
+                                     params=params, key=get_screen_key(snapshot))
+
+def run_screen_with_deadline(snapshot, deadline_ms):
+    """在時間預算內等待篩選工作，回傳完整結果或目前已完成的部分（其餘在背景繼續）"""
+    started = time.monotonic()
+    job, shared = submit_screen_job(snapshot)
+    finished = job.wait(deadline_ms / 1000)
+    elapsed_ms = round((time.monotonic() - started) * 1000)
+    
+    if finished and job.status == 'completed':
+        # 工作完成不代表全部股票都有結果：獲取失敗的股票不計入覆蓋率
+        summary = job.result['analysis_summary']
+        processed = summary['total_analyzed'] + summary.get('pruned_by_prefilter', 0)
+        total = summary['total_available']
+        return {
+            **job.result,
+            'complete': processed >= total,
+            'coverage': {
+                'processed': processed,
+                'total': total,
+                'percent': round(processed / total * 100, 1) if total else 0
+            },
+            'elapsed_ms': elapsed_ms,
+            'job_id': job.job_id,
+            'shared': shared
+        }
+    
+    job_state = job.to_dict(include_result=False)
+    progress = job_state['progress']
+    hits = sorted(job_state['hits'], key=lambda x: x['score'], reverse=True)
+    if finished:
+        message = f"篩選工作未完成（{job.status}）" + (f"：{job.error}" if job.error else '')
+    else:
+        message = (f"時間預算 {deadline_ms}ms 內完成 {progress['processed']}/{progress['total']} 支股票，"
+                   f"其餘在背景繼續計算")
+    return {
+        'success': True,
+        'complete': False,
+        'data': hits,
+        'total': len(hits),
+        'message': message,
+        'data_date': snapshot.data_date,
+        'coverage': {
+            'processed': progress['processed'],
+            'total': progress['total'],
+            'percent': progress['percent']
+        },
+        'deadline_ms': deadline_ms,
+        'elapsed_ms': elapsed_ms,
+        'job_id': job.job_id,
+        'status': job.status,
+        'status_url': f'/api/screen/{job.job_id}',
+        'shared': shared
+    }
+
+# 參數掃描：一次以多組指標參數篩選同一批歷史資料
+SWEEP_MAX_SETS = int(os.environ.get('SWEEP_MAX_SETS', 64))
+
+def run_parameter_sweep(snapshot, param_sets, progress_callback=None, workers=SCREEN_FETCH_WORKERS, cancel_event=None):
+    """獲取（或讀取已快取的）全市場歷史資料後，一次評估所有參數組，回傳API回應內容
+    
+    歷史資料與篩選共用同一個獲取流程與本地歷史資料庫；前置過濾只對預設參數成立，這裡不使用。
+    """
+    started = time.monotonic()
+    stock_codes = list(snapshot.stocks.keys())
+    min_bars = min(required_bars(params) for params in param_sets)
+    
+    histories = {}
+    fetch_errors = []
+    simulated_count = 0
+    if progress_callback:
+        progress_callback(0, len(stock_codes), None)
+    for index, (stock_code, history, error) in enumerate(
+            iter_batched_histories(stock_codes, snapshot, workers, cancel_event), 1):
+        if error:
+            fetch_errors.append({'code': stock_code, 'error': error})
+        elif is_synthetic_history(history[1]):
+            # 模擬資料不是真實行情，不列入參數掃描
+            simulated_count += 1
+        elif history[1] and len(history[1]) >= min_bars:
+            histories[stock_code] = history[1]
+        if progress_callback and index % SCREEN_COMPUTE_CHUNK == 0:
+            progress_callback(index, len(stock_codes), None)
+    
+    compute_started = time.monotonic()
+    sweep = sweep_histories(histories, param_sets)
+    compute_ms = round((time.monotonic() - compute_started) * 1000, 1)
+    logger.info(f"參數掃描完成：{len(param_sets)} 組參數、{len(histories)} 支股票，計算 {compute_ms}ms")
+    
+    for item in sweep['results']:
+        for hit in item['hits']:
+            current_data = snapshot.stocks[hit['code']]
+            hit.update({
+                'name': current_data['name'],
+                'market': current_data.get('market') or MARKET_TWSE,
+                'price': current_data['close'],
+                'change_percent': current_data['change_percent']
+            })
+    if progress_callback:
+        progress_callback(len(stock_codes), len(stock_codes), None)
+    
+    return {
+        'success': True,
+        'data_date': snapshot.data_date,
+        'total_available': len(stock_codes),
+        'total_analyzed': len(histories),
+        'simulated_data': simulated_count,
+        'results': sweep['results'],
+        'shared_series': sweep['computed'],
+        'compute_ms': compute_ms,
+        'elapsed_ms': round((time.monotonic() - started) * 1000),
+        'errors': fetch_errors
+    }
+
+def submit_sweep_job(snapshot, param_sets):
+    """建立（或併入相同參數的進行中）參數掃描背景工作"""
+    key = (snapshot.version, snapshot.data_date, 'sweep', tuple(get_params_key(params) for params in param_sets))
+    return research_job_manager.submit(
+        lambda job: run_parameter_sweep(snapshot, param_sets, job.update_progress, cancel_event=job.cancel_event),
+        params={'type': 'sweep', 'param_sets': len(param_sets)}, key=key)
+
+# 歷史回測：使用本地歷史資料庫的完整資料，可先向外部補抓較長的歷史
+BACKTEST_MAX_BACKFILL_YEARS = int(os.environ.get('BACKTEST_MAX_BACKFILL_YEARS', 10))
+
+def backfill_history(stock_code, years):
+    """向外部來源下載最近 years 年的歷史併入本地資料庫，回傳併入後的K棒數"""
+    fetch_range = f"{years}y"
+    for provider in history_providers.providers():
+        if not provider.persist or provider.synthetic:
+            continue
+        try:
+            ohlc_data = provider.fetch(stock_code, fetch_range, None)
+        except Exception as e:
+            logger.warning(f"❌ {stock_code}: {provider.name} 補抓 {fetch_range} 歷史失敗 - {e}")
+            continue
+        if ohlc_data:
+            return history_store.merge(stock_code, ohlc_data)
+    return history_store.bar_count(stock_code)
+
+def backfill_histories(stock_codes, years, workers=SCREEN_FETCH_WORKERS, progress_callback=None, cancel_event=None):
+    """以有限並行度補抓多支股票的長期歷史，回傳補抓失敗的股票清單"""
+    failed = []
+    logger.info(f"補抓 {len(stock_codes)} 支股票最近 {years} 年的歷史資料...")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(backfill_history, stock_code, years) for stock_code in stock_codes]
+        try:
+            for index, (stock_code, future) in enumerate(zip(stock_codes, futures), 1):
+                try:
+                    if not future.result():
+                        failed.append(stock_code)
+                except Exception as e:
+                    logger.warning(f"補抓股票 {stock_code} 歷史時發生錯誤: {e}")
+                    failed.append(stock_code)
+                if cancel_event is not None and cancel_event.is_set():
+                    raise JobCancelled()
+                if progress_callback and index % SCREEN_COMPUTE_CHUNK == 0:
+                    progress_callback(index, len(stock_codes), None)
+        finally:
+            for future in futures:
+                future.cancel()
+    return failed
+
+def parse_backtest_options(options, snapshot):
+    """檢查回測參數，回傳 run_market_backtest 的關鍵字引數；格式不符時拋出 ValueError"""
+    stock_codes = options.get('codes')
+    if stock_codes is None:
+        stock_codes = list(snapshot.stocks.keys())
+    elif isinstance(stock_codes, str):
+        stock_codes = [code.strip() for code in stock_codes.split(',') if code.strip()]
+    else:
+        stock_codes = [str(code).strip() for code in stock_codes]
+    
+    dates = {}
+    for name in ('from', 'to'):
+        value = options.get(name)
+        if value in (None, ''):
+            dates[name] = None
+            continue
+        dates[name] = normalize_trade_date(str(value))
+        if dates[name] is None:
+            raise ValueError(f"{name} 日期格式錯誤: {value}")
+    
+    backfill_years = options.get('backfill_years')
+    if backfill_years is not None:
+        backfill_years = int(backfill_years)
+        if not 1 <= backfill_years <= BACKTEST_MAX_BACKFILL_YEARS:
+            raise ValueError(f"backfill_years 必須介於 1 到 {BACKTEST_MAX_BACKFILL_YEARS}")
+    
+    return {
+        'stock_codes': stock_codes,
+        'horizons': parse_horizons(options.get('horizons')),
+        'params': normalize_params(options.get('params')),
+        'start_date': dates['from'],
+        'end_date': dates['to'],
+        'backfill_years': backfill_years
+    }
+
+def run_market_backtest(snapshot, stock_codes, horizons=DEFAULT_HORIZONS, params=None, start_date=None,
+                        end_date=None, backfill_years=None, progress_callback=None, cancel_event=None):
+    """以本地歷史資料庫回測黃柱信號（backfill_years 指定時先補抓長期歷史），回傳API回應內容"""
+    started = time.monotonic()
+    failed = []
+    if backfill_years:
+        failed = backfill_histories(stock_codes, backfill_years, progress_callback=progress_callback,
+                                    cancel_event=cancel_event)
+    
+    histories = {}
+    for stock_code in stock_codes:
+        columns = history_store.load(stock_code)
+        if columns is not None:
+            histories[stock_code] = columns
+    
+    compute_started = time.monotonic()
+    result = run_backtest(histories, horizons, params, start_date, end_date)
+    compute_ms = round((time.monotonic() - compute_started) * 1000, 1)
+    
+    for stock in result['per_stock']:
+        current_data = snapshot.stocks.get(stock['code'])
+        if current_data:
+            stock['name'] = current_data['name']
+            stock['market'] = current_data.get('market') or MARKET_TWSE
+    if progress_callback:
+        progress_callback(len(stock_codes), len(stock_codes), None)
+    
+    return {
+        'success': True,
+        **result,
+        'requested_stocks': len(stock_codes),
+        'missing_history': len(stock_codes) - result['stocks'],
+        'backfill_failed': failed,
+        'compute_ms': compute_ms,
+        'elapsed_ms': round((time.monotonic() - started) * 1000)
+    }
+
+# 自動更新排程：資料公布後更新快照並以較少的並行度預先計算全市場篩選
+REFRESH_SCHEDULER_ENABLED = os.environ.get('REFRESH_SCHEDULER_ENABLED', '1') == '1'
+SCHEDULER_FETCH_WORKERS = int(os.environ.get('SCHEDULER_FETCH_WORKERS', 8))
+SCHEDULER_SCREEN_TIMEOUT = int(os.environ.get('SCHEDULER_SCREEN_TIMEOUT', 1800))
+
+def run_scheduled_refresh(session):
+    """排程工作：更新到指定交易日的快照並預先計算篩選，完成時回傳True"""
+    session_date = session.strftime('%Y%m%d')
+    snapshot, _ = update_flight.do('stocks', refresh_stocks_data, False)
+    if not snapshot or snapshot.data_date != session_date:
+        logger.info(f"證交所尚未提供交易日 {session_date} 的資料，稍後重試")
+        return False
+    
+    if result_cache.peek_screen(snapshot.data_date, INDICATOR_PARAMS_KEY) is not None:
+        return True
+    
+    job, shared = submit_screen_job(snapshot, workers=SCHEDULER_FETCH_WORKERS,
+                                    params={'trigger': 'scheduler', 'session': session_date})
+    logger.info(f"排程預先計算篩選：工作 {job.job_id}{'（併入進行中的工作）' if shared else ''}")
+    if not job.wait(SCHEDULER_SCREEN_TIMEOUT):
+        logger.warning(f"排程篩選工作 {job.job_id} 超過 {SCHEDULER_SCREEN_TIMEOUT} 秒仍未完成")
+        return False
+    # 有獲取失敗時不會快取整體結果，下一個排程時間點只重試失敗的股票
+    return result_cache.peek_screen(snapshot.data_date, INDICATOR_PARAMS_KEY) is not None
+
+refresh_scheduler = RefreshScheduler(
+    trading_calendar,
+    run_scheduled_refresh,
+    offsets=parse_offsets(os.environ.get('REFRESH_SCHEDULE_OFFSETS')),
+    jitter_seconds=int(os.environ.get('REFRESH_SCHEDULE_JITTER', 60)),
+    catch_up=os.environ.get('REFRESH_SCHEDULE_CATCH_UP', '1') == '1',
+    lock_path=f"{SHARED_SNAPSHOT_PATH}.scheduler.lock"
+)
+
+# worker啟動時背景探測歷史資料來源的時間預算
+PROVIDER_PROBE_TIMEOUT = int(os.environ.get('PROVIDER_PROBE_TIMEOUT_MS', 5000)) / 1000
+
+def probe_history_providers():
+    """在背景執行緒探測所有歷史資料來源（gunicorn 於每個worker fork 後呼叫），不延遲worker啟動
+    
+    探測經由共用限流器並以 PROVIDER_PROBE_TIMEOUT 為時間預算；逾時不算探測完成，
+    由第一次取用來源時（ProviderRegistry.providers）再探測。
+    """
+    def probe():
+        try:
+            with deadline_scope(Deadline(PROVIDER_PROBE_TIMEOUT)):
+                history_providers.probe_all(force=False)
+        except DeadlineExceeded:
+            logger.info("歷史資料來源探測超過時間預算，改在第一次取用時探測")
+        except Exception as e:
+            logger.warning(f"探測歷史資料來源時發生錯誤: {e}")
+    
+    thread = threading.Thread(target=probe, name='provider-probe', daemon=True)
+    thread.start()
+    return thread
+
+def start_refresh_scheduler():
+    """啟動自動更新排程（gunicorn 於每個worker fork 後呼叫，只有取得排程鎖的worker會執行）"""
+    if REFRESH_SCHEDULER_ENABLED:
+        refresh_scheduler.start()
 
 @app.route('/api/screen', methods=['POST'])
 def screen_stocks():
-    """篩選股票"""
+    """篩選股票（建立背景工作並立即回傳工作ID；wait=true時同步等待結果）
+    
+    帶 deadline_ms 時最多等待該時間：期限內完成就回傳完整結果，否則回傳目前已完成的部分與覆蓋率，
+    其餘股票在背景繼續計算並寫入快取，之後的請求直接取得完整結果。
+    """
     try:
-        current_time = get_taiwan_time()
+        snapshot = market_snapshot
         
         # 檢查是否有股票資料
-        if not stocks_data:
+        if not snapshot:
             return jsonify({
                 'success': False,
                 'error': '請先更新股票資料'
             }), 400
         
-        # 獲取所有股票的完整資料（全部股票分析）
-        all_stocks_data = []
-        total_stocks = len(stocks_data)
-        processed_count = 0
-        
-        logger.info(f"開始分析 {total_stocks} 支股票的Pine Script指標...")
-        
-        # 分批處理以避免超時（減少批次大小）
-        batch_size = 10  # 從50減少到10支股票每批
-        stock_codes = list(stocks_data.keys())
-        
-        # 限制總處理數量以避免超時
-        max_stocks = min(1044, len(stock_codes))  # 最多處理1044支股票
-        stock_codes = stock_codes[:max_stocks]
-        
-        logger.info(f"為確保穩定性，本次處理前 {max_stocks} 支上市股票")
-        
-        for i in range(0, len(stock_codes), batch_size):
-            batch_codes = stock_codes[i:i+batch_size]
-            logger.info(f"處理第 {i//batch_size + 1} 批股票 ({len(batch_codes)} 支)...")
-            
-            for stock_code in batch_codes:
-                try:
-                    # 使用簡單的超時機制，不依賴signal
-                    import time
-                    start_time = time.time()
-                    
-                    stock_data = get_stock_web_data(stock_code)
-                    
-                    # 檢查是否超時
-                    if time.time() - start_time > 10:  # 10秒超時
-                        logger.warning(f"股票 {stock_code} 處理超時，跳過")
-                        continue                
-                    if stock_data:
-                        all_stocks_data.append({
-                            'code': stock_code,
-                            **stock_data
-                        })
-                        processed_count += 1
-                        
-                        # 每處理5支股票記錄一次進度
-                        if processed_count % 5 == 0:
-                            logger.info(f"已處理 {processed_count}/{max_stocks} 支股票...")
-                            
-                except Exception as e:
-                    logger.warning(f"處理股票 {stock_code} 時發生錯誤: {e}")
-                    continue
-        
-        logger.info(f"完成股票分析，共處理 {processed_count} 支股票")
-        
-        # 篩選符合Pine Script主力進場條件的股票（嚴格條件）
-        filtered_stocks = []
-        analysis_details = []
-        
-        for stock in all_stocks_data:
-            # 記錄分析詳情
-            analysis_details.append({
-                'code': stock['code'],
-                'name': stock['name'],
-                'fund_trend': stock['fund_trend'],
-                'multi_short_line': stock['multi_short_line'],
-                'is_crossover': stock.get('is_crossover', False),
-                'is_oversold': stock.get('is_oversold', False),
-                'banker_entry_signal': stock.get('banker_entry_signal', False),
-                'signal_status': stock['signal_status']
-            })
-            
-            # 嚴格的Pine Script主力進場條件：只有banker_entry_signal為True才符合
-            if stock.get('banker_entry_signal', False):
-                filtered_stocks.append(stock)
-        
-        # 按評分排序
-        filtered_stocks.sort(key=lambda x: x['score'], reverse=True)
-        
-        # 記錄篩選結果
-        logger.info(f"黃柱篩選結果:")
-        logger.info(f"  總共分析: {len(all_stocks_data)} 支股票")
-        logger.info(f"  符合條件: {len(filtered_stocks)} 支股票")
-        
-        for detail in analysis_details:
-            if detail['banker_entry_signal']:
-                logger.info(f"  🟡 {detail['code']} {detail['name']}: 資金流向={detail['fund_trend']}, 多空線={detail['multi_short_line']}, crossover={detail['is_crossover']}, 超賣={detail['is_oversold']}, 黃柱={detail['banker_entry_signal']}")
+        options = request.get_json(silent=True) or {}
+        deadline_ms = options.get('deadline_ms', request.args.get('deadline_ms'))
+        if deadline_ms is not None:
+            try:
+                deadline_ms = int(deadline_ms)
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'deadline_ms 必須是整數毫秒'}), 400
+            if deadline_ms < 0:
+                return jsonify({'success': False, 'error': 'deadline_ms 不可為負數'}), 400
+            return jsonify(run_screen_with_deadline(snapshot, deadline_ms))
+        
+        if options.get('wait') or request.args.get('wait') in ('1', 'true'):
+            result, shared = screen_flight.do(get_screen_key(snapshot), run_screen, snapshot=snapshot)
+            return jsonify({**result, 'shared': shared})
+        
+        job, shared = submit_screen_job(snapshot)
+        if shared:
+            logger.info(f"併入進行中的篩選工作 {job.job_id}")
+        else:
+            logger.info(f"已建立篩選工作 {job.job_id}")
         
         return jsonify({
             'success': True,
-            'data': filtered_stocks,
-            'total': len(filtered_stocks),
-            'message': f'黃柱篩選完成：{len(filtered_stocks)} 支出現黃柱信號（已處理 {processed_count}/{max_stocks} 支股票）',
-            'query_time': current_time.isoformat(),
-            'data_date': data_date,
-            'analysis_summary': {
-                'total_analyzed': processed_count,
-                'total_available': total_stocks,
-                'meets_criteria': len(filtered_stocks),
-                'criteria': '黃柱信號：crossover(資金流向, 多空線) AND 多空線 < 25 (當日或前一日)',
-                'market_coverage': f'{(processed_count/total_stocks*100):.1f}%' if total_stocks > 0 else '0%'
-            }
-        })
+            'job_id': job.job_id,
+            'status': job.status,
+            'status_url': f'/api/screen/{job.job_id}',
+            'shared': shared
+        }), 202
         
     except Exception as e:
         logger.error(f"篩選股票時發生錯誤: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/screen/stream', methods=['GET', 'POST'])
+def screen_stocks_stream():
+    """串流篩選結果：每找到一支黃柱股票或完成一段就立即輸出
+    
+    預設輸出NDJSON（每行一個JSON事件），format=sse 時輸出Server-Sent Events。
+    """
+    snapshot = market_snapshot
+    if not snapshot:
+        return jsonify({
+            'success': False,
+            'error': '請先更新股票資料'
+        }), 400
+    
+    use_sse = request.args.get('format') == 'sse'
+    
+    def generate():
+        try:
+            for event in iter_screen_events(snapshot):
+                payload = json.dumps(event, ensure_ascii=False)
+                if use_sse:
+                    yield f"event: {event['type']}\ndata: {payload}\n\n"
+                else:
+                    yield payload + '\n'
+        except Exception as e:
+            logger.error(f"串流篩選時發生錯誤: {e}")
+            payload = json.dumps({'type': 'failed', 'error': str(e)}, ensure_ascii=False)
+            yield f"event: failed\ndata: {payload}\n\n" if use_sse else payload + '\n'
+    
+    mimetype = 'text/event-stream' if use_sse else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/screen/sweep', methods=['POST'])
+def sweep_screen_params():
+    """以多組指標參數篩選：param_sets 為參數組清單，grid 為 {參數: 值清單} 網格（兩者可並用）
+    
+    預設建立背景工作並回傳工作ID（以 /api/screen/<job_id> 查詢），wait=true 時同步等待結果。
+    """
+    snapshot = market_snapshot
+    if not snapshot:
+        return jsonify({'success': False, 'error': '請先更新股票資料'}), 400
+    
+    options = request.get_json(silent=True) or {}
+    try:
+        param_sets = build_param_sets(options.get('param_sets'), options.get('grid'), max_sets=SWEEP_MAX_SETS)
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'success': False, 'error': f'參數格式錯誤: {e}'}), 400
+    
+    try:
+        if options.get('wait') or request.args.get('wait') in ('1', 'true'):
+            return jsonify(run_parameter_sweep(snapshot, param_sets))
+        
+        job, shared = submit_sweep_job(snapshot, param_sets)
+        return jsonify({
+            'success': True,
+            'job_id': job.job_id,
+            'status': job.status,
+            'status_url': f'/api/screen/{job.job_id}',
+            'param_sets': len(param_sets),
+            'shared': shared
+        }), 202
+    except Exception as e:
+        logger.error(f"參數掃描時發生錯誤: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/backtest', methods=['POST'])
+def backtest_signals():
+    """回測黃柱信號：horizons 為持有天數清單（預設 5/10/20），from/to 限制信號日期，
+    codes 限制股票（預設全市場），params 為指標參數（同參數掃描），backfill_years 先補抓長期歷史
+    
+    預設建立背景工作並回傳工作ID（以 /api/screen/<job_id> 查詢），wait=true 時同步等待結果。
+    """
+    snapshot = market_snapshot
+    options = request.get_json(silent=True) or {}
+    try:
+        backtest_options = parse_backtest_options(options, snapshot)
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'success': False, 'error': f'參數格式錯誤: {e}'}), 400
+    
+    try:
+        if options.get('wait') or request.args.get('wait') in ('1', 'true'):
+            return jsonify(run_market_backtest(snapshot, **backtest_options))
+        
+        job, shared = research_job_manager.submit(
+            lambda job: run_market_backtest(snapshot, **backtest_options, progress_callback=job.update_progress,
+                                            cancel_event=job.cancel_event),
+            params={'type': 'backtest', 'stocks': len(backtest_options['stock_codes']),
+                    'horizons': list(backtest_options['horizons'])})
+        return jsonify({
+            'success': True,
+            'job_id': job.job_id,
+            'status': job.status,
+            'status_url': f'/api/screen/{job.job_id}',
+            'shared': shared
+        }), 202
+    except Exception as e:
+        logger.error(f"回測時發生錯誤: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/screen/<job_id>')
+def get_screen_job(job_id):
+    """查詢篩選工作的進度與結果"""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '找不到此篩選工作'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+@app.route('/api/screen/<job_id>', methods=['DELETE'])
+def cancel_screen_job(job_id):
+    """取消篩選工作：排隊中的獲取不再執行，在途的請求在下一次檢查時停止"""
+    for manager in job_managers:
+        job = manager.cancel(job_id)
+        if job is not None:
+            return jsonify({'success': True, **job.to_dict(include_result=False)}), 202
+    return jsonify({'success': False, 'error': '找不到此篩選工作'}), 404
+
+@app.route('/api/screen/jobs')
+def list_screen_jobs():
+    """列出最近的篩選與研究工作（不含完整結果），新的在前"""
+    jobs = [job for manager in job_managers for job in manager.list_jobs()]
+    jobs.sort(key=lambda job: job.created_at, reverse=True)
+    return jsonify({
+        'success': True,
+        'jobs': [job.to_dict(include_result=False) for job in jobs]
+    })
+
 @app.route('/api/health')
 def health_check():
     """健康檢查"""
+    snapshot = market_snapshot
+    now = get_taiwan_time()
     return jsonify({
         'status': 'healthy',
-        'timestamp': get_taiwan_time().isoformat(),
-        'stocks_count': len(stocks_data),
-        'last_update': last_update_time.isoformat() if last_update_time else None,
-        'data_date': data_date,
-        'is_updating': is_updating
+        'timestamp': now.isoformat(),
+        'stocks_count': len(snapshot.stocks),
+        'last_update': snapshot.last_update_time.isoformat() if snapshot.last_update_time else None,
+        'data_date': snapshot.data_date,
+        'snapshot_version': snapshot.version,
+        'latest_session': get_latest_trading_date(),
+        'next_publish_time': trading_calendar.next_publish_time(now).isoformat(),
+        'is_updating': is_updating,
+        'cache': result_cache.stats(),
+        'yahoo_rate_limiter': yahoo_rate_limiter.stats(),
+        'history_providers': history_providers.stats(),
+        'refresh_scheduler': refresh_scheduler.stats(),
+        'signal_prefilter': signal_prefilter.stats(),
+        'indicator_pool': indicator_pool.stats()
     })
 
 if __name__ == '__main__':
     # 啟動時更新一次股票資料
     logger.info("應用啟動，開始初始化股票資料...")
+    load_warm_start_state()
     update_stocks_data()
+    probe_history_providers()
+    start_refresh_scheduler()
     
     # 啟動Flask應用 - 適配Render環境
     port = int(os.environ.get('PORT', 10000))
@@ -0,0 +1,146 @@
+"""以asyncio為基礎的資料獲取層
+
+所有請求都在同一個背景事件迴圈上執行，透過 aiohttp 連線池限制總連線數與
+每個主機的連線數，因此數千個 chart 請求可以同時在途而不需要每個請求一個執行緒。
+Flask 路由（同步 gunicorn worker）透過 *_sync 方法呼叫，不需要改成非同步。
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+import aiohttp
+from multidict import CIMultiDict
+
+from rate_limiter import THROTTLED, RateLimitedError, classify_status, parse_retry_after
+from yahoo_chart import get_chart_params, get_chart_url, parse_chart_response
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+
+class AsyncDataClient:
+    """在背景執行緒的事件迴圈上執行HTTP請求，並提供同步介面"""
+
+    def __init__(self, total_limit=200, per_host_limit=32, timeout=10, rate_limiter=None):
+        self.total_limit = total_limit
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter  # AdaptiveRateLimiter，Yahoo chart 請求共用
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='async-data-client', daemon=True)
+        self._thread.start()
+        self._session = self._call(self._create_session())
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _call(self, coroutine):
+        """在事件迴圈上執行coroutine並等待結果（供同步程式碼呼叫）"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _create_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.total_limit,
+            limit_per_host=self.per_host_limit,
+            ssl=False,
+            ttl_dns_cache=300
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': DEFAULT_USER_AGENT},
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    async def get_json(self, url, params=None, timeout=None):
+        """GET並解析JSON，非2xx狀態碼會拋出 aiohttp.ClientResponseError"""
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        async with self._session.get(url, params=params, timeout=request_timeout) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def get_bytes(self, url, headers=None, timeout=None):
+        """GET原始內容，回傳 (狀態碼, 回應標頭, 內容)；304視為成功，其他非2xx拋出例外
+
+        回應標頭複製為不分大小寫的 CIMultiDict（與 requests 的回應標頭相同），
+        伺服器以小寫送出 etag 時 headers.get('ETag') 仍取得到。
+        """
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        async with self._session.get(url, headers=headers, timeout=request_timeout) as response:
+            if response.status != 304:
+                response.raise_for_status()
+            return response.status, CIMultiDict(response.headers), await response.read()
+
+    async def fetch_chart(self, stock_code, fetch_range='3mo'):
+        """獲取單一股票的Yahoo chart並解析為OHLC清單，上游限流時拋出 RateLimitedError"""
+        if self.rate_limiter is None:
+            data = await self.get_json(get_chart_url(stock_code), params=get_chart_params(fetch_range))
+            return parse_chart_response(data)
+
+        async with self.rate_limiter.slot_async() as permit:
+            try:
+                async with self._session.get(get_chart_url(stock_code), params=get_chart_params(fetch_range)) as response:
+                    outcome = classify_status(response.status)
+                    permit.record(outcome, parse_retry_after(response.headers.get('Retry-After')))
+                    if outcome == THROTTLED:
+                        raise RateLimitedError(f"HTTP {response.status}", permit.retry_after)
+                    response.raise_for_status()
+                    data = await response.json(content_type=None)
+            except asyncio.TimeoutError:
+                permit.record(THROTTLED)
+                raise RateLimitedError("請求逾時")
+        return parse_chart_response(data)
+
+    async def fetch_charts(self, fetch_ranges, timeout=None):
+        """同時送出多支股票的chart請求
+
+        fetch_ranges 為 {股票代碼: range參數}；回傳 {股票代碼: (OHLC清單, 錯誤訊息)}，
+        成功時錯誤訊息為None。timeout 為每支股票（含等待限流名額）的時間上限，
+        逾時的請求會被取消並中斷連線。
+        """
+        codes = list(fetch_ranges)
+        results = await asyncio.gather(
+            *(asyncio.wait_for(self.fetch_chart(code, fetch_ranges[code]), timeout) for code in codes),
+            return_exceptions=True
+        )
+
+        charts = {}
+        for code, result in zip(codes, results):
+            if isinstance(result, asyncio.TimeoutError):
+                charts[code] = (None, "超過時間預算")
+            elif isinstance(result, Exception):
+                charts[code] = (None, str(result) or type(result).__name__)
+            elif not result:
+                charts[code] = (None, "無資料")
+            else:
+                charts[code] = (result, None)
+        return charts
+
+    # 同步介面
+
+    def get_json_sync(self, url, params=None, timeout=None):
+        return self._call(self.get_json(url, params=params, timeout=timeout))
+
+    def get_bytes_sync(self, url, headers=None, timeout=None):
+        return self._call(self.get_bytes(url, headers=headers, timeout=timeout))
+
+    def fetch_charts_sync(self, fetch_ranges, timeout=None, cancel_event=None):
+        """fetch_charts 的同步版本；cancel_event 觸發時取消所有在途請求並拋出 CancelledError"""
+        future = asyncio.run_coroutine_threadsafe(self.fetch_charts(fetch_ranges, timeout), self._loop)
+        if cancel_event is None:
+            return future.result()
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except concurrent.futures.TimeoutError:
+                if cancel_event.is_set():
+                    future.cancel()
+                    raise concurrent.futures.CancelledError("工作已取消")
+
+    def close(self):
+        """關閉連線池並停止事件迴圈"""
+        self._call(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
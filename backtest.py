@@ -0,0 +1,200 @@
+"""黃柱信號的全市場歷史回測
+
+以 (股票 × 交易日) 面板一次算出每支股票每一天的資金流向、多空線與黃柱旗標，
+不需要對每個歷史前綴重新呼叫 calculate_pine_script_indicators。
+信號日以收盤價進場，計算持有 horizon 個交易日後的報酬與期間最大回檔（以期間最低價計），
+並彙整成每支股票與全市場的交易次數、平均/中位數報酬、勝率與回檔，
+全市場另附同期間所有K棒的無條件報酬作為比較基準。
+
+與篩選的差異：篩選只用最近約60根K棒計算，多空線EMA的起點不同，數值差距在小數點後數位，
+只有恰好落在門檻邊界的信號可能不同。
+"""
+import logging
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from parameter_sweep import get_params_key, normalize_params, required_bars
+from pine_indicators import (
+    build_ohlc_panel,
+    bull_bear_series,
+    crossover_flags,
+    fund_flow_series,
+    mask_panel,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HORIZONS = (5, 10, 20)
+MAX_HORIZON = 250
+
+
+def parse_horizons(values):
+    """整理持有天數清單（去重、排序），格式不符時拋出 ValueError"""
+    if values is None:
+        return DEFAULT_HORIZONS
+    if isinstance(values, str):
+        values = [part for part in values.split(',') if part.strip()]
+    try:
+        horizons = sorted({int(value) for value in values})
+    except (TypeError, ValueError):
+        raise ValueError(f"持有天數格式錯誤: {values!r}")
+    if not horizons or horizons[0] < 1 or horizons[-1] > MAX_HORIZON:
+        raise ValueError(f"持有天數必須介於 1 到 {MAX_HORIZON}")
+    return tuple(horizons)
+
+
+def build_date_panel(histories, codes, starts, width):
+    """與 build_ohlc_panel 對齊的交易日期面板（YYYYMMDD整數，留白處為0）"""
+    dates = np.zeros((len(codes), width), dtype=np.int64)
+    for row, code in enumerate(codes):
+        values = histories[code]['date']
+        if len(values):
+            dates[row, starts[row]:] = values
+    return dates
+
+
+def signal_series(opens, highs, lows, closes, starts, params):
+    """每支股票每一天的黃柱旗標（crossover 且 多空線 < 超賣門檻）"""
+    opens, highs, lows, closes = mask_panel(opens, highs, lows, closes, starts)
+    fund_flow = fund_flow_series(highs, lows, closes, starts, window=params['fund_window'],
+                                 fast=params['fund_fast'], slow=params['fund_slow'], factor=params['fund_factor'])
+    bull_bear_line = bull_bear_series(opens, highs, lows, closes, starts, window=params['bull_window'],
+                                      ema_period=params['bull_ema'])
+    _, _, signal = crossover_flags(fund_flow, bull_bear_line, params['oversold'])
+    return signal
+
+
+def forward_returns(closes, horizon):
+    """第t天收盤進場、持有horizon天後收盤出場的報酬；之後不足horizon天的位置為NaN"""
+    result = np.full(closes.shape, np.nan)
+    if closes.shape[1] > horizon:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result[:, :-horizon] = closes[:, horizon:] / closes[:, :-horizon] - 1
+    return result
+
+
+def forward_drawdowns(closes, lows, horizon):
+    """持有期間（t+1 到 t+horizon）最低價相對進場價的最大回檔（≤0）；不足horizon天的位置為NaN"""
+    result = np.full(closes.shape, np.nan)
+    if closes.shape[1] > horizon:
+        lowest = sliding_window_view(lows[:, 1:], horizon, axis=-1).min(axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result[:, :-horizon] = np.minimum(lowest / closes[:, :-horizon] - 1, 0)
+    return result
+
+
+def _percent(value):
+    return None if value is None or not np.isfinite(value) else round(float(value) * 100, 2)
+
+
+def _summarize(returns, drawdowns):
+    """一組交易的統計（報酬與回檔以百分比表示）"""
+    if not len(returns):
+        return {'trades': 0, 'avg_return_pct': None, 'median_return_pct': None, 'hit_rate_pct': None,
+                'avg_drawdown_pct': None, 'max_drawdown_pct': None}
+    return {
+        'trades': int(len(returns)),
+        'avg_return_pct': _percent(returns.mean()),
+        'median_return_pct': _percent(np.median(returns)),
+        'hit_rate_pct': _percent((returns > 0).mean()),
+        'avg_drawdown_pct': _percent(drawdowns.mean()),
+        'max_drawdown_pct': _percent(drawdowns.min())
+    }
+
+
+def run_backtest(histories, horizons=DEFAULT_HORIZONS, params=None, start_date=None, end_date=None):
+    """對 {股票代碼: 欄式歷史資料}（date/open/high/low/close 陣列）回測黃柱信號
+
+    start_date / end_date 為 YYYYMMDD 整數，只計入該區間內的信號日；回傳可JSON序列化的結果字典。
+    """
+    params = normalize_params(params)
+    horizons = parse_horizons(horizons)
+    histories = {code: columns for code, columns in histories.items()
+                 if columns is not None and len(columns['date']) >= required_bars(params)}
+
+    codes, panel, starts = build_ohlc_panel(histories)
+    width = panel['close'].shape[1] if codes else 0
+    dates = build_date_panel(histories, codes, starts, width)
+
+    summary = {
+        'params_key': get_params_key(params),
+        'params': params,
+        'horizons': list(horizons),
+        'stocks': len(codes),
+        'first_date': int(dates[dates > 0].min()) if codes else None,
+        'last_date': int(dates.max()) if codes else None
+    }
+    if not codes or width < 2:
+        return {**summary, 'signals': 0, 'market': {}, 'per_stock': []}
+
+    signal = signal_series(panel['open'], panel['high'], panel['low'], panel['close'], starts, params)
+
+    # 只計入指標已有足夠K棒、且在指定區間內的交易日
+    ages = np.arange(width) - starts[:, None]
+    eligible = ages >= required_bars(params) - 1
+    if start_date is not None:
+        eligible &= dates >= int(start_date)
+    if end_date is not None:
+        eligible &= dates <= int(end_date)
+    events = signal & eligible
+
+    signal_counts = events.sum(axis=1)
+    last_signal = np.where(events, dates, 0).max(axis=1)
+
+    market = {}
+    per_horizon = {}
+    for horizon in horizons:
+        returns = forward_returns(panel['close'], horizon)
+        drawdowns = forward_drawdowns(panel['close'], panel['low'], horizon)
+        complete = np.isfinite(returns) & np.isfinite(drawdowns)
+        trades = events & complete
+        baseline = eligible & complete
+
+        stats = _summarize(returns[trades], drawdowns[trades])
+        stats['baseline_avg_return_pct'] = _percent(returns[baseline].mean()) if baseline.any() else None
+        stats['baseline_hit_rate_pct'] = _percent((returns[baseline] > 0).mean()) if baseline.any() else None
+        if stats['avg_return_pct'] is not None and stats['baseline_avg_return_pct'] is not None:
+            stats['excess_return_pct'] = round(stats['avg_return_pct'] - stats['baseline_avg_return_pct'], 2)
+        market[str(horizon)] = stats
+
+        # 每支股票的統計以遮罩加總一次算出
+        counts = trades.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            per_horizon[horizon] = {
+                'trades': counts,
+                'avg_return': np.where(trades, returns, 0).sum(axis=1) / counts,
+                'hit_rate': (trades & (returns > 0)).sum(axis=1) / counts,
+                'avg_drawdown': np.where(trades, drawdowns, 0).sum(axis=1) / counts,
+                'max_drawdown': np.where(trades, drawdowns, np.inf).min(axis=1)
+            }
+
+    per_stock = []
+    for row in np.flatnonzero(signal_counts):
+        stats = {}
+        for horizon in horizons:
+            values = per_horizon[horizon]
+            trades = int(values['trades'][row])
+            stats[str(horizon)] = {
+                'trades': trades,
+                'avg_return_pct': _percent(values['avg_return'][row]) if trades else None,
+                'hit_rate_pct': _percent(values['hit_rate'][row]) if trades else None,
+                'avg_drawdown_pct': _percent(values['avg_drawdown'][row]) if trades else None,
+                'max_drawdown_pct': _percent(values['max_drawdown'][row]) if trades else None
+            }
+        per_stock.append({
+            'code': codes[row],
+            'signals': int(signal_counts[row]),
+            'last_signal_date': int(last_signal[row]),
+            'horizons': stats
+        })
+
+    logger.info(f"回測完成：{len(codes)} 支股票、{int(signal_counts.sum())} 個信號")
+    return {
+        **summary,
+        'bars': int(eligible.sum()),
+        'signals': int(signal_counts.sum()),
+        'stocks_with_signals': len(per_stock),
+        'market': market,
+        'per_stock': per_stock
+    }
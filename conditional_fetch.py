@@ -0,0 +1,88 @@
+"""上游快照的條件式下載
+
+記住上次回應的 ETag / Last-Modified 與內容雜湊，下次請求帶上 If-None-Match /
+If-Modified-Since。上游回應304，或回應內容與上次完全相同時，直接沿用上次解析好的結果，
+不再解析整份資料。
+"""
+import hashlib
+import threading
+
+
+class ConditionalSnapshot:
+    """單一URL的驗證資訊與上次解析結果"""
+
+    def __init__(self, url):
+        self.url = url
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.data = None  # 上次解析的結果
+        self._lock = threading.Lock()
+
+    def request_headers(self):
+        """下次請求要帶的條件式標頭（還沒有解析結果時不帶，確保取得完整內容）"""
+        with self._lock:
+            headers = {}
+            if self.data is None:
+                return headers
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+            return headers
+
+    def unchanged_data(self, status_code, body):
+        """上游內容未變時回傳上次解析結果，否則回傳None"""
+        with self._lock:
+            if self.data is None:
+                return None
+            if status_code == 304:
+                return self.data
+            if self.content_hash is not None and hashlib.sha256(body).hexdigest() == self.content_hash:
+                return self.data
+            return None
+
+    def validators(self):
+        with self._lock:
+            return {'etag': self.etag, 'last_modified': self.last_modified, 'content_hash': self.content_hash}
+
+    def restore(self, validators, data):
+        """由持久化的驗證資訊與解析結果還原（例如worker重新啟動後）"""
+        with self._lock:
+            self.etag = validators.get('etag')
+            self.last_modified = validators.get('last_modified')
+            self.content_hash = validators.get('content_hash')
+            self.data = data
+
+    def commit(self, headers, body, data):
+        """解析成功後記住新的驗證資訊與結果"""
+        with self._lock:
+            self.etag = headers.get('ETag')
+            self.last_modified = headers.get('Last-Modified')
+            self.content_hash = hashlib.sha256(body).hexdigest()
+            self.data = data
+
+
+class CombinedSnapshot:
+    """多個 ConditionalSnapshot 結果的合併；各部分都是同一個物件時沿用上次的合併結果"""
+
+    def __init__(self):
+        self.parts = None
+        self.data = None
+        self._lock = threading.Lock()
+
+    def combine(self, parts, merge):
+        parts = tuple(parts)
+        with self._lock:
+            if self.parts is not None and len(parts) == len(self.parts) and all(
+                    new is old for new, old in zip(parts, self.parts)):
+                return self.data
+            self.parts = parts
+            self.data = merge(parts)
+            return self.data
+
+    def restore(self, parts, data):
+        """由持久化的合併結果與其各部分還原"""
+        with self._lock:
+            self.parts = tuple(parts)
+            self.data = data
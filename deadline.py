@@ -0,0 +1,67 @@
+"""請求的時間預算
+
+Deadline 記錄一段工作最晚必須結束的時間，並可連結取消事件（事件觸發時視同已逾時）。
+以 deadline_scope() 設為目前執行緒的預算後，底層的HTTP請求會用 cap() 把逾時縮短到剩餘時間，
+預算用完就不再送出請求或重試，因此每支股票的獲取時間有確實的上限。
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(TimeoutError):
+    """時間預算已用完或工作已被取消"""
+
+
+class Deadline:
+    """單調時鐘上的截止時間；seconds 為None表示沒有時間限制，只看取消事件"""
+
+    def __init__(self, seconds=None, cancel_event=None):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        self.cancel_event = cancel_event
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def remaining(self):
+        """剩餘秒數（沒有時間限制時回傳None，已取消時回傳0）"""
+        if self.cancelled():
+            return 0.0
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self):
+        if self.cancelled():
+            raise DeadlineExceeded("工作已取消")
+        if self.expired():
+            raise DeadlineExceeded("超過時間預算")
+
+    def cap(self, timeout):
+        """把逾時秒數縮短到剩餘時間，預算已用完時拋出 DeadlineExceeded"""
+        self.check()
+        remaining = self.remaining()
+        return timeout if remaining is None else min(timeout, remaining)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """在這個區塊內把 deadline 設為目前執行緒的時間預算"""
+    previous = getattr(_local, 'deadline', None)
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def current_deadline():
+    """目前執行緒的時間預算，沒有時回傳None"""
+    return getattr(_local, 'deadline', None)
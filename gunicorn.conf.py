@@ -1,8 +1,11 @@
 # Gunicorn配置檔案 - 解決WORKER TIMEOUT問題
+import os
 
 # 基本配置
 bind = "0.0.0.0:10000"
-workers = 1
+# 市場快照以共享記憶體（/dev/shm mmap）在worker間共用，背景工作的狀態寫入共用目錄
+# （SCREEN_JOB_STATE_DIR），任一worker都能查詢與取消 /api/screen/<job_id>，可以開多個worker
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
 
 # 超時配置（關鍵修復）
 timeout = 300  # 從30秒增加到300秒（5分鐘）
@@ -33,3 +36,10 @@ limit_request_field_size = 8190
 # 效能優化
 worker_tmp_dir = "/dev/shm"  # 使用記憶體檔案系統
 
+
+def post_fork(server, worker):
+    """preload_app 時執行緒不會跨fork保留，在每個worker內背景探測歷史資料來源並啟動自動更新排程"""
+    from app import probe_history_providers, start_refresh_scheduler
+    probe_history_providers()
+    start_refresh_scheduler()
+
@@ -0,0 +1,319 @@
+"""歷史資料來源的註冊與健康狀態追蹤
+
+每個來源（本地資料庫、Manus API Hub、直接Yahoo、模擬資料）都是一個 HistoryProvider，
+啟動時只探測一次是否可用。之後依層級、健康狀態與實測延遲排序，
+連續失敗的來源暫停一段時間後才重新探測，因此每支股票只會呼叫真正可能成功的來源。
+"""
+import logging
+import random
+import sys
+import threading
+import time
+from datetime import timedelta
+
+from deadline import DeadlineExceeded
+from rate_limiter import RateLimitedError
+from yahoo_chart import get_yahoo_symbol, parse_chart_response
+
+logger = logging.getLogger(__name__)
+
+# 來源層級：數字小的先嘗試，同層級內依健康狀態與延遲排序
+TIER_LOCAL = 0  # 本地已是最新的資料，不需網路
+TIER_REMOTE = 1  # 外部來源
+TIER_FALLBACK = 2  # 外部來源都失敗時的備用
+
+
+class ProviderUnavailableError(RuntimeError):
+    """真實資料來源暫時停用或故障，不能以模擬資料代替"""
+
+
+class SyntheticHistory(list):
+    """模擬資料來源產生的OHLC清單；以型別與真實資料區分，據此計算的結果不可快取"""
+
+
+def is_synthetic_history(history):
+    return isinstance(history, SyntheticHistory)
+
+
+class HistoryProvider:
+    """歷史資料來源
+
+    fetch() 回傳OHLC清單，該股票沒有資料時回傳None，來源本身故障時拋出例外。
+    persist 為True的來源，下載結果會併入本地歷史資料庫；synthetic 為True表示資料非真實行情。
+    """
+    name = 'provider'
+    tier = TIER_REMOTE
+    persist = False
+    synthetic = False
+
+    def probe(self):
+        """檢查來源是否可用，不可用時拋出例外"""
+
+    def fetch(self, stock_code, fetch_range, days):
+        raise NotImplementedError
+
+
+class LocalStoreProvider(HistoryProvider):
+    """本地歷史資料庫；allow_stale 為False時只在資料已涵蓋最新快照日期時回傳"""
+
+    def __init__(self, store, allow_stale=False):
+        self.store = store
+        self.allow_stale = allow_stale
+        self.name = 'local_store_stale' if allow_stale else 'local_store'
+        self.tier = TIER_FALLBACK if allow_stale else TIER_LOCAL
+
+    def fetch(self, stock_code, fetch_range, days):
+        if fetch_range is not None and not self.allow_stale:
+            return None
+        if self.store.bar_count(stock_code) < 34:
+            return None
+        return self.store.to_ohlc_list(stock_code, days)
+
+
+class ApiHubProvider(HistoryProvider):
+    """Manus API Hub 的 YahooFinance/get_stock_chart"""
+    name = 'manus_api_hub'
+    persist = True
+    SANDBOX_RUNTIME_PATH = '/opt/.manus/.sandbox-runtime'
+
+    def __init__(self):
+        self.client = None
+
+    def probe(self):
+        if self.SANDBOX_RUNTIME_PATH not in sys.path:
+            sys.path.append(self.SANDBOX_RUNTIME_PATH)
+        from data_api import ApiClient
+        self.client = ApiClient()
+
+    def fetch(self, stock_code, fetch_range, days):
+        response = self.client.call_api('YahooFinance/get_stock_chart', query={
+            'symbol': get_yahoo_symbol(stock_code),
+            'region': 'TW',
+            'interval': '1d',
+            'range': fetch_range,
+            'includeAdjustedClose': True
+        })
+        return parse_chart_response(response)
+
+
+class YahooChartProvider(HistoryProvider):
+    """直接呼叫Yahoo chart API；fetch_response(股票代碼, range) 回傳 requests 回應"""
+    name = 'yahoo_chart'
+    persist = True
+    probe_stock_code = '2330'
+
+    def __init__(self, fetch_response):
+        self.fetch_response = fetch_response
+
+    def probe(self):
+        try:
+            if self.fetch(self.probe_stock_code, '5d', 5) is None:
+                raise RuntimeError("探測股票無資料")
+        except RateLimitedError:
+            pass  # 被限流表示來源可連線，由限流器控制送出速度
+
+    def fetch(self, stock_code, fetch_range, days):
+        response = self.fetch_response(stock_code, fetch_range)
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP狀態碼: {response.status_code}")
+        return parse_chart_response(response.json())
+
+
+class SimulatedProvider(HistoryProvider):
+    """以當日收盤價為基準產生固定種子的模擬資料（最後備用）"""
+    name = 'simulated'
+    tier = TIER_FALLBACK
+    synthetic = True
+
+    def __init__(self, get_base_price, get_now):
+        self.get_base_price = get_base_price
+        self.get_now = get_now
+
+    def fetch(self, stock_code, fetch_range, days):
+        base_price = self.get_base_price(stock_code)
+
+        # 生成60天的模擬OHLC資料
+        ohlc_data = []
+        current_date = self.get_now()
+
+        for i in range(60):
+            date = current_date - timedelta(days=59-i)
+
+            # 簡單的隨機波動
+            random.seed(hash(stock_code) + i)  # 確保相同股票產生相同資料
+
+            change_pct = (random.random() - 0.5) * 0.06  # ±3%波動
+            price = base_price * (1 + change_pct * (i / 60))  # 逐漸趨向基準價
+
+            daily_volatility = price * 0.02  # 2%日內波動
+
+            open_price = price + (random.random() - 0.5) * daily_volatility
+            close_price = price + (random.random() - 0.5) * daily_volatility
+            high_price = max(open_price, close_price) + random.random() * daily_volatility * 0.5
+            low_price = min(open_price, close_price) - random.random() * daily_volatility * 0.5
+
+            ohlc_data.append({
+                'date': date.strftime('%Y-%m-%d'),
+                'open': round(open_price, 2),
+                'high': round(high_price, 2),
+                'low': round(low_price, 2),
+                'close': round(close_price, 2),
+                'volume': random.randint(1000, 10000) * 1000
+            })
+
+        return SyntheticHistory(ohlc_data)
+
+
+class ProviderHealth:
+    """單一來源的健康狀態"""
+
+    def __init__(self):
+        self.available = True
+        self.disabled_until = 0.0
+        self.consecutive_failures = 0
+        self.latency = None  # 成功請求延遲的指數移動平均（秒）
+        self.successes = 0
+        self.failures = 0
+        self.last_error = None
+        self.missing = False  # 探測時缺少相依模組：此環境不存在的來源，不算停用
+
+    def record_latency(self, seconds, alpha=0.2):
+        self.latency = seconds if self.latency is None else alpha * seconds + (1 - alpha) * self.latency
+
+
+class ProviderRegistry:
+    """依層級、健康狀態與延遲排序歷史資料來源
+
+    第一次取用時探測所有來源；連續 failure_threshold 次失敗的來源停用
+    retry_interval 秒，之後重新探測一次決定是否恢復。
+    """
+
+    def __init__(self, failure_threshold=5, retry_interval=300):
+        self.failure_threshold = failure_threshold
+        self.retry_interval = retry_interval
+        self._providers = []
+        self._health = {}
+        self._probed = False
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+
+    def register(self, provider):
+        with self._lock:
+            self._providers.append(provider)
+            self._health[provider.name] = ProviderHealth()
+        return provider
+
+    def _probe(self, provider):
+        health = self._health[provider.name]
+        start = time.monotonic()
+        try:
+            provider.probe()
+        except DeadlineExceeded:
+            # 呼叫端的時間預算用完不代表來源故障，不停用來源
+            raise
+        except Exception as e:
+            with self._lock:
+                health.available = False
+                health.missing = isinstance(e, ImportError)
+                health.disabled_until = time.monotonic() + self.retry_interval
+                health.last_error = f"{type(e).__name__}: {e}"
+            logger.info(f"歷史資料來源 {provider.name} 不可用: {health.last_error}")
+            return False
+
+        with self._lock:
+            health.available = True
+            health.missing = False
+            health.consecutive_failures = 0
+            health.record_latency(time.monotonic() - start)
+        logger.info(f"歷史資料來源 {provider.name} 可用（探測 {time.monotonic() - start:.2f} 秒）")
+        return True
+
+    def probe_all(self, force=True):
+        """探測所有已註冊的來源（每個worker啟動時呼叫一次）；force為False時已探測過就略過"""
+        with self._probe_lock:
+            if self._probed and not force:
+                return
+            for provider in list(self._providers):
+                self._probe(provider)
+            self._probed = True
+
+    def providers(self):
+        """目前可用的來源，依層級、是否為模擬資料、是否有近期失敗、延遲排序"""
+        if not self._probed:
+            self.probe_all(force=False)
+
+        # 停用期滿的來源重新探測一次；探測期間其他執行緒仍跳過此來源
+        now = time.monotonic()
+        with self._lock:
+            expired = []
+            for provider in self._providers:
+                health = self._health[provider.name]
+                if not health.available and now >= health.disabled_until:
+                    health.disabled_until = now + self.retry_interval
+                    expired.append(provider)
+        for index, provider in enumerate(expired):
+            try:
+                self._probe(provider)
+            except DeadlineExceeded:
+                # 尚未探測完的來源恢復為停用期滿，下次取用時重新探測
+                with self._lock:
+                    for pending in expired[index:]:
+                        if not self._health[pending.name].available:
+                            self._health[pending.name].disabled_until = 0.0
+                raise
+
+        with self._lock:
+            available = [p for p in self._providers if self._health[p.name].available]
+            return sorted(available, key=lambda p: (
+                p.tier,
+                p.synthetic,  # 模擬資料永遠排在真實資料之後
+                self._health[p.name].consecutive_failures > 0,
+                self._health[p.name].latency if self._health[p.name].latency is not None else float('inf')
+            ))
+
+    def disabled_sources(self):
+        """暫時停用中的真實外部來源名稱（缺少相依模組的來源不列入）"""
+        with self._lock:
+            return [p.name for p in self._providers
+                    if p.tier == TIER_REMOTE and not p.synthetic
+                    and not self._health[p.name].available and not self._health[p.name].missing]
+
+    def record_success(self, provider, seconds):
+        with self._lock:
+            health = self._health[provider.name]
+            health.successes += 1
+            health.consecutive_failures = 0
+            health.record_latency(seconds)
+
+    def record_failure(self, provider, error):
+        """記錄來源故障；限流與時間預算用完不算故障，不會讓來源被停用"""
+        if isinstance(error, (RateLimitedError, DeadlineExceeded)):
+            return
+        with self._lock:
+            health = self._health[provider.name]
+            health.failures += 1
+            health.consecutive_failures += 1
+            health.last_error = str(error) or type(error).__name__
+            if health.consecutive_failures >= self.failure_threshold:
+                health.available = False
+                health.disabled_until = time.monotonic() + self.retry_interval
+                logger.warning(f"歷史資料來源 {provider.name} 連續失敗 {health.consecutive_failures} 次，"
+                               f"暫停 {self.retry_interval} 秒")
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    'name': p.name,
+                    'tier': p.tier,
+                    'available': self._health[p.name].available,
+                    'latency_ms': round(self._health[p.name].latency * 1000, 1)
+                    if self._health[p.name].latency is not None else None,
+                    'successes': self._health[p.name].successes,
+                    'failures': self._health[p.name].failures,
+                    'last_error': self._health[p.name].last_error
+                }
+                for p in self._providers
+            ]
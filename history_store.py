@@ -0,0 +1,213 @@
+"""本地欄式OHLCV歷史資料庫
+
+每支股票存成一個 .npz 檔，內含以交易日期（YYYYMMDD整數）排序的
+date/open/high/low/close/volume 連續陣列。篩選時優先讀取本地資料，
+只向外部補抓缺少的最新區段，並把每日 STOCK_DAY_ALL 快照併入成為新的一列。
+
+多個gunicorn worker共用同一個目錄：讀取-合併-寫回以檔案鎖（fcntl）跨行程序列化，
+各行程的讀取快取以檔案的 inode/修改時間/大小判斷是否已被其他行程改寫。
+"""
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+PRICE_FIELDS = FIELDS[:4]
+
+DEFAULT_HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'history')
+
+
+def normalize_trade_date(value):
+    """將各種日期格式轉為 YYYYMMDD 整數
+
+    支援 'YYYY-MM-DD'、'YYYYMMDD'、民國年 'YYYMMDD'（證交所格式）及 datetime。
+    無法辨識時回傳 None。
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.year * 10000 + value.month * 100 + value.day
+
+    text = str(value).strip().replace('-', '').replace('/', '')
+    if not text.isdigit():
+        return None
+    if len(text) == 8:
+        return int(text)
+    if len(text) == 7:  # 民國年
+        return int(text) + 19110000
+    return None
+
+
+def format_trade_date(value):
+    """YYYYMMDD 整數轉為 'YYYY-MM-DD' 字串"""
+    value = int(value)
+    return f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
+
+
+class HistoryStore:
+    """以股票代碼為單位的欄式歷史資料庫（執行緒安全）"""
+
+    def __init__(self, root=None):
+        self.root = root or os.environ.get('HISTORY_STORE_DIR', DEFAULT_HISTORY_DIR)
+        self._cache = {}  # {股票代碼: (檔案識別, 欄式資料)}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # 序列化本行程內的讀取-合併-寫回
+
+    def _path(self, stock_code):
+        return os.path.join(self.root, f"{stock_code}.npz")
+
+    def _file_key(self, stock_code):
+        """檔案的 (inode, 修改時間, 大小)；os.replace 寫入新檔後必定改變，不存在時回傳None"""
+        try:
+            stat = os.stat(self._path(stock_code))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def _merge_lock(self):
+        """跨行程的合併鎖，避免兩個worker以各自讀到的舊資料互相覆蓋"""
+        os.makedirs(self.root, exist_ok=True)
+        with self._write_lock, open(os.path.join(self.root, '.merge.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self, stock_code):
+        """讀取股票的欄式資料 {'date': ..., 'open': ..., ...}，不存在時回傳None"""
+        file_key = self._file_key(stock_code)
+        with self._lock:
+            if file_key is None:
+                self._cache.pop(stock_code, None)
+                return None
+            cached = self._cache.get(stock_code)
+            if cached is not None and cached[0] == file_key:
+                return cached[1]
+
+        try:
+            with np.load(self._path(stock_code)) as archive:
+                columns = {name: archive[name] for name in ('date',) + FIELDS}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"讀取 {stock_code} 本地歷史資料失敗，忽略: {e}")
+            return None
+
+        with self._lock:
+            self._cache[stock_code] = (file_key, columns)
+        return columns
+
+    def last_date(self, stock_code):
+        """本地資料的最後交易日（YYYYMMDD整數），沒有資料時回傳None"""
+        columns = self.load(stock_code)
+        if columns is None or not len(columns['date']):
+            return None
+        return int(columns['date'][-1])
+
+    def bar_count(self, stock_code):
+        columns = self.load(stock_code)
+        return 0 if columns is None else len(columns['date'])
+
+    def merge(self, stock_code, bars):
+        """將OHLCV清單併入本地資料（同日期以新資料覆蓋），回傳合併後的K棒數
+
+        缺少任一OHLC價格的K棒與 parse_chart_result 相同直接略過，不以0寫入。
+        """
+        rows = {}
+        for bar in bars:
+            date = normalize_trade_date(bar.get('date'))
+            if date is None or any(bar.get(field) is None for field in PRICE_FIELDS):
+                continue
+            rows[date] = bar
+        if not rows:
+            return self.bar_count(stock_code)
+
+        with self._merge_lock():
+            return self._merge_rows(stock_code, rows)
+
+    def _merge_rows(self, stock_code, rows):
+        existing = self.load(stock_code)
+        dates = np.array(sorted(rows), dtype=np.int64)
+        new_columns = {'date': dates}
+        for field in FIELDS:
+            new_columns[field] = np.array([float(rows[d].get(field) or 0) for d in dates])
+
+        if existing is not None and len(existing['date']):
+            keep = ~np.isin(existing['date'], dates)
+            merged = {name: np.concatenate([existing[name][keep], new_columns[name]]) for name in new_columns}
+            order = np.argsort(merged['date'], kind='stable')
+            merged = {name: np.ascontiguousarray(values[order]) for name, values in merged.items()}
+        else:
+            merged = new_columns
+
+        self._write(stock_code, merged)
+        return len(merged['date'])
+
+    def merge_snapshot(self, snapshot, previous_session):
+        """將 fetch_real_stock_data 的當日快照併入已有歷史的股票
+
+        previous_session(今日YYYYMMDD整數) 回傳前一交易日（YYYYMMDD整數）。只有本地資料停在今日或前一交易日的
+        股票才併入；停在更早交易日的股票若先併入今日，最後日期會變成今日而之間缺少的交易日永遠不會補抓，
+        因此略過，留給下一次獲取時一併補齊。尚無本地歷史的股票不建立單列檔案，等第一次篩選時再完整下載。
+        回傳併入的股票數。
+        """
+        merged_count = 0
+        stale_count = 0
+        for stock_code, data in snapshot.items():
+            last_date = self.last_date(stock_code)
+            today = normalize_trade_date(data.get('date'))
+            if last_date is None or today is None:
+                continue
+            try:
+                if last_date != today and last_date != previous_session(today):
+                    stale_count += 1
+                    continue
+                self.merge(stock_code, [data])
+                merged_count += 1
+            except Exception as e:
+                logger.warning(f"併入 {stock_code} 當日資料失敗: {e}")
+        logger.info(f"已將當日快照併入 {merged_count} 支股票的本地歷史資料（{stale_count} 支本地資料落後，留待補抓）")
+        return merged_count
+
+    def to_ohlc_list(self, stock_code, days=None):
+        """以 fetch_historical_data_for_indicators 的格式回傳最近days天的OHLC清單"""
+        columns = self.load(stock_code)
+        if columns is None:
+            return None
+        start = 0 if days is None else max(0, len(columns['date']) - days)
+        return [
+            {
+                'date': format_trade_date(columns['date'][i]),
+                'open': float(columns['open'][i]),
+                'high': float(columns['high'][i]),
+                'low': float(columns['low'][i]),
+                'close': float(columns['close'][i]),
+                'volume': int(columns['volume'][i])
+            }
+            for i in range(start, len(columns['date']))
+        ]
+
+    def _write(self, stock_code, columns):
+        """以暫存檔加 os.replace 原子寫入"""
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **columns)
+            os.replace(tmp_path, self._path(stock_code))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        file_key = self._file_key(stock_code)
+        with self._lock:
+            self._cache[stock_code] = (file_key, columns)
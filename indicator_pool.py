@@ -0,0 +1,97 @@
+"""以多個行程計算技術指標
+
+篩選的I/O（歷史資料獲取）在執行緒中進行，指標計算則交給行程池，不受GIL限制而能用滿多核心。
+傳給子行程的不是OHLC字典清單，而是一段緊湊的二進位資料：
+各股票K棒數（int32）與依序串接的 open/high/low/close（float64, K棒數 × 4），
+子行程以 numpy.frombuffer 直接還原成面板，不需要逐筆反序列化。
+"""
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+from pine_indicators import complete_bars, summarize_panel
+
+logger = logging.getLogger(__name__)
+
+OHLC_FIELDS = ('open', 'high', 'low', 'close')
+
+
+def pack_histories(histories):
+    """{股票代碼: OHLC清單} 轉為 (股票代碼清單, K棒數bytes, OHLC bytes)
+
+    缺少任一OHLC價格的K棒（停牌或資料缺漏）與 parse_chart_result 相同直接略過，不當成0計算。
+    """
+    codes = list(histories)
+    rows = [[[bar[field] for field in OHLC_FIELDS] for bar in complete_bars(histories[code])] for code in codes]
+    lengths = np.array([len(bars) for bars in rows], dtype=np.int32)
+    ohlc = np.empty((int(lengths.sum()), len(OHLC_FIELDS)), dtype=np.float64)
+    position = 0
+    for bars in rows:
+        if not bars:
+            continue
+        ohlc[position:position + len(bars)] = bars
+        position += len(bars)
+    return codes, lengths.tobytes(), ohlc.tobytes()
+
+
+def unpack_panel(lengths_bytes, ohlc_bytes):
+    """pack_histories 的反向：回傳 (open, high, low, close 面板, starts)，較短的歷史靠右對齊"""
+    lengths = np.frombuffer(lengths_bytes, dtype=np.int32)
+    ohlc = np.frombuffer(ohlc_bytes, dtype=np.float64).reshape(-1, len(OHLC_FIELDS))
+    width = int(lengths.max()) if len(lengths) else 0
+    starts = width - lengths.astype(int)
+
+    panels = np.full((len(OHLC_FIELDS), len(lengths), width), np.nan)
+    if len(ohlc):
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        columns = np.arange(len(ohlc)) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+        panels[:, rows, columns] = ohlc.T
+    return panels[0], panels[1], panels[2], panels[3], starts
+
+
+def compute_packed(codes, lengths_bytes, ohlc_bytes):
+    """子行程的工作：還原面板並計算指標，回傳 {股票代碼: 結果字典}"""
+    opens, highs, lows, closes, starts = unpack_panel(lengths_bytes, ohlc_bytes)
+    return summarize_panel(codes, opens, highs, lows, closes, starts)
+
+
+class IndicatorPool:
+    """指標計算的行程池；workers 為0時在目前行程內計算"""
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self._executor = None
+        self.submitted = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            # 主行程有多個執行緒，fork 可能複製到被鎖住的鎖；改由 forkserver 產生乾淨的子行程
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            logger.info(f"啟動 {self.workers} 個指標計算行程")
+        return self._executor
+
+    def submit(self, histories):
+        """送出一段 {股票代碼: OHLC清單} 的計算，回傳結果為 {股票代碼: 結果字典} 的 Future"""
+        self.submitted += 1
+        packed = pack_histories(histories)
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(compute_packed(*packed))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._get_executor().submit(compute_packed, *packed)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {'workers': self.workers, 'batches_submitted': self.submitted}
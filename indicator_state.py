@@ -0,0 +1,253 @@
+"""逐K棒增量更新的Pine Script指標狀態
+
+IndicatorState 保存計算下一根K棒所需的全部狀態（27/34期視窗極值、
+wsa1/wsa2 的輸入視窗、13期EMA），update(bar) 以 O(1) 攤銷時間推進一根K棒，
+結果與 pine_indicators 的批次計算一致（誤差在 INDICATOR_TOLERANCE 以內）。
+"""
+import json
+import logging
+import os
+import tempfile
+from collections import deque
+
+from pine_indicators import (
+    INDICATOR_TOLERANCE,
+    MIN_BARS,
+    calculate_pine_script_indicators_vectorized,
+    weighted_simple_average_kernel,
+)
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# calculate_weighted_simple_average 依輸入長度展開後的權重（最舊在前）
+_WSA1_KERNELS = [tuple(weighted_simple_average_kernel(n, 1).tolist()) for n in range(1, 6)]
+_WSA2_KERNEL = tuple(weighted_simple_average_kernel(3, 1).tolist())
+_EMA_PERIOD = 13
+_EMA_MULTIPLIER = 2 / (_EMA_PERIOD + 1)
+
+
+class MonotonicWindow:
+    """滑動視窗極值（單調佇列），每次推進為 O(1) 攤銷"""
+
+    def __init__(self, window, mode):
+        self.window = window
+        self.mode = mode  # 'min' 或 'max'
+        self.items = deque()  # (bar_index, value)
+
+    def push(self, index, value):
+        if self.mode == 'min':
+            while self.items and self.items[-1][1] >= value:
+                self.items.pop()
+        else:
+            while self.items and self.items[-1][1] <= value:
+                self.items.pop()
+        self.items.append((index, value))
+        while self.items[0][0] <= index - self.window:
+            self.items.popleft()
+        return self.items[0][1]
+
+    @property
+    def value(self):
+        return self.items[0][1] if self.items else None
+
+    def snapshot(self):
+        return [list(item) for item in self.items]
+
+    def restore(self, items):
+        self.items = deque((int(index), float(value)) for index, value in items)
+
+
+class IndicatorState:
+    """單一股票的增量指標狀態"""
+
+    def __init__(self, stock_code=None):
+        self.stock_code = stock_code
+        self.bar_count = 0
+        self.last_date = None
+        self.low_27 = MonotonicWindow(27, 'min')
+        self.high_27 = MonotonicWindow(27, 'max')
+        self.low_34 = MonotonicWindow(34, 'min')
+        self.high_34 = MonotonicWindow(34, 'max')
+        self.relative_positions = deque(maxlen=5)  # wsa1 的輸入視窗
+        self.wsa1_values = deque(maxlen=3)  # wsa2 的輸入視窗
+        self.ema_sum = 0.0
+        self.ema = None
+        self.fund_flow = None
+        self.bull_bear_line = None
+        self.is_crossover = False
+        self.is_oversold = False
+        self.signal = False
+
+    @classmethod
+    def from_history(cls, ohlc_data, stock_code=None):
+        """以歷史K棒重播建立狀態"""
+        state = cls(stock_code)
+        for bar in ohlc_data:
+            state.update(bar)
+        return state
+
+    def update(self, bar):
+        """推進一根K棒，資料足夠時回傳與 calculate_pine_script_indicators 相同格式的結果"""
+        index = self.bar_count
+        opening, high, low, close = (float(bar[field]) for field in ('open', 'high', 'low', 'close'))
+
+        # 資金流向：27期相對位置 -> wsa1(5) -> wsa2(3)
+        lowest_27 = self.low_27.push(index, low)
+        highest_27 = self.high_27.push(index, high)
+        flat_27 = not highest_27 - lowest_27 > 0
+        relative_pos = 50.0 if flat_27 else (close - lowest_27) / (highest_27 - lowest_27) * 100
+        self.relative_positions.append(relative_pos)
+
+        kernel = _WSA1_KERNELS[len(self.relative_positions) - 1]
+        wsa1 = sum(w * v for w, v in zip(kernel, self.relative_positions))
+        self.wsa1_values.append(wsa1)
+        if index < 2:
+            wsa2 = wsa1
+        else:
+            wsa2 = sum(w * v for w, v in zip(_WSA2_KERNEL, self.wsa1_values))
+
+        fund_flow = 50.0 if flat_27 else (3 * wsa1 - 2 * wsa2 - 50) * 1.032 + 50
+        fund_flow = max(0.0, min(100.0, fund_flow))
+
+        # 多空線：34期標準化典型價格的13期EMA
+        lowest_34 = self.low_34.push(index, low)
+        highest_34 = self.high_34.push(index, high)
+        typical_price = (2 * close + high + low + opening) / 5
+        if highest_34 - lowest_34 > 0:
+            normalized = (typical_price - lowest_34) / (highest_34 - lowest_34) * 100
+        else:
+            normalized = 50.0
+        normalized = max(0.0, min(100.0, normalized))
+
+        if index < _EMA_PERIOD:
+            self.ema_sum += normalized
+            bull_bear_line = self.ema_sum / (index + 1)
+        else:
+            bull_bear_line = normalized * _EMA_MULTIPLIER + self.ema * (1 - _EMA_MULTIPLIER)
+        self.ema = bull_bear_line
+
+        # crossover 與黃柱判斷
+        previous = (self.fund_flow, self.bull_bear_line, self.is_crossover, self.is_oversold, self.signal)
+        if self.fund_flow is None:
+            is_crossover = False
+        else:
+            is_crossover = fund_flow > bull_bear_line and self.fund_flow <= self.bull_bear_line
+        is_oversold = bull_bear_line < 25
+
+        self.fund_flow = fund_flow
+        self.bull_bear_line = bull_bear_line
+        self.is_crossover = is_crossover
+        self.is_oversold = is_oversold
+        self.signal = is_crossover and is_oversold
+        self.bar_count += 1
+        self.last_date = bar.get('date')
+
+        if self.bar_count < MIN_BARS:
+            return None
+
+        prev_fund, prev_bull_bear, prev_crossover, prev_oversold, prev_signal = previous
+        return {
+            'fund_trend': fund_flow,
+            'multi_short_line': bull_bear_line,
+            'banker_entry_signal': self.signal or prev_signal,
+            'is_crossover': is_crossover if self.signal else prev_crossover,
+            'is_oversold': is_oversold if self.signal else prev_oversold,
+            'fund_trend_previous': prev_fund,
+            'multi_short_line_previous': prev_bull_bear
+        }
+
+    def snapshot(self):
+        """輸出可JSON序列化的狀態快照"""
+        return {
+            'version': SNAPSHOT_VERSION,
+            'stock_code': self.stock_code,
+            'bar_count': self.bar_count,
+            'last_date': self.last_date,
+            'low_27': self.low_27.snapshot(),
+            'high_27': self.high_27.snapshot(),
+            'low_34': self.low_34.snapshot(),
+            'high_34': self.high_34.snapshot(),
+            'relative_positions': list(self.relative_positions),
+            'wsa1_values': list(self.wsa1_values),
+            'ema_sum': self.ema_sum,
+            'ema': self.ema,
+            'fund_flow': self.fund_flow,
+            'bull_bear_line': self.bull_bear_line,
+            'is_crossover': self.is_crossover,
+            'is_oversold': self.is_oversold,
+            'signal': self.signal
+        }
+
+    @classmethod
+    def restore(cls, snapshot):
+        """由 snapshot() 的輸出還原狀態"""
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"不支援的指標狀態版本: {snapshot.get('version')}")
+
+        state = cls(snapshot.get('stock_code'))
+        state.bar_count = snapshot['bar_count']
+        state.last_date = snapshot['last_date']
+        state.low_27.restore(snapshot['low_27'])
+        state.high_27.restore(snapshot['high_27'])
+        state.low_34.restore(snapshot['low_34'])
+        state.high_34.restore(snapshot['high_34'])
+        state.relative_positions.extend(snapshot['relative_positions'])
+        state.wsa1_values.extend(snapshot['wsa1_values'])
+        state.ema_sum = snapshot['ema_sum']
+        state.ema = snapshot['ema']
+        state.fund_flow = snapshot['fund_flow']
+        state.bull_bear_line = snapshot['bull_bear_line']
+        state.is_crossover = snapshot['is_crossover']
+        state.is_oversold = snapshot['is_oversold']
+        state.signal = snapshot['signal']
+        return state
+
+
+def save_indicator_states(path, states):
+    """以原子寫入方式將 {股票代碼: IndicatorState} 存成JSON檔"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({code: state.snapshot() for code, state in states.items()}, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_indicator_states(path):
+    """讀取 save_indicator_states 的檔案，檔案不存在或損毀時回傳空字典"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            snapshots = json.load(f)
+        return {code: IndicatorState.restore(snapshot) for code, snapshot in snapshots.items()}
+    except FileNotFoundError:
+        return {}
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"指標狀態檔 {path} 無法讀取，忽略: {e}")
+        return {}
+
+
+def replay_matches_batch(ohlc_data, tolerance=INDICATOR_TOLERANCE):
+    """重播整段歷史並與批次計算比對，回傳 (是否一致, 差異欄位清單)"""
+    expected = calculate_pine_script_indicators_vectorized(ohlc_data)
+    state = IndicatorState()
+    actual = None
+    for bar in ohlc_data:
+        actual = state.update(bar)
+
+    if not isinstance(expected, dict):
+        return actual is None, [] if actual is None else ['length']
+
+    mismatches = []
+    for key, value in expected.items():
+        if isinstance(value, bool):
+            if actual[key] != value:
+                mismatches.append(key)
+        elif abs(actual[key] - value) > tolerance:
+            mismatches.append(key)
+    return not mismatches, mismatches
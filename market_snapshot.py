@@ -0,0 +1,41 @@
+"""不可變的市場快照版本
+
+一個 MarketSnapshot 包含同一次更新的即時資料、更新時間與資料日期。
+更新時建立新物件並以單一參考指派替換，讀取端在請求開始時取得參考後一路使用，
+不需要任何鎖，也不會看到新資料配上舊資料日期的組合。
+"""
+from types import MappingProxyType
+
+
+class MarketSnapshot:
+    """市場快照（建立後不可修改）"""
+
+    __slots__ = ('version', 'stocks', 'last_update_time', 'data_date')
+
+    def __init__(self, version, stocks, last_update_time=None, data_date=None):
+        # dict 包成唯讀視圖；SharedSnapshotView 等本身唯讀的 Mapping 直接使用
+        if isinstance(stocks, dict):
+            stocks = MappingProxyType(stocks)
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'stocks', stocks)
+        object.__setattr__(self, 'last_update_time', last_update_time)
+        object.__setattr__(self, 'data_date', data_date)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MarketSnapshot 不可修改，請以 replace() 建立新版本")
+
+    @classmethod
+    def empty(cls):
+        return cls(0, {})
+
+    def replace(self, **changes):
+        """建立下一個版本"""
+        fields = {name: getattr(self, name) for name in ('stocks', 'last_update_time', 'data_date')}
+        fields.update(changes)
+        return MarketSnapshot(self.version + 1, **fields)
+
+    def __bool__(self):
+        return len(self.stocks) > 0
+
+    def __repr__(self):
+        return f"MarketSnapshot(version={self.version}, stocks={len(self.stocks)}, data_date={self.data_date!r})"
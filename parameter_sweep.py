@@ -0,0 +1,236 @@
+"""黃柱指標的參數掃描
+
+一次以多組指標參數（資金流向與多空線的視窗、wsa長度、放大係數、超賣門檻）篩選同一批歷史資料。
+所有參數組共用同一個 (股票 × 天數) 面板；視窗極值依視窗長度只計算一次，
+資金流向與多空線序列也依各自用到的參數共用，只差在超賣門檻的參數組只需重新比較旗標。
+
+命令列用法（使用與網頁服務相同的快照、本地歷史資料庫與獲取流程）：
+    python parameter_sweep.py --grid fund_window=21,27 --grid oversold=20,25
+    python parameter_sweep.py --set '{"bull_window": 30, "bull_ema": 10}' --json
+"""
+import argparse
+import itertools
+import json
+import logging
+
+import numpy as np
+
+from pine_indicators import (
+    bull_bear_series,
+    build_ohlc_panel,
+    crossover_flags,
+    fund_flow_series,
+    mask_panel,
+    window_extremes,
+)
+
+logger = logging.getLogger(__name__)
+
+# 參數名稱與目前篩選使用的預設值
+DEFAULT_PARAMS = {
+    'fund_window': 27,   # 資金流向的最高最低價視窗
+    'fund_fast': 5,      # 第一層加權簡單平均長度
+    'fund_slow': 3,      # 第二層加權簡單平均長度
+    'fund_factor': 1.032,
+    'bull_window': 34,   # 多空線的最高最低價視窗
+    'bull_ema': 13,      # 多空線EMA期數
+    'oversold': 25       # 超賣門檻
+}
+INTEGER_PARAMS = ('fund_window', 'fund_fast', 'fund_slow', 'bull_window', 'bull_ema')
+MAX_WINDOW = 250
+
+
+def normalize_params(params):
+    """補齊預設值並檢查參數，格式不符時拋出 ValueError"""
+    params = dict(params or {})
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"未知的參數: {', '.join(sorted(unknown))}")
+
+    normalized = {}
+    for name, default in DEFAULT_PARAMS.items():
+        value = params.get(name, default)
+        try:
+            if name in INTEGER_PARAMS:
+                if float(value) != int(float(value)):
+                    raise ValueError
+                value = int(float(value))
+            else:
+                value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"參數 {name} 的值 {value!r} 格式錯誤")
+        if name in INTEGER_PARAMS and not 1 <= value <= MAX_WINDOW:
+            raise ValueError(f"參數 {name} 必須介於 1 到 {MAX_WINDOW}")
+        normalized[name] = value
+    if not 0 < normalized['oversold'] < 100:
+        raise ValueError("參數 oversold 必須介於 0 到 100")
+    return normalized
+
+
+def get_params_key(params):
+    """參數組的識別字串，格式與 app.INDICATOR_PARAMS_KEY 相同"""
+    return (f"fund{params['fund_window']}-wsa{params['fund_fast']}/{params['fund_slow']}-x{params['fund_factor']:g}"
+            f"|bull{params['bull_window']}-ema{params['bull_ema']}|oversold{params['oversold']:g}")
+
+
+def required_bars(params):
+    """該參數組至少需要的K棒數（兩個視窗都要填滿）"""
+    return max(params['fund_window'], params['bull_window'], 2)
+
+
+def expand_grid(grid):
+    """{參數: 值清單} 展開為所有組合（單一值可不用清單）"""
+    names = list(grid)
+    choices = [value if isinstance(value, (list, tuple)) else [value] for value in grid.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*choices)]
+
+
+def build_param_sets(param_sets=None, grid=None, max_sets=64):
+    """合併明確列出的參數組與網格展開的參數組，去除重複後回傳已檢查的參數清單"""
+    candidates = list(param_sets or [])
+    if grid:
+        candidates.extend(expand_grid(grid))
+    if not candidates:
+        candidates = [{}]
+
+    normalized = {}
+    for params in candidates:
+        if not isinstance(params, dict):
+            raise ValueError("每組參數必須是物件")
+        params = normalize_params(params)
+        normalized.setdefault(get_params_key(params), params)
+    if len(normalized) > max_sets:
+        raise ValueError(f"參數組數 {len(normalized)} 超過上限 {max_sets}")
+    return list(normalized.values())
+
+
+class SweepPanel:
+    """同一批歷史資料上的共用序列；每種視窗、每組序列參數只計算一次"""
+
+    def __init__(self, histories):
+        self.codes, panel, self.starts = build_ohlc_panel(histories)
+        self.lengths = (panel['close'].shape[1] - self.starts) if self.codes else np.zeros(0, dtype=int)
+        self.opens, self.highs, self.lows, self.closes = mask_panel(
+            panel['open'], panel['high'], panel['low'], panel['close'], self.starts)
+        self._series = {}
+        self.computed = {'window_extremes': 0, 'fund_flow': 0, 'bull_bear_line': 0}
+
+    def _get(self, key, build):
+        if key not in self._series:
+            self._series[key] = build()
+            self.computed[key[0]] += 1
+        return self._series[key]
+
+    def extremes(self, window):
+        return self._get(('window_extremes', window), lambda: window_extremes(self.lows, self.highs, window))
+
+    def fund_flow(self, params):
+        key = ('fund_flow', params['fund_window'], params['fund_fast'], params['fund_slow'], params['fund_factor'])
+        return self._get(key, lambda: fund_flow_series(
+            self.highs, self.lows, self.closes, self.starts,
+            window=params['fund_window'], fast=params['fund_fast'], slow=params['fund_slow'],
+            factor=params['fund_factor'], extremes=self.extremes(params['fund_window'])))
+
+    def bull_bear_line(self, params):
+        key = ('bull_bear_line', params['bull_window'], params['bull_ema'])
+        return self._get(key, lambda: bull_bear_series(
+            self.opens, self.highs, self.lows, self.closes, self.starts,
+            window=params['bull_window'], ema_period=params['bull_ema'],
+            extremes=self.extremes(params['bull_window'])))
+
+    def evaluate(self, params):
+        """回傳該參數組的 {evaluated, hits: [結果字典]}，判斷方式與篩選相同（當日或前一日黃柱）"""
+        if not self.codes or self.closes.shape[1] < 2:
+            return {'evaluated': 0, 'hits': []}
+
+        # 與 summarize_panel 相同：取最後三天即可判斷當日與前一日的 crossover
+        fund_flow = self.fund_flow(params)[:, -3:]
+        bull_bear_line = self.bull_bear_line(params)[:, -3:]
+        crossover, oversold, signal = crossover_flags(fund_flow, bull_bear_line, params['oversold'])
+        current_signal = signal[:, -1]
+
+        valid = self.lengths >= required_bars(params)
+        hit_rows = np.flatnonzero(valid & (current_signal | signal[:, -2]))
+        hits = []
+        for row in hit_rows:
+            pick = -1 if current_signal[row] else -2
+            hits.append({
+                'code': self.codes[row],
+                'fund_trend': round(float(fund_flow[row, -1]), 2),
+                'multi_short_line': round(float(bull_bear_line[row, -1]), 2),
+                'is_crossover': bool(crossover[row, pick]),
+                'is_oversold': bool(oversold[row, pick]),
+                'signal_day': 'current' if pick == -1 else 'previous'
+            })
+        return {'evaluated': int(valid.sum()), 'hits': hits}
+
+
+def sweep_histories(histories, param_sets):
+    """對 {股票代碼: OHLC清單} 評估所有參數組
+
+    回傳 {'results': [每組的 key/params/evaluated/hit_count/hits], 'computed': 各共用序列實際計算次數}。
+    """
+    panel = SweepPanel(histories)
+    results = []
+    for params in param_sets:
+        evaluation = panel.evaluate(params)
+        results.append({
+            'key': get_params_key(params),
+            'params': params,
+            'evaluated': evaluation['evaluated'],
+            'hit_count': len(evaluation['hits']),
+            'hits': evaluation['hits']
+        })
+    return {'results': results, 'computed': dict(panel.computed)}
+
+
+def parse_grid_option(values):
+    """命令列的 --grid name=v1,v2 轉為 {參數: 值清單}"""
+    grid = {}
+    for item in values or []:
+        name, sep, choices = item.partition('=')
+        if not sep:
+            raise ValueError(f"--grid 格式應為 參數=值1,值2: {item}")
+        grid[name.strip()] = [choice.strip() for choice in choices.split(',') if choice.strip()]
+    return grid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='以多組指標參數一次篩選全市場黃柱股票')
+    parser.add_argument('--grid', action='append', metavar='參數=值1,值2',
+                        help=f"參數網格，可重複指定；參數: {', '.join(DEFAULT_PARAMS)}")
+    parser.add_argument('--set', action='append', dest='param_sets', metavar='JSON',
+                        help='單一參數組（JSON物件），可重複指定')
+    parser.add_argument('--json', action='store_true', help='輸出完整JSON結果')
+    parser.add_argument('--update', action='store_true', help='先下載最新快照')
+    args = parser.parse_args(argv)
+
+    try:
+        param_sets = build_param_sets([json.loads(item) for item in args.param_sets or []],
+                                      parse_grid_option(args.grid), max_sets=1024)
+    except (ValueError, json.JSONDecodeError) as e:
+        parser.error(str(e))
+
+    import app  # 延後載入：只有命令列需要完整的資料獲取流程
+
+    logging.basicConfig(level=logging.WARNING)
+    app.load_warm_start_state()
+    if args.update or not app.market_snapshot:
+        app.update_stocks_data()
+    if not app.market_snapshot:
+        parser.exit(1, "無法取得股票資料\n")
+
+    result = app.run_parameter_sweep(app.market_snapshot, param_sets)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    print(f"資料日期 {result['data_date']}，{result['total_available']} 支股票，{len(result['results'])} 組參數")
+    for item in sorted(result['results'], key=lambda x: x['hit_count'], reverse=True):
+        codes = ' '.join(hit['code'] for hit in item['hits'][:20])
+        more = ' ...' if item['hit_count'] > 20 else ''
+        print(f"{item['hit_count']:5d}/{item['evaluated']:<5d} {item['key']}  {codes}{more}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+"""Pine Script黃柱指標的NumPy向量化計算引擎
+
+與 app.calculate_pine_script_indicators_reference（逐筆Python迴圈的參考實作）
+產生相同的結果：浮點數值的絕對誤差在 1e-9 以內，布林旗標完全一致
+（除非數值恰好落在比較邊界的浮點誤差範圍內）。
+"""
+import logging
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+logger = logging.getLogger(__name__)
+
+# 與參考實作的允許誤差（絕對值）
+INDICATOR_TOLERANCE = 1e-9
+
+MIN_BARS = 34  # 計算指標所需的最少K棒數
+
+
+def rolling_min(values, window):
+    """滑動視窗最小值（前段不足window時使用擴張視窗，與min(lows[max(0,i-w+1):i+1])一致）"""
+    values = np.asarray(values, dtype=float)
+    pad = np.full(values.shape[:-1] + (window - 1,), np.inf)
+    padded = np.concatenate([pad, values], axis=-1)
+    return sliding_window_view(padded, window, axis=-1).min(axis=-1)
+
+
+def rolling_max(values, window):
+    """滑動視窗最大值（前段不足window時使用擴張視窗）"""
+    values = np.asarray(values, dtype=float)
+    pad = np.full(values.shape[:-1] + (window - 1,), -np.inf)
+    padded = np.concatenate([pad, values], axis=-1)
+    return sliding_window_view(padded, window, axis=-1).max(axis=-1)
+
+
+def weighted_simple_average_kernel(count, weight=1):
+    """calculate_weighted_simple_average(src[-count:], count, weight) 的封閉形式權重
+
+    當 length 等於輸入長度時，Pine Script狀態迴圈展開為
+    output = a^(n-1)*src[0] + (weight/n) * Σ a^(n-1-k) * src[k]，其中 a = (n - weight) / n。
+    回傳的權重依時間順序排列（最舊在前）。
+    """
+    if count <= 1:
+        return np.ones(1)
+    decay = (count - weight) / count
+    kernel = np.array([decay ** (count - 1 - k) * weight / count for k in range(count)])
+    kernel[0] = decay ** (count - 1)
+    return kernel
+
+
+def _bar_ages(values, starts):
+    """每個位置距離該股票第一根有效K棒的距離（單一序列時即為索引）"""
+    n = values.shape[-1]
+    if starts is None:
+        return np.broadcast_to(np.arange(n), values.shape)
+    return np.arange(n) - np.asarray(starts)[..., None]
+
+
+def _shift(values, periods):
+    """沿時間軸右移periods格（左側補0）"""
+    if periods == 0:
+        return values
+    shifted = np.zeros_like(values)
+    shifted[..., periods:] = values[..., :-periods]
+    return shifted
+
+
+def weighted_simple_average_series(values, length, weight=1, starts=None):
+    """逐點套用 calculate_weighted_simple_average(values[max(start,i-length+1):i+1], ...)
+
+    每支股票前 length-1 個點只有較短的歷史，使用對應長度的權重；
+    starts 為各列第一根有效K棒的索引（None表示從0開始）。
+    """
+    values = np.asarray(values, dtype=float)
+    n = values.shape[-1]
+    ages = _bar_ages(values, starts)
+    result = np.zeros_like(values)
+
+    # 完整視窗：以固定權重做一次滑動內積
+    if n >= length:
+        kernel = weighted_simple_average_kernel(length, weight)
+        windows = sliding_window_view(values, length, axis=-1)
+        result[..., length - 1:] = windows @ kernel
+
+    # 前段不足視窗長度的點
+    if starts is None:
+        for i in range(min(length - 1, n)):
+            result[..., i] = values[..., :i + 1] @ weighted_simple_average_kernel(i + 1, weight)
+        return result
+
+    for age in range(length - 1):
+        kernel = weighted_simple_average_kernel(age + 1, weight)
+        partial = sum(kernel[j] * _shift(values, age - j) for j in range(age + 1))
+        result = np.where(ages == age, partial, result)
+
+    return result
+
+
+def ema_series(values, period, starts=None):
+    """多空線EMA序列：前period-1點為累積平均，之後以前period點SMA為種子做遞迴
+
+    沿時間軸掃描一次，每一步同時處理所有列；starts之前的位置結果為NaN。
+    """
+    values = np.asarray(values, dtype=float)
+    n = values.shape[-1]
+    multiplier = 2 / (period + 1)
+
+    if starts is None:
+        result = np.empty_like(values)
+        seed_len = min(period, n)
+        result[..., :seed_len] = np.cumsum(values[..., :seed_len], axis=-1) / np.arange(1, seed_len + 1)
+        ema = result[..., seed_len - 1]
+        for i in range(seed_len, n):
+            ema = values[..., i] * multiplier + ema * (1 - multiplier)
+            result[..., i] = ema
+        return result
+
+    ages = _bar_ages(values, starts)
+    result = np.full(values.shape, np.nan)
+    running_sum = np.zeros(values.shape[:-1])
+    ema = np.full(values.shape[:-1], np.nan)
+    for i in range(n):
+        age = ages[..., i]
+        value = values[..., i]
+        running_sum = running_sum + np.where(age >= 0, value, 0)
+        ema = np.where(age < 0, np.nan,
+                       np.where(age < period, running_sum / np.maximum(age + 1, 1),
+                                value * multiplier + ema * (1 - multiplier)))
+        result[..., i] = ema
+    return result
+
+
+def mask_panel(opens, highs, lows, closes, starts=None):
+    """轉為浮點陣列；面板中 starts 之前的位置以不影響視窗極值的值填補"""
+    opens = np.asarray(opens, dtype=float)
+    highs = np.asarray(highs, dtype=float)
+    lows = np.asarray(lows, dtype=float)
+    closes = np.asarray(closes, dtype=float)
+
+    if starts is not None:
+        padding = _bar_ages(closes, starts) < 0
+        highs = np.where(padding, -np.inf, highs)
+        lows = np.where(padding, np.inf, lows)
+        opens = np.where(padding, 0.0, opens)
+        closes = np.where(padding, 0.0, closes)
+    return opens, highs, lows, closes
+
+
+def window_extremes(lows, highs, window):
+    """window 期的 (最低價, 最高價) 序列"""
+    return rolling_min(lows, window), rolling_max(highs, window)
+
+
+def fund_flow_series(highs, lows, closes, starts=None, window=27, fast=5, slow=3, factor=1.032, extremes=None):
+    """資金流向：window 期相對位置 -> wsa1(fast) -> wsa2(slow)
+
+    輸入需已經過 mask_panel；extremes 為已算好的 window_extremes(lows, highs, window)，可在多組參數間共用。
+    """
+    lowest, highest = extremes if extremes is not None else window_extremes(lows, highs, window)
+    with np.errstate(invalid='ignore'):
+        price_range = highest - lowest
+    flat = ~(price_range > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative_pos = np.where(flat, 50.0, (closes - lowest) / np.where(flat, 1.0, price_range) * 100)
+
+    wsa1 = weighted_simple_average_series(relative_pos, fast, 1, starts)
+    wsa2 = weighted_simple_average_series(wsa1, slow, 1, starts)
+    # 參考實作在第二層視窗（slow 根）填滿前直接令 wsa2 = wsa1（預設 slow=3 時為前兩根K棒）
+    warmup = slow - 1
+    if starts is None:
+        wsa2[..., :warmup] = wsa1[..., :warmup]
+    else:
+        wsa2 = np.where(_bar_ages(wsa1, starts) < warmup, wsa1, wsa2)
+
+    fund_flow = (3 * wsa1 - 2 * wsa2 - 50) * factor + 50
+    fund_flow = np.where(flat, 50.0, fund_flow)
+    return np.clip(fund_flow, 0, 100)
+
+
+def bull_bear_series(opens, highs, lows, closes, starts=None, window=34, ema_period=13, extremes=None):
+    """多空線：window 期標準化典型價格的 ema_period 期EMA（輸入需已經過 mask_panel）"""
+    lowest, highest = extremes if extremes is not None else window_extremes(lows, highs, window)
+    with np.errstate(invalid='ignore'):
+        typical_prices = (2 * closes + highs + lows + opens) / 5
+        price_range = highest - lowest
+    flat = ~(price_range > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = np.where(flat, 50.0, (typical_prices - lowest) / np.where(flat, 1.0, price_range) * 100)
+    normalized = np.clip(normalized, 0, 100)
+
+    return ema_series(normalized, ema_period, starts)
+
+
+def compute_indicator_series(opens, highs, lows, closes, starts=None):
+    """計算完整的資金流向與多空線序列
+
+    輸入可為單一序列或 (股票 × 天數) 的面板；面板以 starts 標示各列第一根有效K棒，
+    之前的位置視為遮罩（最高最低價以±inf填補，不影響視窗極值）。
+    回傳 (fund_flow, bull_bear_line) 兩個與輸入同形狀的陣列。
+    """
+    opens, highs, lows, closes = mask_panel(opens, highs, lows, closes, starts)
+    fund_flow = fund_flow_series(highs, lows, closes, starts)
+    bull_bear_line = bull_bear_series(opens, highs, lows, closes, starts)
+    return fund_flow, bull_bear_line
+
+
+def crossover_flags(fund_flow, bull_bear_line, oversold_threshold=25):
+    """逐點計算 crossover、超賣與黃柱旗標（第一根K棒沒有前值，一律為False）"""
+    crossover = np.zeros(fund_flow.shape, dtype=bool)
+    crossover[..., 1:] = (fund_flow[..., 1:] > bull_bear_line[..., 1:]) & \
+        (fund_flow[..., :-1] <= bull_bear_line[..., :-1])
+    oversold = bull_bear_line < oversold_threshold
+    return crossover, oversold, crossover & oversold
+
+
+def calculate_pine_script_indicators_vectorized(ohlc_data):
+    """向量化版本的 calculate_pine_script_indicators，回傳相同格式的結果"""
+    if len(ohlc_data) < MIN_BARS:  # 需要足夠的歷史數據
+        return None, None, False, False, False
+
+    opens = np.fromiter((d['open'] for d in ohlc_data), dtype=float, count=len(ohlc_data))
+    highs = np.fromiter((d['high'] for d in ohlc_data), dtype=float, count=len(ohlc_data))
+    lows = np.fromiter((d['low'] for d in ohlc_data), dtype=float, count=len(ohlc_data))
+    closes = np.fromiter((d['close'] for d in ohlc_data), dtype=float, count=len(ohlc_data))
+
+    fund_flow, bull_bear_line = compute_indicator_series(opens, highs, lows, closes)
+    return summarize_latest_signal(fund_flow, bull_bear_line)
+
+
+def calculate_indicator_series(ohlc_data, oversold_threshold=25):
+    """OHLC清單的完整指標序列
+
+    回傳 {'fund_flow', 'bull_bear_line', 'crossover', 'oversold', 'signal', 'banker_entry_signal'} 陣列，
+    banker_entry_signal 與篩選相同（當日或前一日出現信號）。
+    """
+    opens = np.fromiter((d['open'] for d in ohlc_data), dtype=float, count=len(ohlc_data))
+    highs = np.fromiter((d['high'] for d in ohlc_data), dtype=float, count=len(ohlc_data))
+    lows = np.fromiter((d['low'] for d in ohlc_data), dtype=float, count=len(ohlc_data))
+    closes = np.fromiter((d['close'] for d in ohlc_data), dtype=float, count=len(ohlc_data))
+
+    fund_flow, bull_bear_line = compute_indicator_series(opens, highs, lows, closes)
+    crossover, oversold, signal = crossover_flags(fund_flow, bull_bear_line, oversold_threshold)
+    banker_entry_signal = signal.copy()
+    banker_entry_signal[1:] |= signal[:-1]
+    return {
+        'fund_flow': fund_flow,
+        'bull_bear_line': bull_bear_line,
+        'crossover': crossover,
+        'oversold': oversold,
+        'signal': signal,
+        'banker_entry_signal': banker_entry_signal
+    }
+
+
+def summarize_latest_signal(fund_flow, bull_bear_line, oversold_threshold=25):
+    """由完整序列整理出當日/前一日黃柱判斷結果"""
+    crossover, oversold, signal = crossover_flags(fund_flow, bull_bear_line, oversold_threshold)
+
+    current_day_signal = bool(signal[-1])
+    previous_day_signal = bool(signal[-2])
+    banker_entry_signal = current_day_signal or previous_day_signal
+
+    current_fund = float(fund_flow[-1])
+    current_bull_bear = float(bull_bear_line[-1])
+
+    # 記錄詳細計算結果用於調試（僅記錄符合條件的股票）
+    if banker_entry_signal:
+        logger.info(f"🟡 發現黃柱信號:")
+        logger.info(f"  當日: 資金流向={current_fund:.2f}, 多空線={current_bull_bear:.2f}, crossover={bool(crossover[-1])}, 超賣={bool(oversold[-1])}, 黃柱={current_day_signal}")
+        logger.info(f"  前日: 資金流向={float(fund_flow[-2]):.2f}, 多空線={float(bull_bear_line[-2]):.2f}, crossover={bool(crossover[-2])}, 超賣={bool(oversold[-2])}, 黃柱={previous_day_signal}")
+
+    pick = -1 if current_day_signal else -2
+    return {
+        'fund_trend': current_fund,
+        'multi_short_line': current_bull_bear,
+        'banker_entry_signal': banker_entry_signal,
+        'is_crossover': bool(crossover[pick]),
+        'is_oversold': bool(oversold[pick]),
+        'fund_trend_previous': float(fund_flow[-2]),
+        'multi_short_line_previous': float(bull_bear_line[-2])
+    }
+
+
+def complete_bars(bars):
+    """略過缺少任一OHLC價格的K棒（停牌或資料缺漏），與 parse_chart_result 相同，不把缺值當成0"""
+    return [bar for bar in bars or () if all(bar.get(field) is not None for field in ('open', 'high', 'low', 'close'))]
+
+
+def _history_length(bars):
+    """OHLC清單或欄式資料的K棒數"""
+    if isinstance(bars, dict):
+        return len(bars['close'])
+    return len(bars) if bars else 0
+
+
+def build_ohlc_panel(histories):
+    """將各股票的OHLC清單組成 (股票 × 天數) 面板
+
+    histories 的值可以是OHLC字典清單（缺少價格的K棒略過），或 {欄位: 陣列} 形式的欄式資料。
+    每支股票的K棒依序靠右對齊（最後一根位於最後一欄），停牌等缺漏日不留空格，
+    與逐股計算時的序列完全相同；較短的歷史在左側留白，以 starts 標示第一根有效K棒。
+    回傳 (codes, panel, starts)，panel 為 open/high/low/close/volume 的二維陣列字典。
+    """
+    codes = list(histories.keys())
+    histories = {code: bars if isinstance(bars, dict) else complete_bars(bars) for code, bars in histories.items()}
+    lengths = np.array([_history_length(histories[code]) for code in codes], dtype=int)
+    width = int(lengths.max()) if len(codes) else 0
+    starts = width - lengths
+
+    panel = {field: np.full((len(codes), width), np.nan) for field in ('open', 'high', 'low', 'close', 'volume')}
+    for row, code in enumerate(codes):
+        bars = histories[code]
+        if not _history_length(bars):
+            continue
+        start = starts[row]
+        for field, values in panel.items():
+            if isinstance(bars, dict):
+                values[row, start:] = bars[field]
+            else:
+                values[row, start:] = [bar.get(field) or 0 for bar in bars]
+
+    return codes, panel, starts
+
+
+def calculate_pine_script_indicators_batch(histories):
+    """一次計算多支股票的Pine Script指標
+
+    histories 為 {股票代碼: OHLC清單}；回傳 {股票代碼: 結果字典}，
+    字典格式與 calculate_pine_script_indicators 相同，資料不足34天的股票結果為None。
+    """
+    if not histories:
+        return {}
+
+    codes, panel, starts = build_ohlc_panel(histories)
+    return summarize_panel(codes, panel['open'], panel['high'], panel['low'], panel['close'], starts)
+
+
+def summarize_panel(codes, opens, highs, lows, closes, starts):
+    """對 (股票 × 天數) 面板計算指標，回傳 {股票代碼: 結果字典}（資料不足34天為None）"""
+    width = closes.shape[1]
+    if width < 2:
+        return {code: None for code in codes}
+
+    fund_flow, bull_bear_line = compute_indicator_series(opens, highs, lows, closes, starts)
+    crossover, oversold, signal = crossover_flags(fund_flow[:, -3:], bull_bear_line[:, -3:])
+
+    current_day_signal = signal[:, -1]
+    banker_entry_signal = current_day_signal | signal[:, -2]
+    is_crossover = np.where(current_day_signal, crossover[:, -1], crossover[:, -2])
+    is_oversold = np.where(current_day_signal, oversold[:, -1], oversold[:, -2])
+    valid = (width - starts) >= MIN_BARS
+
+    results = {}
+    for row, code in enumerate(codes):
+        if not valid[row]:
+            results[code] = None
+            continue
+        results[code] = {
+            'fund_trend': float(fund_flow[row, -1]),
+            'multi_short_line': float(bull_bear_line[row, -1]),
+            'banker_entry_signal': bool(banker_entry_signal[row]),
+            'is_crossover': bool(is_crossover[row]),
+            'is_oversold': bool(is_oversold[row]),
+            'fund_trend_previous': float(fund_flow[row, -2]),
+            'multi_short_line_previous': float(bull_bear_line[row, -2])
+        }
+    return results
@@ -0,0 +1,201 @@
+"""對外歷史資料請求的自適應並行度控制（AIMD）
+
+回應正常時並行上限以加法緩慢增加（每完成約一個上限數量的成功請求加1），
+遇到 429、5xx 或逾時則以乘法減半，並依 Retry-After 暫停送出新請求。
+第一次被限流前以慢啟動（每個成功請求加1）快速找到上游可承受的並行度。
+執行緒池（requests）與事件迴圈（aiohttp）共用同一個控制器，
+因此實際並行度由上游的回應決定，而不是固定的批次大小。
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# 請求結果分類
+SUCCESS = 'success'
+THROTTLED = 'throttled'  # 429 / 5xx / 逾時：上游過載，需要退避
+ERROR = 'error'  # 其他失敗（例如404），與上游負載無關，不調整並行度
+
+
+class RateLimitedError(Exception):
+    """上游回應限流（429/5xx/逾時），呼叫端不應改用模擬資料"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """解析 Retry-After 標頭（秒數或HTTP日期），無法解析時回傳None"""
+    if not value:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def classify_status(status_code):
+    """依HTTP狀態碼分類請求結果"""
+    if status_code == 429 or status_code >= 500:
+        return THROTTLED
+    if 200 <= status_code < 300:
+        return SUCCESS
+    return ERROR
+
+
+class AdaptiveRateLimiter:
+    """以AIMD調整並行上限的共用控制器（執行緒安全，亦可在asyncio中使用）"""
+
+    def __init__(self, initial_concurrency=4, min_concurrency=1, max_concurrency=64,
+                 decrease_factor=0.5, default_backoff=1.0, max_backoff=60.0, rate_window=10.0):
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease_factor = decrease_factor
+        self.default_backoff = default_backoff
+        self.max_backoff = max_backoff
+        self.rate_window = rate_window
+        self.limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self.in_flight = 0
+        self.resume_at = 0.0  # 退避期間結束的時間（time.monotonic）
+        self.slow_start_threshold = float(max_concurrency)
+        self.last_decrease = float('-inf')
+        self.consecutive_throttles = 0
+        self.counts = {SUCCESS: 0, THROTTLED: 0, ERROR: 0}
+        self._completions = deque()  # 最近 rate_window 秒內成功完成的時間
+        self._cond = threading.Condition()
+
+    def _wait_time(self, now):
+        """可以立即取得名額時回傳0，否則回傳建議等待秒數"""
+        if now < self.resume_at:
+            return self.resume_at - now
+        if self.in_flight >= int(self.limit):
+            return 0.05
+        return 0.0
+
+    def acquire(self, timeout=None):
+        """取得一個請求名額，逾時回傳False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_time(now)
+                if wait == 0:
+                    self.in_flight += 1
+                    return True
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    wait = min(wait, deadline - now)
+                self._cond.wait(wait)
+
+    async def acquire_async(self):
+        """acquire 的asyncio版本，等待期間不阻塞事件迴圈"""
+        while True:
+            with self._cond:
+                wait = self._wait_time(time.monotonic())
+                if wait == 0:
+                    self.in_flight += 1
+                    return
+            await asyncio.sleep(min(wait, 0.05) if self.in_flight else wait)
+
+    def release(self, outcome, retry_after=None, started_at=None):
+        """歸還名額並依結果調整並行上限
+
+        started_at 為請求送出的時間（time.monotonic），用來辨識在上次減半前就已送出的請求。
+        """
+        with self._cond:
+            utilized = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.counts[outcome] += 1
+            now = time.monotonic()
+
+            if outcome == SUCCESS:
+                self.consecutive_throttles = 0
+                # 上限被用滿時才增加：慢啟動階段每個成功請求加1，之後每完成約 limit 個加1
+                if utilized:
+                    step = 1 if self.limit < self.slow_start_threshold else 1 / self.limit
+                    self.limit = min(self.max_concurrency, self.limit + step)
+                self._completions.append(now)
+            elif outcome == THROTTLED:
+                self.consecutive_throttles += 1
+                # 上次減半前就已送出的請求屬於同一次壅塞，不再重複減半
+                if started_at is None or started_at >= self.last_decrease:
+                    self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+                    self.slow_start_threshold = self.limit
+                    self.last_decrease = now
+                if retry_after is None:
+                    retry_after = self.default_backoff * 2 ** (self.consecutive_throttles - 1)
+                self.resume_at = max(self.resume_at, now + min(retry_after, self.max_backoff))
+                logger.warning(f"上游限流，並行上限降為 {int(self.limit)}，暫停 {self.resume_at - now:.1f} 秒")
+
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """with limiter.slot() as permit: ... permit.record(結果)；未記錄時視為ERROR
+
+        timeout 秒內等不到名額時拋出 TimeoutError。
+        """
+        if not self.acquire(timeout):
+            raise TimeoutError(f"等待請求名額超過 {timeout:.1f} 秒")
+        permit = _Permit()
+        try:
+            yield permit
+        finally:
+            self.release(permit.outcome, permit.retry_after, permit.started_at)
+
+    @asynccontextmanager
+    async def slot_async(self):
+        await self.acquire_async()
+        permit = _Permit()
+        try:
+            yield permit
+        finally:
+            self.release(permit.outcome, permit.retry_after, permit.started_at)
+
+    def current_rate(self):
+        """最近 rate_window 秒內每秒成功完成的請求數"""
+        with self._cond:
+            cutoff = time.monotonic() - self.rate_window
+            while self._completions and self._completions[0] < cutoff:
+                self._completions.popleft()
+            return len(self._completions) / self.rate_window
+
+    def stats(self):
+        rate = self.current_rate()
+        with self._cond:
+            return {
+                'concurrency_limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'requests_per_second': round(rate, 2),
+                'backoff_seconds': round(max(0.0, self.resume_at - time.monotonic()), 1),
+                'successes': self.counts[SUCCESS],
+                'throttled': self.counts[THROTTLED],
+                'errors': self.counts[ERROR]
+            }
+
+
+class _Permit:
+    """slot() 內記錄請求結果"""
+
+    def __init__(self):
+        self.outcome = ERROR
+        self.retry_after = None
+        self.started_at = time.monotonic()
+
+    def record(self, outcome, retry_after=None):
+        self.outcome = outcome
+        self.retry_after = retry_after
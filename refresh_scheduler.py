@@ -0,0 +1,158 @@
+"""交易日資料公布後的自動更新排程
+
+每個交易日在證交所公布資料後的幾個時間點（offsets，分鐘）加上隨機延遲（jitter）執行 task(交易日)。
+task 回傳True代表該交易日已完成（資料已更新且篩選已預先計算），當天剩下的時間點就不再執行；
+回傳False（例如上游還沒更新）則在下一個時間點重試。行程啟動時若最近的交易日尚未完成（錯過排程），
+立即補跑一次。多個gunicorn worker 都會啟動排程器，但只有取得排程檔案鎖的行程實際執行。
+"""
+import fcntl
+import logging
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+
+from trading_calendar import TAIWAN_TZ
+
+logger = logging.getLogger(__name__)
+
+
+def parse_offsets(value, default=(5, 35, 95)):
+    """解析以逗號分隔的分鐘數，例如 '5,35,95'"""
+    if not value:
+        return tuple(default)
+    try:
+        offsets = tuple(sorted(int(part) for part in str(value).split(',') if part.strip()))
+    except ValueError:
+        logger.warning(f"排程設定 {value!r} 格式錯誤，使用預設值 {default}")
+        return tuple(default)
+    return offsets or tuple(default)
+
+
+class RefreshScheduler:
+    """依交易日曆在資料公布後執行更新工作"""
+
+    def __init__(self, calendar, task, offsets=(5, 35, 95), jitter_seconds=60, catch_up=True,
+                 lock_path=None, max_sleep=300, now=None):
+        self.calendar = calendar
+        self.task = task
+        self.offsets = tuple(offsets)
+        self.jitter_seconds = jitter_seconds
+        self.catch_up = catch_up
+        self.lock_path = lock_path
+        self.max_sleep = max_sleep  # 最長睡眠秒數，系統時間跳動或休眠後仍會重新計算
+        self.now = now or (lambda: datetime.now(TAIWAN_TZ))
+
+        self.completed_session = None
+        self.last_run_at = None
+        self.last_result = None
+        self.runs = 0
+        self._attempts = {}  # {交易日: 已執行次數}
+        self._jitter = {}  # {(交易日, 第幾次): 延遲秒數}
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """啟動背景執行緒（重複呼叫不會啟動第二個）"""
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        if not self.catch_up:
+            # 不補跑時，啟動當下已公布的交易日視為已處理
+            self.completed_session = self.calendar.latest_complete_session(self.now())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='refresh-scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"更新排程已啟動：公布後 {', '.join(map(str, self.offsets))} 分鐘，隨機延遲最多 {self.jitter_seconds} 秒")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def is_leader(self):
+        """是否持有排程鎖（沒有設定鎖檔時一律視為持有）"""
+        if self.lock_path is None:
+            return True
+        if self._lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file  # 行程結束時自動釋放，其他worker接手
+        logger.info(f"取得排程鎖 {self.lock_path}，由此行程執行排程更新")
+        return True
+
+    def next_run(self, now=None):
+        """回傳 (下次執行時間, 交易日)"""
+        now = now or self.now()
+        session = self.calendar.latest_complete_session(now)
+        attempt = self._attempts.get(session, 0)
+        if session == self.completed_session or attempt >= len(self.offsets):
+            # 已完成或當天的時間點都用完了：等下一個交易日公布
+            session = self.calendar.next_trading_day(session)
+            attempt = self._attempts.get(session, 0)
+        run_at = self.calendar.publish_time(session) + timedelta(minutes=self.offsets[attempt])
+        if attempt and self.last_run_at is not None:
+            # 補跑失敗後不要立刻把剩下已過時的時間點連續用完，仍保持原本的間隔
+            spacing = timedelta(minutes=self.offsets[attempt] - self.offsets[attempt - 1])
+            run_at = max(run_at, self.last_run_at + spacing)
+        return run_at + timedelta(seconds=self._get_jitter(session, attempt)), session
+
+    def _get_jitter(self, session, attempt):
+        key = (session, attempt)
+        if key not in self._jitter:
+            self._jitter = {k: v for k, v in self._jitter.items() if k[0] >= session}
+            self._jitter[key] = random.uniform(0, self.jitter_seconds) if self.jitter_seconds else 0
+        return self._jitter[key]
+
+    def run_once(self, session):
+        """執行一次工作並記錄結果"""
+        self._attempts = {s: n for s, n in self._attempts.items() if s >= session}
+        self._attempts[session] = self._attempts.get(session, 0) + 1
+        self.runs += 1
+        self.last_run_at = self.now()
+        try:
+            done = bool(self.task(session))
+        except Exception as e:
+            logger.error(f"排程更新（交易日 {session}）失敗: {e}")
+            done = False
+        self.last_result = 'completed' if done else 'retry'
+        if done:
+            self.completed_session = session
+            logger.info(f"排程更新完成：交易日 {session}")
+        return done
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = self.now()
+            run_at, session = self.next_run(now)
+            wait = (run_at - now).total_seconds()
+            if wait > 0:
+                self._stop.wait(min(wait, self.max_sleep))
+                continue
+            if self.is_leader():
+                self.run_once(session)
+            else:
+                # 其他worker負責執行，這個時間點略過；持鎖的行程結束後下個時間點由搶到鎖的worker接手
+                self._attempts[session] = self._attempts.get(session, 0) + 1
+
+    def stats(self):
+        next_run_at, next_session = self.next_run()
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'leader': self._lock_file is not None or self.lock_path is None,
+            'offsets_minutes': list(self.offsets),
+            'jitter_seconds': self.jitter_seconds,
+            'completed_session': self.completed_session.isoformat() if self.completed_session else None,
+            'next_session': next_session.isoformat(),
+            'next_run_at': next_run_at.isoformat(),
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_result': self.last_result,
+            'runs': self.runs
+        }
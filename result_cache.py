@@ -0,0 +1,107 @@
+"""個股分析結果、個股指標序列與整體篩選結果的快取
+
+個股結果與指標序列以 (股票代碼, 資料日期, 指標參數) 為鍵，整體篩選結果以 (資料日期, 指標參數) 為鍵，
+都是有上限的LRU快取。更新快照時只讓K棒實際變動的股票失效。
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """執行緒安全、有容量上限的LRU快取"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def peek(self, key, default=None):
+        """讀取但不影響LRU順序與命中統計"""
+        with self._lock:
+            return self._data.get(key, default)
+
+    def invalidate(self, predicate):
+        """移除所有鍵符合 predicate 的項目，回傳移除數量"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class ResultCache:
+    """個股分析結果、個股指標序列與整體篩選結果的快取"""
+
+    def __init__(self, max_stocks=4096, max_screens=8, max_series=512):
+        self.stocks = LRUCache(max_stocks)
+        self.screens = LRUCache(max_screens)
+        self.series = LRUCache(max_series)
+
+    def get_stock(self, stock_code, data_date, params_key):
+        return self.stocks.get((stock_code, data_date, params_key))
+
+    def put_stock(self, stock_code, data_date, params_key, row):
+        self.stocks.put((stock_code, data_date, params_key), row)
+
+    def get_series(self, stock_code, data_date, params_key):
+        return self.series.get((stock_code, data_date, params_key))
+
+    def put_series(self, stock_code, data_date, params_key, series):
+        self.series.put((stock_code, data_date, params_key), series)
+
+    def get_screen(self, data_date, params_key):
+        return self.screens.get((data_date, params_key))
+
+    def peek_screen(self, data_date, params_key):
+        return self.screens.peek((data_date, params_key))
+
+    def put_screen(self, data_date, params_key, screen):
+        self.screens.put((data_date, params_key), screen)
+
+    def invalidate_stocks(self, stock_codes):
+        """讓指定股票的個股結果失效；有任何股票變動時整體篩選結果一併失效"""
+        stock_codes = set(stock_codes)
+        if not stock_codes:
+            return 0
+        self.screens.clear()
+        self.series.invalidate(lambda key: key[0] in stock_codes)
+        return self.stocks.invalidate(lambda key: key[0] in stock_codes)
+
+    def clear(self):
+        self.stocks.clear()
+        self.screens.clear()
+        self.series.clear()
+
+    def stats(self):
+        return {'stocks': self.stocks.stats(), 'screens': self.screens.stats(), 'series': self.series.stats()}
@@ -0,0 +1,307 @@
+"""背景篩選工作管理
+
+POST /api/screen 只建立工作並立即回傳工作ID，篩選在背景執行緒中進行，
+GET /api/screen/<job_id> 可隨時查詢進度（已處理/總數、預估剩餘時間、已找到的黃柱股票），
+完成後結果保留在記憶體中供之後取回。
+
+指定 state_dir 時，工作狀態同時寫入該目錄（每個工作一個JSON檔），多個gunicorn worker
+共用同一目錄，任一worker都能查詢、列出與取消其他worker建立的工作；
+取消以標記檔通知執行中的worker，於下一次回報進度時停止。
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """工作被取消時由篩選流程拋出"""
+
+
+class ScreenJob:
+    """單一篩選工作的狀態與進度"""
+
+    def __init__(self, job_id, params=None, key=None):
+        self.job_id = job_id
+        self.params = params or {}
+        self.key = key  # 相同key的未完成工作會被合併
+        self.status = 'queued'  # queued / running / completed / failed / cancelled
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.processed = 0
+        self.total = 0
+        self.hits = []
+        self.result = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self.cancel_event = threading.Event()  # 觸發後篩選流程停止排程並中斷在途請求
+        self.on_update = None  # 進度更新後呼叫（由管理器寫入共用狀態）
+
+    def update_progress(self, processed, total, new_hits=None):
+        """回報進度，new_hits 為這段新找到的黃柱股票"""
+        with self._lock:
+            self.processed = processed
+            self.total = total
+            if new_hits:
+                self.hits.extend(new_hits)
+        if self.on_update is not None:
+            self.on_update(self)
+
+    def wait(self, timeout=None):
+        """等待工作結束，逾時回傳False"""
+        return self._finished.wait(timeout)
+
+    def eta_seconds(self):
+        """依目前處理速度估計剩餘秒數"""
+        if self.status != 'running' or not self.processed or not self.total:
+            return None
+        elapsed = time.time() - self.started_at
+        return round(elapsed / self.processed * (self.total - self.processed), 1)
+
+    def to_dict(self, include_result=True):
+        with self._lock:
+            job = {
+                'job_id': self.job_id,
+                'status': self.status,
+                'params': self.params,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'progress': {
+                    'processed': self.processed,
+                    'total': self.total,
+                    'percent': round(self.processed / self.total * 100, 1) if self.total else 0,
+                    'eta_seconds': self.eta_seconds()
+                },
+                'hits': list(self.hits),
+                'error': self.error
+            }
+            if include_result:
+                job['result'] = self.result
+            return job
+
+
+class StoredJob:
+    """其他worker寫入的工作狀態（唯讀）"""
+
+    def __init__(self, state):
+        self.state = state
+        self.job_id = state['job_id']
+        self.status = state['status']
+        self.created_at = state['created_at']
+
+    def to_dict(self, include_result=True):
+        job = dict(self.state)
+        job.pop('owner_pid', None)
+        if not include_result:
+            job.pop('result', None)
+        return job
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ScreenJobManager:
+    """以固定大小的執行緒池執行篩選工作，並保留最近 max_history 筆工作
+
+    state_dir 為多個worker共用的工作狀態目錄（None時工作只存在本行程內）；
+    進度最多每 save_interval 秒寫入一次，狀態改變時立即寫入。
+    """
+
+    def __init__(self, max_concurrent_jobs=1, max_history=20, thread_name_prefix='screen-job',
+                 state_dir=None, save_interval=0.5, state_ttl=86400):
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix=thread_name_prefix)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.state_dir = state_dir
+        self.save_interval = save_interval
+        self._saved_at = {}
+        if state_dir:
+            try:
+                os.makedirs(state_dir, exist_ok=True)
+                self._prune_state(state_ttl)
+            except OSError as e:
+                logger.warning(f"工作狀態目錄 {state_dir} 無法使用，工作狀態只保留在本worker: {e}")
+                self.state_dir = None
+
+    def submit(self, target, params=None, key=None):
+        """建立工作並排入執行；target(job) 的回傳值即為工作結果
+
+        回傳 (工作, 是否共用)。key 相同且尚未結束的工作已存在時直接回傳該工作，不重複執行。
+        """
+        with self._lock:
+            if key is not None:
+                for existing in self._jobs.values():
+                    if existing.key == key and existing.status in ('queued', 'running'):
+                        return existing, True
+            job = ScreenJob(uuid.uuid4().hex[:12], params, key)
+            job.on_update = self._on_update
+            self._jobs[job.job_id] = job
+            self._evict()
+        self._save(job)
+        self._executor.submit(self._run, job, target)
+        return job, False
+
+    def get(self, job_id):
+        """本worker的工作，或其他worker寫入共用目錄的工作狀態；都不存在時回傳None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._load(job_id)
+
+    def cancel(self, job_id):
+        """要求停止工作；回傳工作（不存在時回傳None），已結束的工作不受影響"""
+        job = self.get(job_id)
+        if job is None or job.status not in ('queued', 'running'):
+            return job
+        if isinstance(job, ScreenJob):
+            job.cancel_event.set()
+        else:
+            # 由執行該工作的worker在下一次回報進度時發現並停止
+            try:
+                open(self._state_path(job_id, '.cancel'), 'w').close()
+            except OSError as e:
+                logger.warning(f"無法標記取消工作 {job_id}: {e}")
+        return job
+
+    def list_jobs(self):
+        """最近的工作（含其他worker的），新的在前"""
+        with self._lock:
+            jobs = list(reversed(self._jobs.values()))
+        if self.state_dir:
+            local_ids = {job.job_id for job in jobs}
+            for name in self._state_files():
+                job_id = name[:-len('.json')]
+                if job_id not in local_ids:
+                    job = self._load(job_id)
+                    if job is not None:
+                        jobs.append(job)
+            jobs.sort(key=lambda job: job.created_at, reverse=True)
+        return jobs[:self.max_history]
+
+    def _state_path(self, job_id, suffix='.json'):
+        return os.path.join(self.state_dir, f"{job_id}{suffix}")
+
+    def _state_files(self):
+        try:
+            return [name for name in os.listdir(self.state_dir) if name.endswith('.json')]
+        except OSError:
+            return []
+
+    def _save(self, job, force=True):
+        """以暫存檔加 os.replace 原子寫入工作狀態；force為False時依 save_interval 節流"""
+        if not self.state_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._saved_at.get(job.job_id, 0) < self.save_interval:
+            return
+        self._saved_at[job.job_id] = now
+        try:
+            state = json.dumps({**job.to_dict(), 'owner_pid': os.getpid()}, ensure_ascii=False, default=str)
+            fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(state)
+                os.replace(tmp_path, self._state_path(job.job_id))
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.warning(f"寫入工作 {job.job_id} 狀態失敗: {e}")
+
+    def _load(self, job_id):
+        if not self.state_dir or not job_id.isalnum():
+            return None
+        try:
+            with open(self._state_path(job_id), encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取工作 {job_id} 狀態失敗: {e}")
+            return None
+        # 執行中的worker已結束（重啟或當機）時，工作不會再有進度
+        if state['status'] in ('queued', 'running') and not _process_alive(state.get('owner_pid', 0)):
+            state = {**state, 'status': 'failed', 'error': '執行此工作的worker已結束'}
+        return StoredJob(state)
+
+    def _check_cancel(self, job):
+        """其他worker標記取消時觸發本工作的取消事件"""
+        if self.state_dir and os.path.exists(self._state_path(job.job_id, '.cancel')):
+            job.cancel_event.set()
+
+    def _on_update(self, job):
+        self._check_cancel(job)
+        self._save(job, force=False)
+
+    def _remove_state(self, job_id):
+        self._saved_at.pop(job_id, None)
+        if not self.state_dir:
+            return
+        for suffix in ('.json', '.cancel'):
+            try:
+                os.unlink(self._state_path(job_id, suffix))
+            except OSError:
+                pass
+
+    def _prune_state(self, ttl):
+        """清除超過 ttl 秒未更新的工作狀態檔（結束已久的worker留下的）"""
+        cutoff = time.time() - ttl
+        for name in os.listdir(self.state_dir):
+            path = os.path.join(self.state_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+    def _run(self, job, target):
+        job.status = 'running'
+        job.started_at = time.time()
+        self._save(job)
+        try:
+            self._check_cancel(job)
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            job.result = target(job)
+            job.status = 'completed'
+        except JobCancelled:
+            logger.info(f"篩選工作 {job.job_id} 已取消")
+            job.status = 'cancelled'
+        except Exception as e:
+            logger.error(f"篩選工作 {job.job_id} 失敗: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+            if self.state_dir:
+                try:
+                    os.unlink(self._state_path(job.job_id, '.cancel'))
+                except OSError:
+                    pass
+            job._finished.set()
+
+    def _evict(self):
+        """只移除已結束的舊工作，執行中的工作一律保留"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ('completed', 'failed', 'cancelled')]
+        while len(self._jobs) > self.max_history and finished:
+            job_id = finished.pop(0)
+            del self._jobs[job_id]
+            self._remove_state(job_id)
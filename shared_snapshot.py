@@ -0,0 +1,180 @@
+"""多個gunicorn worker共用的唯讀市場快照
+
+更新的行程把快照轉成欄式陣列（代碼、名稱、OHLC、成交量、漲跌、日期）寫成單一檔案，
+以 os.replace 原子發布到 /dev/shm（或其他目錄）。每個worker以唯讀 mmap 掛載，
+陣列直接指向共享的記憶體頁，不複製資料；發布新版本時舊的對應在worker換版前仍然有效。
+跨行程的更新以檔案鎖序列化，同一時間只有一個行程下載並發布。
+"""
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'TWSNAP02'
+_HEADER_LENGTH = struct.Struct('<Q')
+_ALIGNMENT = 64
+
+FLOAT_FIELDS = ('open', 'high', 'low', 'close', 'change', 'change_percent')
+TEXT_FIELDS = ('name', 'date', 'market')
+
+
+def default_snapshot_path():
+    """優先放在記憶體檔案系統 /dev/shm，沒有時放在專案的 data 目錄"""
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm/tw_stock_snapshot.bin'
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'shared_snapshot.bin')
+
+
+class SharedSnapshotView(Mapping):
+    """以 {股票代碼: 即時資料dict} 介面讀取mmap中的欄式快照
+
+    每次取值只組出該股票的小dict，整體資料留在共享記憶體中。
+    """
+
+    def __init__(self, arrays, buffer=None):
+        self._arrays = arrays
+        self._buffer = buffer  # 保持mmap存活
+        self._index = {code: i for i, code in enumerate(arrays['code'].tolist())}
+
+    def __getitem__(self, stock_code):
+        i = self._index[stock_code]
+        arrays = self._arrays
+        row = {field: float(arrays[field][i]) for field in FLOAT_FIELDS}
+        row['name'] = str(arrays['name'][i])
+        row['volume'] = int(arrays['volume'][i])
+        row['date'] = str(arrays['date'][i])
+        row['market'] = str(arrays['market'][i])
+        return row
+
+    def __contains__(self, stock_code):
+        return stock_code in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def column(self, field):
+        """直接取得整欄的唯讀陣列（不複製）"""
+        return self._arrays[field]
+
+
+def build_columns(stocks_data):
+    """{股票代碼: 即時資料} 轉為欄式陣列"""
+    codes = list(stocks_data)
+    columns = {'code': np.array(codes, dtype=str)}
+    for field in FLOAT_FIELDS:
+        columns[field] = np.array([float(stocks_data[c][field]) for c in codes], dtype=np.float64)
+    columns['volume'] = np.array([int(stocks_data[c]['volume']) for c in codes], dtype=np.int64)
+    for field in TEXT_FIELDS:
+        columns[field] = np.array([str(stocks_data[c].get(field) or '') for c in codes], dtype=str)
+    return columns
+
+
+def publish_snapshot(path, stocks_data, meta):
+    """原子發布新版本：meta 為可JSON序列化的附加資訊（更新時間、篩選結果等）"""
+    columns = build_columns(stocks_data)
+
+    layout = []
+    offset = 0
+    for name, values in columns.items():
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        layout.append({'name': name, 'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': offset})
+        offset += values.nbytes
+    header = json.dumps({'meta': meta, 'arrays': layout}, ensure_ascii=False).encode('utf-8')
+    data_start = -(-(len(SNAPSHOT_MAGIC) + _HEADER_LENGTH.size + len(header)) // _ALIGNMENT) * _ALIGNMENT
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            for entry, values in zip(layout, columns.values()):
+                f.seek(data_start + entry['offset'])
+                f.write(np.ascontiguousarray(values).tobytes())
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def attach_snapshot(path):
+    """以唯讀mmap掛載已發布的快照，回傳 (SharedSnapshotView, meta)"""
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError(f"不是有效的共享快照檔: {path}")
+    position = len(SNAPSHOT_MAGIC)
+    (header_length,) = _HEADER_LENGTH.unpack_from(buffer, position)
+    position += _HEADER_LENGTH.size
+    header = json.loads(bytes(buffer[position:position + header_length]).decode('utf-8'))
+    data_start = -(-(position + header_length) // _ALIGNMENT) * _ALIGNMENT
+
+    arrays = {}
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        arrays[entry['name']] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                              offset=data_start + entry['offset']).reshape(entry['shape'])
+    return SharedSnapshotView(arrays, buffer), header['meta']
+
+
+def snapshot_signature(path):
+    """已發布版本的識別（inode與修改時間），尚未發布時回傳None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class SharedSnapshotReader:
+    """追蹤已發布的版本，有新版本時才重新掛載"""
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+
+    def poll(self):
+        """有新版本時回傳 (SharedSnapshotView, meta)，否則回傳None"""
+        signature = snapshot_signature(self.path)
+        if signature is None or signature == self.signature:
+            return None
+        try:
+            view, meta = attach_snapshot(self.path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"掛載共享快照失敗: {e}")
+            return None
+        self.signature = signature
+        return view, meta
+
+    def mark_published(self):
+        """本行程剛發布的版本不需要再掛載"""
+        self.signature = snapshot_signature(self.path)
+
+
+@contextmanager
+def publisher_lock(path):
+    """跨行程的更新鎖，確保同一時間只有一個行程下載並發布快照"""
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,175 @@
+"""黃柱篩選的前置過濾
+
+黃柱需要 crossover(資金流向, 多空線) 且多空線 < 25（當日或前一日）。多空線是34期標準化價格的13期EMA，
+有前一交易日的 IndicatorState（資金流向、多空線與34期視窗極值）後，只要今天 STOCK_DAY_ALL 的一根K棒
+就能算出今天多空線的下界：
+    今日多空線 = 今日標準化價格 × α + 昨日多空線 × (1 − α)，α = 2/14
+昨日與今日都不可能出現黃柱的股票，不需要下載歷史資料就能排除。
+
+篩選時的歷史視窗只有最近 history_days 根K棒，與狀態的起點不同：較晚開始的序列前33根K棒的34期極值
+只涵蓋部分視窗（標準化價格不同），EMA種子也不同。兩者的標準化價格從較晚序列的第34根K棒起才完全相同，
+此後多空線差距每根K棒乘上 (1 − α)，因此不超過 100 × (1 − α)^(兩者都有完整34期極值後的K棒數)；
+所有判斷都預留這個誤差，因此不會排除真正的黃柱股票。資金流向只依賴最近27+5+3根K棒，兩者相同。
+"""
+import copy
+import logging
+import threading
+
+from history_store import normalize_trade_date
+from indicator_state import IndicatorState, load_indicator_states, save_indicator_states
+from pine_indicators import MIN_BARS
+
+logger = logging.getLogger(__name__)
+
+OVERSOLD_THRESHOLD = 25
+EMA_PERIOD = 13
+EMA_ALPHA = 2 / (EMA_PERIOD + 1)
+FLOAT_TOLERANCE = 1e-6
+
+
+def ema_seed_error(bar_count, history_days=60):
+    """狀態（bar_count 根K棒）與篩選視窗起點不同造成的前一日多空線誤差上界
+
+    篩選視窗到前一日為止有 history_days - 1 根K棒；較短的一方從第 MIN_BARS 根起標準化價格才與另一方相同，
+    之前的差距最多為100，之後每根K棒衰減為 (1 − α) 倍。
+    """
+    steps = min(bar_count, history_days - 1) - (MIN_BARS - 1)
+    return 100 * (1 - EMA_ALPHA) ** max(steps, 0) + FLOAT_TOLERANCE
+
+
+def _window_extreme(window, first_index):
+    """單調佇列中 first_index 之後（含）的極值；佇列前端即為該區段的極值"""
+    for index, value in window.items:
+        if index >= first_index:
+            return value
+    return None
+
+
+def cannot_signal(state, bar, history_days=60):
+    """state 為前一交易日收盤後的指標狀態，bar 為今天的K棒；昨日與今日都不可能出現黃柱時回傳True"""
+    if state.bar_count < MIN_BARS or state.fund_flow is None:
+        return False
+
+    error = ema_seed_error(state.bar_count, history_days)
+    previous_fund = state.fund_flow
+    previous_line = state.bull_bear_line
+
+    # 昨日黃柱需要 昨日資金流向 > 昨日多空線 且 昨日多空線 < 25
+    if previous_fund > previous_line - error and previous_line - error < OVERSOLD_THRESHOLD:
+        return False
+
+    # 今日 crossover 需要 昨日資金流向 <= 昨日多空線
+    if previous_fund > previous_line + error:
+        return True
+
+    # 今日多空線的下界：今日標準化價格以今天的K棒與前33根K棒的極值算出
+    opening, high, low, close = (float(bar[field]) for field in ('open', 'high', 'low', 'close'))
+    first_index = state.bar_count - 33
+    lowest_34 = min(low, _window_extreme(state.low_34, first_index))
+    highest_34 = max(high, _window_extreme(state.high_34, first_index))
+    if highest_34 - lowest_34 > 0:
+        normalized = ((2 * close + high + low + opening) / 5 - lowest_34) / (highest_34 - lowest_34) * 100
+        normalized = max(0.0, min(100.0, normalized))
+    else:
+        normalized = 50.0
+    lower_bound = normalized * EMA_ALPHA + (previous_line - error) * (1 - EMA_ALPHA)
+    return lower_bound >= OVERSOLD_THRESHOLD
+
+
+class SignalPrefilter:
+    """保存每支股票最近的指標狀態，篩選前排除不可能出現黃柱的股票"""
+
+    def __init__(self, history_days=60, path=None):
+        self.history_days = history_days
+        self.path = path
+        self._states = {}  # {股票代碼: {YYYYMMDD: IndicatorState}}，只保留最近兩個交易日
+        self._lock = threading.Lock()
+        self.pruned_total = 0
+        self.checked_total = 0
+
+    def load(self):
+        """讀回持久化的狀態，回傳載入的股票數"""
+        if not self.path:
+            return 0
+        states = load_indicator_states(self.path)
+        for stock_code, state in states.items():
+            self._put(stock_code, state)
+        return len(states)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            latest = {code: by_date[max(by_date)] for code, by_date in self._states.items() if by_date}
+        try:
+            save_indicator_states(self.path, latest)
+        except OSError as e:
+            logger.warning(f"寫入指標狀態檔 {self.path} 失敗: {e}")
+
+    def _put(self, stock_code, state):
+        date = normalize_trade_date(state.last_date)
+        if date is None:
+            return
+        with self._lock:
+            by_date = self._states.setdefault(stock_code, {})
+            by_date[date] = state
+            for old in sorted(by_date)[:-2]:
+                del by_date[old]
+
+    def _get(self, stock_code, date):
+        with self._lock:
+            return self._states.get(stock_code, {}).get(date)
+
+    def record_history(self, stock_code, ohlc_data):
+        """以篩選用的歷史資料（最後一根為今天）建立前一日與今日的狀態"""
+        if len(ohlc_data) < MIN_BARS + 1:
+            return
+        state = IndicatorState.from_history(ohlc_data[:-1], stock_code)
+        self._put(stock_code, copy.deepcopy(state))
+        state.update(ohlc_data[-1])
+        self._put(stock_code, state)
+
+    def split(self, stock_codes, stocks, previous_session):
+        """回傳 (需要完整分析的股票, 被排除的股票)
+
+        stocks 為 {股票代碼: 今日即時資料}；previous_session(今日日期) 回傳前一交易日 YYYYMMDD 整數。
+        被排除的股票把狀態推進到今天，下一個交易日仍可直接使用。
+        """
+        remaining = []
+        pruned = []
+        for stock_code in stock_codes:
+            bar = stocks[stock_code]
+            today = normalize_trade_date(bar['date'])
+            state = self._get(stock_code, previous_session(today)) if today else None
+            if state is None or not cannot_signal(state, bar, self.history_days):
+                remaining.append(stock_code)
+                continue
+            pruned.append(stock_code)
+            if self._get(stock_code, today) is None:
+                advanced = copy.deepcopy(state)
+                advanced.update(bar)
+                self._put(stock_code, advanced)
+
+        self.checked_total += len(stock_codes)
+        self.pruned_total += len(pruned)
+        return remaining, pruned
+
+    def prioritize(self, stock_codes, stocks, previous_session):
+        """依前一交易日多空線由低到高排序（越接近超賣越先分析），沒有狀態的股票視為在門檻上"""
+        def priority(stock_code):
+            today = normalize_trade_date(stocks[stock_code]['date'])
+            state = self._get(stock_code, previous_session(today)) if today else None
+            if state is None or state.bull_bear_line is None:
+                return OVERSOLD_THRESHOLD
+            return state.bull_bear_line
+
+        return sorted(stock_codes, key=priority)
+
+    def stats(self):
+        with self._lock:
+            tracked = len(self._states)
+        return {
+            'tracked_stocks': tracked,
+            'checked': self.checked_total,
+            'pruned': self.pruned_total
+        }
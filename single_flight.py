@@ -0,0 +1,52 @@
+"""相同請求的合併執行（single-flight）
+
+同一個鍵同時只有一個呼叫真正執行，其餘並行呼叫等待並取得同一個結果（或同一個例外），
+避免重複下載與重複計算，也避免多個請求同時改寫全域狀態。
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """以鍵合併並行呼叫"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """執行 fn(*args, **kwargs)，回傳 (結果, 是否共用其他呼叫的結果)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
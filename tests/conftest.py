@@ -0,0 +1,45 @@
+"""測試共用設定：app 的本地檔案（歷史資料庫、暖啟動檔、共享快照、工作狀態）都放在暫存目錄"""
+import atexit
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_state_dir = tempfile.mkdtemp(prefix='tw_stock_test_')
+atexit.register(shutil.rmtree, _state_dir, ignore_errors=True)
+os.environ.setdefault('HISTORY_STORE_DIR', os.path.join(_state_dir, 'history'))
+os.environ.setdefault('WARM_START_PATH', os.path.join(_state_dir, 'warm_start.json.gz'))
+os.environ.setdefault('SHARED_SNAPSHOT_PATH', os.path.join(_state_dir, 'shared_snapshot.bin'))
+os.environ.setdefault('SCREEN_JOB_STATE_DIR', os.path.join(_state_dir, 'jobs'))
+os.environ.setdefault('INDICATOR_STATE_PATH', os.path.join(_state_dir, 'indicator_states.json'))
+os.environ.setdefault('REFRESH_SCHEDULER_ENABLED', '0')
+
+
+def generate_history(length, seed, flat_bars=0, drift=0.0):
+    """固定種子的隨機K棒；前 flat_bars 根為平盤（最高=最低），drift 為每日平均漲跌幅"""
+    rng = random.Random(seed)
+    price = 100.0
+    bars = []
+    for index in range(length):
+        price *= 1 + drift + (rng.random() - 0.5) * 0.06
+        if index < flat_bars:
+            opening = high = low = close = 50.0
+        else:
+            opening = price + (rng.random() - 0.5) * 2
+            close = price + (rng.random() - 0.5) * 2
+            high = max(opening, close) + rng.random()
+            low = min(opening, close) - rng.random()
+        bars.append({'date': f"2026{index // 28 + 1:02d}{index % 28 + 1:02d}", 'open': opening, 'high': high,
+                     'low': low, 'close': close, 'volume': 1000})
+    return bars
+
+
+@pytest.fixture
+def make_history():
+    return generate_history
@@ -0,0 +1,71 @@
+"""本地歷史資料庫的合併規則"""
+from history_store import HistoryStore
+
+
+def bar(date, close=10.0):
+    return {'date': date, 'open': close, 'high': close + 1, 'low': close - 1, 'close': close, 'volume': 1000}
+
+
+def previous_session(today):
+    return {20261016: 20261015, 20261015: 20261014}[today]
+
+
+def test_merge_snapshot_skips_stale_history(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.merge('current', [bar('2026-10-14'), bar('2026-10-15')])
+    store.merge('same_day', [bar('2026-10-15'), bar('2026-10-16', 11.0)])
+    store.merge('stale', [bar('2026-10-12'), bar('2026-10-13')])
+
+    merged = store.merge_snapshot({
+        'current': bar('1151016', 12.0),
+        'same_day': bar('1151016', 12.0),
+        'stale': bar('1151016', 12.0),
+        'missing': bar('1151016', 12.0)
+    }, previous_session)
+
+    assert merged == 2
+    assert store.last_date('current') == 20261016
+    assert store.to_ohlc_list('same_day')[-1]['close'] == 12.0
+    # 落後的股票維持原本的最後日期，下一次獲取才會補抓缺少的交易日
+    assert store.last_date('stale') == 20261013
+    assert store.last_date('missing') is None
+
+
+def test_load_sees_writes_from_another_process(tmp_path):
+    worker_a = HistoryStore(str(tmp_path))
+    worker_b = HistoryStore(str(tmp_path))
+    worker_a.merge('2330', [bar('2026-10-14')])
+    assert worker_b.bar_count('2330') == 1
+
+    worker_a.merge('2330', [bar('2026-10-15')])
+
+    # worker_b 的快取已過期，需重新讀取而不是以舊資料合併
+    assert worker_b.last_date('2330') == 20261015
+    worker_b.merge('2330', [bar('2026-10-16')])
+    assert worker_a.bar_count('2330') == 3
+
+
+def _merge_days(root, offset, count):
+    store = HistoryStore(root)
+    for day in range(count):
+        store.merge('2330', [bar(f"2026{offset + day // 28 + 1:02d}{day % 28 + 1:02d}")])
+
+
+def test_concurrent_merges_from_processes_keep_every_row(tmp_path):
+    import multiprocessing
+
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_merge_days, args=(str(tmp_path), offset, 40)) for offset in (0, 4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert HistoryStore(str(tmp_path)).bar_count('2330') == 80
+
+
+def test_merge_skips_bars_with_missing_prices(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.merge('2330', [bar('2026-10-14'), {**bar('2026-10-15'), 'low': None}, bar('2026-10-16')])
+
+    assert [row['date'] for row in store.to_ohlc_list('2330')] == ['2026-10-14', '2026-10-16']
@@ -0,0 +1,34 @@
+"""行程池的緊湊編碼需與逐股計算的結果一致"""
+import numpy as np
+
+from indicator_pool import compute_packed, pack_histories, unpack_panel
+from pine_indicators import calculate_pine_script_indicators_batch
+
+
+def test_pack_skips_bars_with_missing_prices(make_history):
+    bars = make_history(61, 1)
+    gapped = [dict(bar) for bar in bars]
+    gapped[10]['close'] = None
+    del gapped[20]['high']
+
+    codes, lengths_bytes, ohlc_bytes = pack_histories({'2330': gapped, 'empty': None})
+    opens, highs, lows, closes, starts = unpack_panel(lengths_bytes, ohlc_bytes)
+
+    assert codes == ['2330', 'empty']
+    assert list(np.frombuffer(lengths_bytes, dtype=np.int32)) == [59, 0]
+    assert not (closes[0] == 0).any()
+    assert closes[0, -1] == bars[-1]['close']
+
+
+def test_compute_packed_matches_batch(make_history):
+    histories = {str(1000 + seed): make_history(length, seed)
+                 for seed, length in enumerate((34, 40, 61, 61, 90, 20))}
+    gapped = [dict(bar) for bar in histories['1002']]
+    gapped[30]['low'] = None
+    histories['gap'] = gapped
+
+    results = compute_packed(*pack_histories(histories))
+    expected = calculate_pine_script_indicators_batch(
+        {**histories, 'gap': gapped[:30] + gapped[31:]})
+
+    assert results == expected
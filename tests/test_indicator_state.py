@@ -0,0 +1,70 @@
+"""逐K棒增量狀態需與參考實作一致，快照還原後繼續推進的結果也相同"""
+import json
+
+import pytest
+
+from app import calculate_pine_script_indicators_reference
+from indicator_state import IndicatorState, load_indicator_states, save_indicator_states
+from pine_indicators import INDICATOR_TOLERANCE
+
+
+def assert_same_result(actual, expected):
+    assert set(actual) == set(expected)
+    for key, value in expected.items():
+        if isinstance(value, bool):
+            assert actual[key] == value, key
+        else:
+            assert actual[key] == pytest.approx(value, abs=INDICATOR_TOLERANCE), key
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_replay_matches_reference(make_history, seed):
+    bars = make_history(90, seed, flat_bars=40 if seed % 10 == 0 else 0, drift=-0.005 if seed % 2 else 0.0)
+    state = IndicatorState()
+    for index, bar in enumerate(bars):
+        result = state.update(bar)
+        if index + 1 < 34:
+            assert result is None
+        else:
+            assert_same_result(result, calculate_pine_script_indicators_reference(bars[:index + 1]))
+
+
+def test_snapshot_restore_continues_identically(make_history):
+    bars = make_history(120, 3, drift=-0.003)
+    state = IndicatorState.from_history(bars[:70], '2330')
+
+    restored = IndicatorState.restore(json.loads(json.dumps(state.snapshot())))
+
+    assert restored.stock_code == '2330'
+    assert restored.bar_count == 70
+    for bar in bars[70:]:
+        assert restored.update(bar) == state.update(bar)
+
+
+def test_save_and_load_states(tmp_path, make_history):
+    bars = make_history(80, 5)
+    states = {'2330': IndicatorState.from_history(bars[:60], '2330'),
+              '2317': IndicatorState.from_history(bars[:50], '2317')}
+    path = tmp_path / 'states.json'
+
+    save_indicator_states(str(path), states)
+    loaded = load_indicator_states(str(path))
+
+    assert set(loaded) == set(states)
+    for code, state in states.items():
+        assert loaded[code].snapshot() == state.snapshot()
+    assert_same_result(loaded['2330'].update(bars[60]), calculate_pine_script_indicators_reference(bars[:61]))
+
+
+def test_restore_rejects_unknown_version():
+    snapshot = IndicatorState().snapshot()
+    snapshot['version'] = 0
+    with pytest.raises(ValueError):
+        IndicatorState.restore(snapshot)
+
+
+def test_load_missing_or_corrupt_file(tmp_path):
+    assert load_indicator_states(str(tmp_path / 'missing.json')) == {}
+    corrupt = tmp_path / 'corrupt.json'
+    corrupt.write_text('{not json', encoding='utf-8')
+    assert load_indicator_states(str(corrupt)) == {}
@@ -0,0 +1,94 @@
+"""參數掃描的每組參數需與逐筆計算的參考實作一致"""
+import numpy as np
+import pytest
+
+from app import calculate_ema, calculate_pine_script_indicators_reference, calculate_weighted_simple_average
+from parameter_sweep import DEFAULT_PARAMS, SweepPanel, normalize_params, required_bars
+from pine_indicators import INDICATOR_TOLERANCE
+
+
+def reference_series(bars, params):
+    """calculate_pine_script_indicators_reference 的逐筆計算，視窗長度與係數改由 params 決定"""
+    opens = [bar['open'] for bar in bars]
+    highs = [bar['high'] for bar in bars]
+    lows = [bar['low'] for bar in bars]
+    closes = [bar['close'] for bar in bars]
+    fund_window, fast, slow = params['fund_window'], params['fund_fast'], params['fund_slow']
+
+    def extremes(index, window):
+        start = max(0, index - window + 1)
+        return min(lows[start:index + 1]), max(highs[start:index + 1])
+
+    def relative_position(index):
+        lowest, highest = extremes(index, fund_window)
+        return (closes[index] - lowest) / (highest - lowest) * 100 if highest != lowest else 50
+
+    def wsa1(index):
+        values = [relative_position(j) for j in range(max(0, index - fast + 1), index + 1)]
+        return calculate_weighted_simple_average(values, min(fast, len(values)), 1)
+
+    fund_flow = []
+    for i in range(len(bars)):
+        lowest, highest = extremes(i, fund_window)
+        if highest == lowest:
+            fund_flow.append(50)
+            continue
+        first = wsa1(i)
+        if i >= slow - 1:
+            values = [wsa1(k) for k in range(max(0, i - slow + 1), i + 1)]
+            second = calculate_weighted_simple_average(values, min(slow, len(values)), 1)
+        else:
+            second = first
+        fund_flow.append(max(0, min(100, (3 * first - 2 * second - 50) * params['fund_factor'] + 50)))
+
+    normalized = []
+    for i in range(len(bars)):
+        lowest, highest = extremes(i, params['bull_window'])
+        typical_price = (2 * closes[i] + highs[i] + lows[i] + opens[i]) / 5
+        value = (typical_price - lowest) / (highest - lowest) * 100 if highest != lowest else 50
+        normalized.append(max(0, min(100, value)))
+    period = params['bull_ema']
+    bull_bear_line = [sum(normalized[:i + 1]) / (i + 1) if i < period else calculate_ema(normalized[:i + 1], period)
+                      for i in range(len(bars))]
+    return fund_flow, bull_bear_line
+
+
+def test_reference_series_matches_reference_at_default_params(make_history):
+    for seed in range(20):
+        bars = make_history(61, seed, drift=-0.005)
+        fund_flow, bull_bear_line = reference_series(bars, DEFAULT_PARAMS)
+        expected = calculate_pine_script_indicators_reference(bars)
+        assert fund_flow[-1] == pytest.approx(expected['fund_trend'], abs=INDICATOR_TOLERANCE)
+        assert bull_bear_line[-1] == pytest.approx(expected['multi_short_line'], abs=INDICATOR_TOLERANCE)
+
+
+@pytest.mark.parametrize('overrides', [
+    {'fund_slow': 2},
+    {'fund_slow': 4},
+    {'fund_slow': 5, 'fund_fast': 3},
+    {'fund_window': 21, 'fund_fast': 8, 'fund_slow': 6, 'fund_factor': 1.05, 'bull_window': 30, 'bull_ema': 10,
+     'oversold': 30},
+])
+def test_sweep_series_match_reference(make_history, overrides):
+    params = normalize_params(overrides)
+    histories = {str(1000 + seed): make_history(length, seed, drift=-0.005 if seed % 2 else 0.0)
+                 for seed, length in enumerate([34, 40, 61, 61, 75] * 6)}
+    panel = SweepPanel(histories)
+    fund_flow = panel.fund_flow(params)
+    bull_bear_line = panel.bull_bear_line(params)
+    hits = {hit['code'] for hit in panel.evaluate(params)['hits']}
+
+    expected_hits = set()
+    for row, code in enumerate(panel.codes):
+        bars = histories[code]
+        expected_fund, expected_line = reference_series(bars, params)
+        # 整段序列（不只最後一天）都需一致，才能確認前段的暖機規則
+        assert np.allclose(fund_flow[row, -len(bars):], expected_fund, atol=INDICATOR_TOLERANCE, rtol=0)
+        assert np.allclose(bull_bear_line[row, -len(bars):], expected_line, atol=INDICATOR_TOLERANCE, rtol=0)
+
+        crossover = [expected_fund[i] > expected_line[i] and expected_fund[i - 1] <= expected_line[i - 1]
+                     for i in (-2, -1)]
+        signal = [crossover[k] and expected_line[i] < params['oversold'] for k, i in enumerate((-2, -1))]
+        if len(bars) >= required_bars(params) and any(signal):
+            expected_hits.add(code)
+    assert hits == expected_hits
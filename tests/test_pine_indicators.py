@@ -0,0 +1,81 @@
+"""向量化與批次指標引擎需與逐筆計算的參考實作一致"""
+import random
+
+import pytest
+
+from app import calculate_pine_script_indicators_reference
+from pine_indicators import (
+    INDICATOR_TOLERANCE,
+    calculate_pine_script_indicators_batch,
+    calculate_pine_script_indicators_vectorized,
+)
+
+LENGTHS = (34, 35, 36, 40, 61, 120)
+
+
+def assert_same_result(actual, expected):
+    if not isinstance(expected, dict):
+        assert actual == expected
+        return
+    assert set(actual) == set(expected)
+    for key, value in expected.items():
+        if isinstance(value, bool):
+            assert actual[key] == value, key
+        else:
+            assert actual[key] == pytest.approx(value, abs=INDICATOR_TOLERANCE), key
+
+
+def sample_histories(make_history, count=400):
+    histories = {}
+    for seed in range(count):
+        rng = random.Random(seed)
+        histories[f"{1000 + seed}"] = make_history(
+            rng.choice(LENGTHS), seed,
+            flat_bars=40 if seed % 50 == 0 else 0,
+            drift=rng.choice((-0.01, 0.0, 0.005)))
+    return histories
+
+
+def test_vectorized_matches_reference(make_history):
+    histories = sample_histories(make_history)
+    signals = 0
+    for bars in histories.values():
+        expected = calculate_pine_script_indicators_reference(bars)
+        assert_same_result(calculate_pine_script_indicators_vectorized(bars), expected)
+        signals += expected['banker_entry_signal']
+    assert signals > 0  # 樣本需包含黃柱，否則旗標的比對沒有意義
+
+
+def test_vectorized_short_history(make_history):
+    bars = make_history(33, 1)
+    assert calculate_pine_script_indicators_vectorized(bars) == calculate_pine_script_indicators_reference(bars)
+
+
+def test_batch_with_ragged_lengths_matches_reference(make_history):
+    histories = sample_histories(make_history)
+    histories['short'] = make_history(20, 7)
+    histories['empty'] = []
+
+    results = calculate_pine_script_indicators_batch(histories)
+
+    assert set(results) == set(histories)
+    assert results['short'] is None
+    assert results['empty'] is None
+    for code, bars in histories.items():
+        if len(bars) >= 34:
+            assert_same_result(results[code], calculate_pine_script_indicators_reference(bars))
+
+
+def test_batch_empty():
+    assert calculate_pine_script_indicators_batch({}) == {}
+
+
+def test_batch_skips_bars_with_missing_prices(make_history):
+    bars = make_history(61, 3)
+    gapped = [dict(bar) for bar in bars]
+    gapped[5]['low'] = None
+    del gapped[40]['open']
+
+    results = calculate_pine_script_indicators_batch({'gap': gapped})
+
+    assert_same_result(results['gap'], calculate_pine_script_indicators_reference(bars[:5] + bars[6:40] + bars[41:]))
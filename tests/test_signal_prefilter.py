@@ -0,0 +1,83 @@
+"""前置過濾不可排除真正出現黃柱的股票"""
+import random
+
+import pytest
+
+from app import calculate_pine_script_indicators_reference
+from indicator_state import IndicatorState
+from pine_indicators import calculate_pine_script_indicators_vectorized
+from signal_prefilter import SignalPrefilter, cannot_signal, ema_seed_error
+
+HISTORY_DAYS = 60
+
+
+def walk_days(make_history, seed, length=120):
+    """以前一日篩選視窗建立的狀態逐日推進，產生 (狀態, 今日K棒, 到今日為止的K棒)"""
+    rng = random.Random(seed)
+    bars = make_history(length, seed, drift=rng.choice((-0.01, -0.005, 0.0, 0.005)))
+    start = 30 if seed % 2 else 0
+    state = IndicatorState.from_history(bars[start:start + HISTORY_DAYS + 1])
+    for index in range(start + HISTORY_DAYS + 1, length):
+        yield state, bars[index], bars[:index + 1]
+        state.update(bars[index])
+
+
+@pytest.mark.parametrize('window', [HISTORY_DAYS, HISTORY_DAYS + 1])
+def test_ema_seed_error_bounds_line_difference(make_history, window):
+    """狀態與篩選視窗（到前一日為止）的多空線實際差距不超過 ema_seed_error"""
+    worst = 0.0
+    for seed in range(600):
+        rng = random.Random(seed)
+        bars = make_history(rng.randint(window + 5, 150), seed, drift=rng.choice((-0.01, -0.003, 0.0, 0.005)))
+        screen_line = calculate_pine_script_indicators_vectorized(bars[-(window - 1):])['multi_short_line']
+        for bar_count in (34, 40, window - 2, window - 1, window + 3, len(bars)):
+            state = IndicatorState.from_history(bars[-bar_count:])
+            difference = abs(state.bull_bear_line - screen_line)
+            assert difference <= ema_seed_error(state.bar_count, HISTORY_DAYS)
+            worst = max(worst, difference)
+    # 起點不同確實會造成差距，不只是EMA種子的衰減
+    assert worst > 100 * (1 - 2 / 14) ** (HISTORY_DAYS - 1 - 14)
+
+
+@pytest.mark.parametrize('window', [HISTORY_DAYS, HISTORY_DAYS + 1])
+def test_cannot_signal_never_prunes_a_signal(make_history, window):
+    pruned = 0
+    signals = 0
+    for seed in range(30):
+        for state, bar, bars in walk_days(make_history, seed):
+            # 篩選以最近 60（或含今日共61）根K棒計算
+            signal = calculate_pine_script_indicators_reference(bars[-window:])['banker_entry_signal']
+            if cannot_signal(state, bar, HISTORY_DAYS):
+                assert not signal
+                pruned += 1
+            signals += signal
+    # 樣本需同時有被排除的股票與黃柱，檢查才有意義
+    assert pruned > 0
+    assert signals > 0
+
+
+def test_cannot_signal_needs_enough_bars(make_history):
+    bars = make_history(40, 1, drift=0.01)
+    state = IndicatorState.from_history(bars[:33])
+    assert cannot_signal(state, bars[33], HISTORY_DAYS) is False
+
+
+def test_split_keeps_every_signal(make_history):
+    prefilter = SignalPrefilter(history_days=HISTORY_DAYS)
+    stocks = {}
+    expected = set()
+    for seed in range(200):
+        code = str(1000 + seed)
+        bars = make_history(HISTORY_DAYS + 2, seed, drift=random.Random(seed).choice((-0.01, 0.0, 0.005)))
+        bars[-2]['date'], bars[-1]['date'] = '20261015', '20261016'
+        prefilter.record_history(code, bars[:-1])
+        stocks[code] = bars[-1]
+        if calculate_pine_script_indicators_reference(bars[-HISTORY_DAYS:])['banker_entry_signal']:
+            expected.add(code)
+
+    remaining, pruned = prefilter.split(list(stocks), stocks, lambda today: 20261015)
+
+    assert pruned
+    assert expected
+    assert expected <= set(remaining)
+    assert set(remaining) | set(pruned) == set(stocks)
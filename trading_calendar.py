@@ -0,0 +1,148 @@
+"""台灣證券交易所交易日曆
+
+以本地休市表（國定假日、農曆春節、颱風停止交易）與特殊收盤時間判斷交易日，
+回答「最近一個已公布資料的交易日」、「下一次資料公布時間」與「兩日之間有幾個交易日」。
+休市表依證交所每年公告維護；臨時休市（例如颱風）可寫入 TRADING_CALENDAR_FILE
+（JSON：{"holidays": ["2026-07-24", ...], "half_days": {"2026-02-11": "12:00"}}）而不需改程式。
+"""
+import json
+import logging
+import os
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+TAIWAN_TZ = timezone(timedelta(hours=8))
+
+# 證交所休市日（不含週末）
+TWSE_HOLIDAYS = frozenset(date.fromisoformat(d) for d in (
+    # 2024
+    '2024-01-01', '2024-02-08', '2024-02-09', '2024-02-12', '2024-02-13', '2024-02-14',
+    '2024-02-28', '2024-04-04', '2024-04-05', '2024-05-01', '2024-06-10', '2024-07-24',
+    '2024-07-25', '2024-09-17', '2024-10-02', '2024-10-03', '2024-10-10', '2024-10-31',
+    # 2025
+    '2025-01-01', '2025-01-23', '2025-01-24', '2025-01-27', '2025-01-28', '2025-01-29',
+    '2025-01-30', '2025-01-31', '2025-02-28', '2025-04-03', '2025-04-04', '2025-05-01',
+    '2025-05-30', '2025-09-29', '2025-10-06', '2025-10-10', '2025-10-24', '2025-12-25',
+    # 2026
+    '2026-01-01', '2026-02-12', '2026-02-13', '2026-02-16', '2026-02-17', '2026-02-18',
+    '2026-02-19', '2026-02-20', '2026-02-27', '2026-04-03', '2026-04-06', '2026-05-01',
+    '2026-06-19', '2026-09-25', '2026-09-28', '2026-10-09', '2026-10-26', '2026-12-25',
+))
+
+REGULAR_CLOSE = time(13, 30)
+# STOCK_DAY_ALL 於收盤後約一小時更新
+DEFAULT_PUBLISH_DELAY = timedelta(minutes=int(os.environ.get('TWSE_PUBLISH_DELAY_MINUTES', 60)))
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.astimezone(TAIWAN_TZ).date() if value.tzinfo else value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip().replace('-', '').replace('/', '')
+    if len(text) == 7:  # 民國年
+        text = str(int(text) + 19110000)
+    return datetime.strptime(text, '%Y%m%d').date()
+
+
+class TradingCalendar:
+    """交易日判斷與交易日區間查詢"""
+
+    def __init__(self, holidays=TWSE_HOLIDAYS, half_days=None, close_time=REGULAR_CLOSE,
+                 publish_delay=DEFAULT_PUBLISH_DELAY):
+        self.holidays = frozenset(holidays)
+        self.half_days = dict(half_days or {})  # {date: 收盤時間}
+        self.close_time = close_time
+        self.publish_delay = publish_delay
+        self._sessions = []  # 已展開的交易日（排序），供區間查詢二分搜尋
+        self._range = None
+
+    def is_trading_day(self, value):
+        day = _as_date(value)
+        return day.weekday() < 5 and day not in self.holidays
+
+    def session_close(self, value):
+        """該交易日的收盤時間（台灣時間）"""
+        day = _as_date(value)
+        return datetime.combine(day, self.half_days.get(day, self.close_time), tzinfo=TAIWAN_TZ)
+
+    def publish_time(self, value):
+        """該交易日的資料預計公布時間"""
+        return self.session_close(value) + self.publish_delay
+
+    def previous_trading_day(self, value):
+        day = _as_date(value) - timedelta(days=1)
+        while not self.is_trading_day(day):
+            day -= timedelta(days=1)
+        return day
+
+    def next_trading_day(self, value):
+        day = _as_date(value) + timedelta(days=1)
+        while not self.is_trading_day(day):
+            day += timedelta(days=1)
+        return day
+
+    def latest_complete_session(self, now=None):
+        """資料已公布的最近一個交易日"""
+        now = now or datetime.now(TAIWAN_TZ)
+        day = now.astimezone(TAIWAN_TZ).date()
+        if not self.is_trading_day(day) or now < self.publish_time(day):
+            day = self.previous_trading_day(day)
+        return day
+
+    def next_publish_time(self, now=None):
+        """下一次資料公布時間（今天尚未公布時為今天）"""
+        now = now or datetime.now(TAIWAN_TZ)
+        day = now.astimezone(TAIWAN_TZ).date()
+        if not self.is_trading_day(day) or now >= self.publish_time(day):
+            day = self.next_trading_day(day)
+        return self.publish_time(day)
+
+    def _ensure_range(self, start, end):
+        if self._range and self._range[0] <= start and end <= self._range[1]:
+            return
+        low = min(start, self._range[0]) if self._range else start
+        high = max(end, self._range[1]) if self._range else end
+        # 一次展開前後多一年，之後的查詢只需二分搜尋
+        low = date(low.year - 1, 1, 1)
+        high = date(high.year + 1, 12, 31)
+        sessions = []
+        day = low
+        while day <= high:
+            if self.is_trading_day(day):
+                sessions.append(day)
+            day += timedelta(days=1)
+        self._sessions = sessions
+        self._range = (low, high)
+
+    def sessions_between(self, start, end):
+        """start 到 end（皆含）之間的交易日清單"""
+        start, end = _as_date(start), _as_date(end)
+        if start > end:
+            return []
+        self._ensure_range(start, end)
+        return self._sessions[bisect_left(self._sessions, start):bisect_right(self._sessions, end)]
+
+    def count_sessions_between(self, start, end):
+        return len(self.sessions_between(start, end))
+
+
+def load_trading_calendar(path=None):
+    """建立交易日曆，並併入 TRADING_CALENDAR_FILE 中的臨時休市與特殊收盤時間"""
+    path = path or os.environ.get('TRADING_CALENDAR_FILE')
+    holidays = set(TWSE_HOLIDAYS)
+    half_days = {}
+    if path:
+        try:
+            with open(path, encoding='utf-8') as f:
+                extra = json.load(f)
+            holidays.update(date.fromisoformat(d) for d in extra.get('holidays', []))
+            half_days = {date.fromisoformat(d): time.fromisoformat(t) for d, t in extra.get('half_days', {}).items()}
+            logger.info(f"已載入交易日曆補充檔 {path}")
+        except FileNotFoundError:
+            logger.warning(f"交易日曆補充檔 {path} 不存在，使用內建休市表")
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"交易日曆補充檔 {path} 格式錯誤，使用內建休市表: {e}")
+    return TradingCalendar(holidays, half_days)
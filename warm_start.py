@@ -0,0 +1,48 @@
+"""暖啟動檔案
+
+每次更新後把市場快照、更新時間、資料日期、證交所驗證資訊與最新篩選結果
+以gzip壓縮的JSON原子寫入本地檔案。gunicorn worker 重新啟動（max_requests回收或重新部署）後
+第一次收到請求時讀回，不需要任何網路請求就能提供完整資料。
+"""
+import gzip
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+WARM_START_VERSION = 1
+
+DEFAULT_WARM_START_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'warm_start.json.gz')
+
+
+def save_warm_start(path, state):
+    """以暫存檔加 os.replace 原子寫入暖啟動狀態"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+            f.write(json.dumps({'version': WARM_START_VERSION, **state}, ensure_ascii=False).encode('utf-8'))
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_warm_start(path):
+    """讀取暖啟動狀態，檔案不存在、損毀或版本不符時回傳None"""
+    try:
+        with gzip.open(path, 'rb') as f:
+            state = json.loads(f.read().decode('utf-8'))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, EOFError) as e:
+        logger.warning(f"暖啟動檔 {path} 無法讀取，忽略: {e}")
+        return None
+
+    if state.get('version') != WARM_START_VERSION:
+        logger.warning(f"暖啟動檔版本 {state.get('version')} 不符，忽略")
+        return None
+    return state
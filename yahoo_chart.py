@@ -0,0 +1,72 @@
+"""Yahoo Finance chart API 的共用URL與回應解析"""
+from datetime import datetime
+
+YAHOO_CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/{symbol}"
+
+MARKET_TWSE = 'TWSE'  # 上市
+MARKET_TPEX = 'TPEX'  # 上櫃
+YAHOO_SUFFIXES = {MARKET_TWSE: '.TW', MARKET_TPEX: '.TWO'}
+
+# {股票代碼: 市場}，由最新的市場快照整批替換；未登記的代碼視為上市
+_stock_markets = {}
+
+
+def register_stock_markets(stocks):
+    """以 {股票代碼: 即時資料} 更新各股票所屬市場"""
+    global _stock_markets
+    _stock_markets = {code: stock.get('market', MARKET_TWSE) for code, stock in stocks.items()}
+
+
+def get_stock_market(stock_code):
+    return _stock_markets.get(stock_code, MARKET_TWSE)
+
+
+def get_yahoo_symbol(stock_code, market=None):
+    """台股代碼轉為Yahoo代號（上市 .TW、上櫃 .TWO）"""
+    return f"{stock_code}{YAHOO_SUFFIXES[market or get_stock_market(stock_code)]}"
+
+
+def get_chart_url(stock_code):
+    return YAHOO_CHART_URL.format(symbol=get_yahoo_symbol(stock_code))
+
+
+def get_chart_params(fetch_range='3mo'):
+    return {
+        'range': fetch_range,
+        'interval': '1d',
+        'includeAdjustedClose': 'true'
+    }
+
+
+def parse_chart_result(result):
+    """將 chart.result[0] 轉為OHLC清單，略過任一價格為空的K棒"""
+    if 'timestamp' not in result or 'indicators' not in result:
+        return []
+
+    timestamps = result['timestamp']
+    quotes = result['indicators']['quote'][0]
+
+    ohlc_data = []
+    for i in range(len(timestamps)):
+        if (quotes['open'][i] is not None and
+            quotes['high'][i] is not None and
+            quotes['low'][i] is not None and
+            quotes['close'][i] is not None):
+
+            ohlc_data.append({
+                'date': datetime.fromtimestamp(timestamps[i]).strftime('%Y-%m-%d'),
+                'open': quotes['open'][i],
+                'high': quotes['high'][i],
+                'low': quotes['low'][i],
+                'close': quotes['close'][i],
+                'volume': quotes['volume'][i] if quotes['volume'][i] else 0
+            })
+    return ohlc_data
+
+
+def parse_chart_response(data):
+    """解析完整的chart API回應，格式不符時回傳None"""
+    if (data and 'chart' in data and 'result' in data['chart'] and
+        data['chart']['result'] and len(data['chart']['result']) > 0):
+        return parse_chart_result(data['chart']['result'][0])
+    return None